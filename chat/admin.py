@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import User, Question, ChatLog, Prompt
+from django.utils.html import format_html_join
+from .chat_log_archive import decode_chat_logs
+from .models import User, Question, ChatLog, ChatLogArchive, Prompt, ReEngagementRun, JobLease, ReEngagementDraft, LLMUsage
 
 admin.site.register(User)
 
@@ -25,4 +27,50 @@ class PromptAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',),
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(ReEngagementRun)
+class ReEngagementRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'finished_at', 'due_users', 'sent_count', 'skipped_count', 'failed_count', 'completed_users')
+    readonly_fields = [field.name for field in ReEngagementRun._meta.fields]
+
+@admin.register(JobLease)
+class JobLeaseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'run_id', 'acquired_at', 'expires_at')
+
+@admin.register(ReEngagementDraft)
+class ReEngagementDraftAdmin(admin.ModelAdmin):
+    list_display = ('user', 'stage_index', 'status', 'batch_id', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('user__user_id', 'batch_id')
+
+@admin.register(LLMUsage)
+class LLMUsageAdmin(admin.ModelAdmin):
+    list_display = ('day', 'call_type', 'model', 'calls', 'prompt_tokens', 'cached_tokens', 'cached_share', 'completion_tokens')
+    list_filter = ('call_type', 'model')
+    date_hierarchy = 'day'
+    readonly_fields = [field.name for field in LLMUsage._meta.fields]
+
+    @admin.display(description='Cached')
+    def cached_share(self, obj):
+        return f"{obj.cache_hit_rate:.0%}"
+
+@admin.register(ChatLogArchive)
+class ChatLogArchiveAdmin(admin.ModelAdmin):
+    list_display = ('user', 'month', 'chunk', 'log_count', 'codec', 'compressed_size', 'created_at')
+    list_filter = ('codec',)
+    search_fields = ('user__user_id',)
+    exclude = ('data',)
+    readonly_fields = ('user', 'month', 'chunk', 'codec', 'log_count', 'first_log_id', 'last_log_id',
+                       'first_timestamp', 'last_timestamp', 'created_at', 'messages')
+
+    @admin.display(description='Compressed size (bytes)')
+    def compressed_size(self, obj):
+        return len(obj.data)
+
+    @admin.display(description='Messages')
+    def messages(self, obj):
+        return format_html_join(
+            '', '<p><strong>{} {}</strong><br>{}</p>',
+            ((log.timestamp, log.sender_type, log.message_content) for log in decode_chat_logs(obj)),
+        )
@@ -2,16 +2,115 @@ import os
 import openai
 import logging
 from django.conf import settings
-from chat.utils import get_prompt, reset_gpt_5_2_usage_if_new_day # Import the new utility function
+from chat.utils import get_prompt
+from chat.quotas import consume_quota
 from chat.models import User # Import the User model
+from chat.request_context import get_context_user
+from chat.llm_backends import get_llm_backend
+from chat.context_builder import build_context, pack_prompt_context
+from chat.prompt_layout import build_prompt_messages, get_prompt_prefix, prompt_cache_key
+from chat.llm_usage import record_llm_usage
 import json
+import hashlib
+import threading
+from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
+RE_ENGAGEMENT_MODEL = "gpt-5-mini"
+GENERAL_BOT_QUOTA = "gpt-5.2" # Key of settings.AI_MODEL_QUOTAS
+
+# Singleflight: identical completion requests in flight at the same time share one upstream call.
+_inflight_completions = {}
+_inflight_lock = threading.Lock()
+
+class _InflightCompletion:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+class SharedCompletionError(openai.OpenAIError):
+    """Raised in callers that waited on an identical in-flight request whose upstream call failed."""
+
+def _completion_key(request):
+    """Key for a completion request: a hash of the model, messages and every other option."""
+    payload = json.dumps(request, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _call_upstream(call_type, request):
+    response = get_llm_backend().create_completion(**request)
+    if call_type:
+        record_llm_usage(call_type, request.get('model'), response)
+    return response
+
+def _create_completion(call_type=None, **request):
+    """
+    Calls the configured LLM backend (see chat.llm_backends), coalescing concurrent identical requests:
+    the first caller makes the upstream call and the others in this process wait for
+    and share its response (or exception). With settings.LLM_SINGLEFLIGHT_CACHE_TTL > 0
+    the response is also kept in the shared cache for that many seconds, so identical
+    requests from other processes in that window reuse it.
+    Waiting callers give up after settings.LLM_SINGLEFLIGHT_WAIT_SECONDS and make their own call.
+    With a call_type (the prompt category), the request gets a prompt_cache_key for its stable
+    prefix (see chat.prompt_layout) and the upstream call's token usage is recorded (chat.llm_usage).
+    """
+    if call_type and getattr(settings, 'LLM_PROMPT_CACHE_KEYS', True):
+        request.setdefault('prompt_cache_key', prompt_cache_key(call_type, request['messages']))
+    key = _completion_key(request)
+    cache_ttl = getattr(settings, 'LLM_SINGLEFLIGHT_CACHE_TTL', 0)
+    cache_key = f"llm:completion:{key}"
+    if cache_ttl:
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            logger.info(f"Reusing cached completion for identical {request.get('model')} request.")
+            return cached_response
+
+    with _inflight_lock:
+        inflight = _inflight_completions.get(key)
+        is_leader = inflight is None
+        if is_leader:
+            inflight = _inflight_completions[key] = _InflightCompletion()
+
+    if not is_leader:
+        logger.info(f"Joining in-flight identical {request.get('model')} request.")
+        if not inflight.done.wait(getattr(settings, 'LLM_SINGLEFLIGHT_WAIT_SECONDS', 30)):
+            logger.warning(f"In-flight identical {request.get('model')} request is taking too long. Calling upstream directly.")
+            return _call_upstream(call_type, request)
+        if inflight.error is not None:
+            # A new exception per caller: re-raising the leader's object would share (and grow) its traceback
+            raise SharedCompletionError(f"Shared {request.get('model')} request failed: {inflight.error}") from inflight.error
+        return inflight.response
+
+    try:
+        inflight.response = _call_upstream(call_type, request)
+        if cache_ttl:
+            try:
+                cache.set(cache_key, inflight.response, cache_ttl)
+            except Exception as e:
+                logger.warning(f"Could not cache completion response: {e}")
+        return inflight.response
+    except BaseException as e:
+        inflight.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_completions.pop(key, None)
+        inflight.done.set()
+
 class AIIntegration:
     def __init__(self):
         pass
 
+    def _prompt_messages(self, call_type, user_prompt_name, prompt_context, prefix_names=None):
+        """
+        Builds the messages for a call: the call type's stable prefix prompts (chat.prompt_layout),
+        or prefix_names, followed by the user prompt template formatted with prompt_context.
+        """
+        prefix = [get_prompt(name=name, category=call_type) for name in (prefix_names or get_prompt_prefix(call_type))]
+        user_prompt = get_prompt(name=user_prompt_name, category=call_type).format(**prompt_context)
+        return build_prompt_messages(prefix, user_prompt)
+
     def generate_chat_response(self, user_id, system_prompt_name, user_prompt_name, prompt_category, prompt_context, model="gpt-5-mini"):
         """
         Generates a general chat response using a specified AI model and prompts.
@@ -19,47 +118,43 @@ class AIIntegration:
         :param system_prompt_name: The name of the system prompt to retrieve.
         :param user_prompt_name: The name of the user prompt template to retrieve.
         :param prompt_category: The category for prompt retrieval.
-        :param prompt_context: A dictionary with values to format the user prompt.
+        :param prompt_context: A dictionary with values to format the user prompt. Its 'conversation_history'
+                               may be a list of turns; see chat.context_builder.pack_prompt_context.
         :param model: The AI model to use (defaults to gpt-5-mini).
         :return: A string containing the AI's response, or None if an error occurs.
         """
         logger.info(f"Generating chat response for user {user_id} using prompts {system_prompt_name}, {user_prompt_name} in category {prompt_category}")
         
-        user = None
-        try:
-            user = User.objects.get(user_id=user_id)
-        except User.DoesNotExist:
-            logger.error(f"User with ID {user_id} not found during chat response generation.")
-            return None
+        # Reuse the User already loaded by the calling task, if any
+        user = get_context_user(user_id)
+        if user is None:
+            try:
+                user = User.objects.get(user_id=user_id)
+            except User.DoesNotExist:
+                logger.error(f"User with ID {user_id} not found during chat response generation.")
+                return None
 
         # --- GPT-5.2 Usage Limit Logic for GENERAL_BOT ---
         if user.current_stage == 'GENERAL_BOT':
-            reset_gpt_5_2_usage_if_new_day(user) # Reset count if new day
-
-            if user.gpt_5_2_daily_count < 10:
+            # Daily limits live in settings.AI_MODEL_QUOTAS and are counted outside the User row
+            if consume_quota(GENERAL_BOT_QUOTA, user_id=user_id):
                 model = "gpt-5.2"
-                user.gpt_5_2_daily_count += 1
-                user.save() # Save the updated count
-                logger.info(f"User {user_id}: Using gpt-5.2. Daily count: {user.gpt_5_2_daily_count}")
+                logger.info(f"User {user_id}: Using gpt-5.2.")
             else:
                 model = "gpt-5-mini" # Fallback
                 logger.info(f"User {user_id}: GPT-5.2 daily limit reached. Falling back to gpt-5-mini.")
         # --- End GPT-5.2 Usage Limit Logic ---
         
         try:
-            system_prompt = get_prompt(name=system_prompt_name, category=prompt_category)
-            user_prompt_template = get_prompt(name=user_prompt_name, category=prompt_category)
-            
-            # Format the user prompt with the provided context
-            formatted_user_prompt = user_prompt_template.format(**prompt_context)
-
+            # Fit the summary, history and message into the category's token budget, then format the user prompt
+            messages = self._prompt_messages(
+                prompt_category, user_prompt_name, pack_prompt_context(prompt_category, prompt_context), prefix_names=(system_prompt_name,)
+            )
 
-            response = openai.chat.completions.create(
+            response = _create_completion(
+                call_type=prompt_category,
                 model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": formatted_user_prompt}
-                ],
+                messages=messages,
             )
             reply = response.choices[0].message.content.strip()
             logger.info(f"Generated chat response: {reply}")
@@ -82,12 +177,10 @@ class AIIntegration:
         # Placeholder for actual AI call
         try:
             # Example: Use OpenAI's chat completion for a quick reply
-            response = openai.chat.completions.create(
+            response = _create_completion(
+                call_type='QUICK_REPLY',
                 model="gpt-5-mini", # Or a more "nano" model if available and suitable
-                messages=[
-                    {"role": "system", "content": get_prompt(name='QUICK_REPLY_SYSTEM_PROMPT', category='QUICK_REPLY')},
-                    {"role": "user", "content": get_prompt(name='QUICK_REPLY_USER_PROMPT_TEMPLATE', category='QUICK_REPLY').format(conversation_history=conversation_history)}
-                ],
+                messages=self._prompt_messages('QUICK_REPLY', 'QUICK_REPLY_USER_PROMPT_TEMPLATE', {'conversation_history': conversation_history}),
             )
             reply = response.choices[0].message.content.strip()
             logger.info(f"Generated quick reply: {reply}")
@@ -103,22 +196,22 @@ class AIIntegration:
         """
         Summarizes a chunk of conversation, optionally merging with an existing summary.
         :param user_id: The ID of the user.
-        :param conversation_chunk: A list of messages to summarize.
+        :param conversation_chunk: The formatted messages to summarize, as a list, oldest first.
         :param existing_summary: An optional existing summary to merge with.
-        :return: A concise summary of the conversation.
+        :return: A concise summary of the conversation, or None if it could not be generated.
         """
         logger.info(f"Summarizing conversation for user {user_id}. Chunk: {conversation_chunk}")
         # Placeholder for actual AI call
         try:
-            prompt_messages = [
-                {"role": "system", "content": get_prompt(name='SUMMARIZE_SYSTEM_PROMPT', category='SUMMARIZATION')},
-            ]
+            context = build_context('SUMMARIZATION', turns=conversation_chunk, summary=existing_summary)
+            existing_summary, conversation_chunk = context.summary, context.conversation_history
             if existing_summary:
-                prompt_messages.append({"role": "user", "content": get_prompt(name='SUMMARIZE_USER_PROMPT_WITH_EXISTING_SUMMARY_TEMPLATE', category='SUMMARIZATION').format(existing_summary=existing_summary, conversation_chunk=conversation_chunk)})
+                prompt_messages = self._prompt_messages('SUMMARIZATION', 'SUMMARIZE_USER_PROMPT_WITH_EXISTING_SUMMARY_TEMPLATE', {'existing_summary': existing_summary, 'conversation_chunk': conversation_chunk})
             else:
-                prompt_messages.append({"role": "user", "content": get_prompt(name='SUMMARIZE_USER_PROMPT_WITHOUT_EXISTING_SUMMARY_TEMPLATE', category='SUMMARIZATION').format(conversation_chunk=conversation_chunk)})
+                prompt_messages = self._prompt_messages('SUMMARIZATION', 'SUMMARIZE_USER_PROMPT_WITHOUT_EXISTING_SUMMARY_TEMPLATE', {'conversation_chunk': conversation_chunk})
 
-            response = openai.chat.completions.create(
+            response = _create_completion(
+                call_type='SUMMARIZATION',
                 model="gpt-5-mini",
                 messages=prompt_messages,
             )
@@ -127,10 +220,10 @@ class AIIntegration:
             return summary
         except openai.OpenAIError as e:
             logger.error(f"OpenAI API error during conversation summarization: {e}")
-            return "I'm sorry, I couldn't summarize the conversation at the moment."
+            return None
         except Exception as e:
             logger.error(f"Unexpected error during conversation summarization: {e}")
-            return "An unexpected error occurred."
+            return None
 
     def grade_exam_answer(self, user_id, question_text, user_answer, expected_answer):
         """
@@ -145,13 +238,11 @@ class AIIntegration:
         # Placeholder for actual AI call
         try:
             # Construct a detailed prompt for grading
-            prompt = get_prompt(name='GRADE_EXAM_USER_PROMPT_TEMPLATE', category='EXAM_GRADING').format(question_text=question_text, user_answer=user_answer, expected_answer=expected_answer)
-            response = openai.chat.completions.create(
+            messages = self._prompt_messages('EXAM_GRADING', 'GRADE_EXAM_USER_PROMPT_TEMPLATE', {'question_text': question_text, 'user_answer': user_answer, 'expected_answer': expected_answer})
+            response = _create_completion(
+                call_type='EXAM_GRADING',
                 model="gpt-5.2", # Use a more capable model for grading
-                messages=[
-                    {"role": "system", "content": get_prompt(name='GRADE_EXAM_SYSTEM_PROMPT', category='EXAM_GRADING')},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=messages,
                 max_completion_tokens=500,
                 response_format={"type": "json_object"}
             )
@@ -170,6 +261,21 @@ class AIIntegration:
             logger.error(f"Unexpected error during exam grading: {e}")
             return {"error": "An unexpected error occurred."}
 
+    def build_re_engagement_messages(self, first_name, current_stage, user_summary, conversation_history):
+        """
+        Builds the chat messages for a re-engagement prompt. Shared by live generation
+        and the offline pre-generation in chat.re_engagement_drafts.
+        The summary and history are packed into the RE_ENGAGEMENT token budget (chat.context_builder).
+        :return: A list of message dicts for the chat completions API.
+        """
+        context = build_context('RE_ENGAGEMENT', turns=conversation_history or (), summary=user_summary)
+        return self._prompt_messages('RE_ENGAGEMENT', 'RE_ENGAGEMENT_USER_PROMPT_TEMPLATE', {
+            'first_name': first_name if first_name else "there",
+            'current_stage': current_stage,
+            'user_summary': context.summary if context.summary else "No summary available.",
+            'conversation_history': context.conversation_history if context.turns else "No recent conversation history.",
+        })
+
     def generate_re_engagement_message(self, user_id, first_name, current_stage, user_summary, conversation_history):
         """
         Generates a re-engagement message using a general AI model.
@@ -177,23 +283,15 @@ class AIIntegration:
         :param first_name: The first name of the user.
         :param current_stage: The current stage of the user (e.g., ONBOARDING, MARKETING).
         :param user_summary: The AI-generated summary of the user's persona and history.
-        :param conversation_history: A formatted string of recent conversation history.
+        :param conversation_history: Recent formatted conversation turns, as a list, oldest first.
         :return: A generated re-engagement message.
         """
         logger.info(f"Generating re-engagement message for user {user_id} in stage {current_stage}")
         try:
-            user_prompt = get_prompt(name='RE_ENGAGEMENT_USER_PROMPT_TEMPLATE', category='RE_ENGAGEMENT').format(
-                first_name=first_name if first_name else "there",
-                current_stage=current_stage,
-                user_summary=user_summary if user_summary else "No summary available.",
-                conversation_history=conversation_history if conversation_history else "No recent conversation history."
-            )
-            response = openai.chat.completions.create(
-                model="gpt-5-mini",
-                messages=[
-                    {"role": "system", "content": get_prompt(name='RE_ENGAGEMENT_SYSTEM_PROMPT', category='RE_ENGAGEMENT')},
-                    {"role": "user", "content": user_prompt}
-                ],
+            response = _create_completion(
+                call_type='RE_ENGAGEMENT',
+                model=RE_ENGAGEMENT_MODEL,
+                messages=self.build_re_engagement_messages(first_name, current_stage, user_summary, conversation_history),
             )
             message = response.choices[0].message.content.strip()
             logger.info(f"Generated re-engagement message for {user_id}: {message}")
@@ -211,39 +309,27 @@ class AIIntegration:
         :param user: The User object for whom to generate the assessment.
         :return: A string containing the AI-generated strength assessment.
         """
-        from chat.models import ExamResult, Question # Import locally to avoid circular dependency
+        from chat.models import UserCategoryScore # Import locally to avoid circular dependency
         logger.info(f"Generating strength assessment for user {user.user_id}")
 
-        exam_results = ExamResult.objects.filter(user=user).select_related('question')
-        if not exam_results.exists():
+        # Per-category totals are maintained incrementally whenever an ExamResult is saved
+        category_scores = UserCategoryScore.objects.filter(user=user, result_count__gt=0)
+        categorized_scores_list = [
+            f"- {category_score.category} (Avg Score: {category_score.average_score:.1f})"
+            for category_score in category_scores
+        ]
+        if not categorized_scores_list:
             return "You haven't completed any mock exam questions yet. Complete an exam to get a personalized strength assessment!"
-
-        # Aggregate scores by category
-        category_scores = {}
-        for result in exam_results:
-            category = result.question.category
-            if category not in category_scores:
-                category_scores[category] = {'total_score': 0, 'count': 0}
-            category_scores[category]['total_score'] += result.score
-            category_scores[category]['count'] += 1
-
-        categorized_scores_list = []
-        for category, data in category_scores.items():
-            avg_score = data['total_score'] / data['count']
-            categorized_scores_list.append(f"- {category} (Avg Score: {avg_score:.1f})")
         
         categorized_scores_str = "\n".join(categorized_scores_list)
         logger.info(f"Categorized scores for user {user.user_id}:\n{categorized_scores_str}")
 
         try:
-            user_prompt = get_prompt(name='ASSESSMENT_USER_PROMPT_TEMPLATE', category='ASSESSMENT').format(categorized_scores=categorized_scores_str)
-            messages_to_send = [
-                {"role": "system", "content": get_prompt(name='ASSESSMENT_SYSTEM_PROMPT', category='ASSESSMENT')},
-                {"role": "user", "content": user_prompt}
-            ]
+            messages_to_send = self._prompt_messages('ASSESSMENT', 'ASSESSMENT_USER_PROMPT_TEMPLATE', {'categorized_scores': categorized_scores_str})
             logger.info("Sending prompt to OpenAI for strength assessment")
 
-            response = openai.chat.completions.create(
+            response = _create_completion(
+                call_type='ASSESSMENT',
                 model="gpt-5.2", # Use a more capable model for detailed assessment
                 messages=messages_to_send,
                 max_completion_tokens=500, # Allow for a comprehensive assessment
@@ -266,12 +352,10 @@ class AIIntegration:
         """
         logger.info(f"Attempting to extract name from message: {message_text}")
         try:
-            response = openai.chat.completions.create(
+            response = _create_completion(
+                call_type='NAME_EXTRACTION',
                 model="gpt-5.2", # Upgraded model for improved name extraction
-                messages=[
-                    {"role": "system", "content": get_prompt(name='NAME_EXTRACTION_SYSTEM_PROMPT', category='NAME_EXTRACTION')},
-                    {"role": "user", "content": get_prompt(name='NAME_EXTRACTION_USER_PROMPT_TEMPLATE', category='NAME_EXTRACTION').format(message_text=message_text)}
-                ],
+                messages=self._prompt_messages('NAME_EXTRACTION', 'NAME_EXTRACTION_USER_PROMPT_TEMPLATE', {'message_text': message_text}),
                 max_completion_tokens=20 # A name should not be very long
             )
             extracted_name = response.choices[0].message.content
@@ -9,6 +9,7 @@ class ChatConfig(AppConfig):
     name = 'chat'
 
     def ready(self):
+        from . import signals # Register model signal receivers
         if hasattr(settings, 'OPEN_AI_TOKEN') and settings.OPEN_AI_TOKEN:
             openai.api_key = settings.OPEN_AI_TOKEN
             logger.info("OPEN_AI_TOKEN set from Django settings in ChatConfig.ready().")
@@ -0,0 +1,104 @@
+import abc
+import io
+import json
+import logging
+import uuid
+import openai
+from .llm_backends import get_llm_backend
+
+logger = logging.getLogger(__name__)
+
+class BatchBackend(abc.ABC):
+    """
+    Runs many chat completion requests as one bulk job.
+    Each request is a dict with 'custom_id', 'model' and 'messages'.
+    Results map custom_id to the generated text, or None when that request failed.
+    """
+
+    @abc.abstractmethod
+    def submit(self, requests):
+        """
+        Submits the requests.
+        :return: (batch_id, results) where results is None if the job finishes later
+                 (fetch them with poll) or the results dict if it completed immediately.
+        """
+
+    @abc.abstractmethod
+    def poll(self, batch_id):
+        """
+        :return: The results dict once the job has finished, otherwise None.
+        """
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    Uses the OpenAI Batch API (asynchronous, up to 24 hours, at batch pricing).
+    """
+    endpoint = '/v1/chat/completions'
+    completion_window = '24h'
+    failed_statuses = ('failed', 'expired', 'cancelled')
+
+    def submit(self, requests):
+        lines = [
+            json.dumps({
+                'custom_id': request['custom_id'],
+                'method': 'POST',
+                'url': self.endpoint,
+                'body': {'model': request['model'], 'messages': request['messages']},
+            })
+            for request in requests
+        ]
+        input_file = openai.files.create(
+            file=('re_engagement_batch.jsonl', io.BytesIO('\n'.join(lines).encode('utf-8'))),
+            purpose='batch',
+        )
+        batch = openai.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+        )
+        logger.info(f"Submitted OpenAI batch {batch.id} with {len(requests)} requests.")
+        return batch.id, None
+
+    def poll(self, batch_id):
+        batch = openai.batches.retrieve(batch_id)
+        if batch.status in self.failed_statuses:
+            logger.error(f"OpenAI batch {batch_id} ended with status {batch.status}.")
+            return {}
+        if batch.status != 'completed':
+            return None
+
+        results = {}
+        if batch.output_file_id:
+            for line in openai.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                try:
+                    content = record['response']['body']['choices'][0]['message']['content']
+                    results[record['custom_id']] = content.strip() if content else None
+                except (KeyError, IndexError, TypeError):
+                    logger.error(f"Unexpected result in OpenAI batch {batch_id} for {record.get('custom_id')}: {record.get('error')}")
+                    results[record['custom_id']] = None
+        return results
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Stand-in that runs each request right away through the configured LLM backend.
+    Useful for development, tests, and accounts without Batch API access.
+    """
+
+    def submit(self, requests):
+        results = {}
+        for request in requests:
+            try:
+                response = get_llm_backend().create_completion(model=request['model'], messages=request['messages'])
+                results[request['custom_id']] = response.choices[0].message.content.strip()
+            except openai.OpenAIError as e:
+                logger.error(f"OpenAI API error in local batch for {request['custom_id']}: {e}")
+                results[request['custom_id']] = None
+        return f"local-{uuid.uuid4()}", results
+
+    def poll(self, batch_id):
+        return {} # Local batches complete on submit
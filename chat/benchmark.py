@@ -0,0 +1,264 @@
+import json
+import logging
+import platform
+import statistics
+import threading
+import time
+from unittest.mock import patch
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from . import llm_usage
+from .fake_graph_api import FakeGraphAPIServer, webhook_event_payload
+from .messenger_api import clear_reachability_cache
+from .models import User, Question, LLMUsage
+from .quotas import purge_user_quota_counters
+from .task_queue import local_worker_pool
+from .tasks import process_messenger_message
+from .views import webhook_callback
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['ONBOARDING', 'MARKETING', 'MOCK_EXAM', 'GENERAL_BOT']
+
+STAGE_MESSAGES = {
+    'ONBOARDING': "Hi! I'm Juan Dela Cruz.",
+    'MARKETING': "How does the review program work?",
+    'MOCK_EXAM': "The contract is voidable because consent was vitiated by fraud under Article 1390.",
+    'GENERAL_BOT': "Can you explain the doctrine of piercing the corporate veil?",
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100)) # ceil(n * pct / 100)
+    return ordered[int(rank) - 1]
+
+
+def _distribution(values):
+    values = list(values)
+    return {
+        'count': len(values),
+        'mean': round(statistics.fmean(values), 2) if values else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+class _QueryRecorder:
+    """Counts queries (and time spent in SELECT ... FOR UPDATE) per sender, across threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.lock_wait = {}
+        self.local = threading.local()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            sender_id = getattr(self.local, 'sender_id', None)
+            with self.lock:
+                self.queries[sender_id] = self.queries.get(sender_id, 0) + 1
+                if 'FOR UPDATE' in sql.upper():
+                    self.lock_wait[sender_id] = self.lock_wait.get(sender_id, 0) + elapsed_ms
+
+    def attributed_to(self, sender_id):
+        recorder = self
+
+        class _Scope:
+            def __enter__(self):
+                self.previous = getattr(recorder.local, 'sender_id', None)
+                recorder.local.sender_id = sender_id
+                self.wrapper = connection.execute_wrapper(recorder)
+                self.wrapper.__enter__()
+
+            def __exit__(self, *exc_info):
+                self.wrapper.__exit__(*exc_info)
+                recorder.local.sender_id = self.previous
+
+        return _Scope()
+
+
+def _sender_of(func, args):
+    if func is process_messenger_message and args:
+        return args[0].get('sender', {}).get('id')
+    return None
+
+
+def _seed_users(prefix, messages_per_stage):
+    """Creates the synthetic users (ONBOARDING users are created by the pipeline itself)."""
+    created_questions = []
+    questions = list(Question.objects.exclude(expected_answer='')[:10])
+    if not questions:
+        created_questions = [
+            Question.objects.create(
+                category='CIVIL_LAW',
+                question_text=f"Benchmark question {i + 1}: Discuss the requisites of a valid contract.",
+                expected_answer="Consent, object certain, and cause of the obligation (Article 1318).",
+            )
+            for i in range(3)
+        ]
+        questions = created_questions
+
+    senders = []
+    for stage in STAGES:
+        for i in range(messages_per_stage):
+            user_id = f"{prefix}{stage.lower()}-{i}"
+            senders.append((stage, user_id))
+            if stage == 'ONBOARDING':
+                continue
+            User.objects.create(
+                user_id=user_id,
+                first_name='Bench',
+                academic_status='Law graduate',
+                current_stage=stage,
+                # GENERAL_BOT users past their welcome message, so their message is a real query
+                exam_question_counter=(i % 8) + 1 if stage == 'MOCK_EXAM' else -1 if stage == 'GENERAL_BOT' else 0,
+                last_question_id_asked=questions[i % len(questions)] if stage == 'MOCK_EXAM' else None,
+                last_interaction_timestamp=timezone.now(),
+            )
+    return senders, created_questions
+
+
+_add_llm_usage = llm_usage._add_usage
+
+
+class _UsageRecorder:
+    """Collects the LLMUsage increments made while the benchmark runs, across worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.usage = {}
+
+    def __call__(self, day, call_type, model, usage):
+        with self.lock:
+            totals = self.usage.setdefault((day, call_type, model), dict.fromkeys(llm_usage.USAGE_FIELDS, 0))
+            totals['calls'] += 1
+            for field, value in usage.items():
+                totals[field] += value
+        return _add_llm_usage(day, call_type, model, usage)
+
+
+def _cleanup(prefix, created_questions, usage_recorder):
+    """
+    Deletes the synthetic users and questions, and takes the benchmark's share back out of
+    the counters it has in common with real traffic: the global quota counters and LLMUsage.
+    """
+    purge_user_quota_counters(prefix)
+    for (day, call_type, model), totals in usage_recorder.usage.items():
+        LLMUsage.objects.filter(day=day, call_type=call_type, model=model).update(
+            **{field: F(field) - value for field, value in totals.items()})
+    LLMUsage.objects.filter(calls__lte=0).delete()
+
+    User.objects.filter(user_id__startswith=prefix).delete()
+    for question in created_questions:
+        question.delete()
+
+
+def run_pipeline_benchmark(messages_per_stage=10, workers=4, llm_simulation=None, graph_latency_ms=0,
+                           arrival_interval_ms=0, label='', prefix='bench-'):
+    """
+    Drives chat.views.webhook_callback with one synthetic message per user across all
+    four stages, runs the queued tasks on a local worker pool, and measures the whole
+    pipeline against the simulated LLM backend and a FakeGraphAPIServer.
+    Synthetic users (ids starting with prefix) are deleted afterwards, and their quota and
+    LLM usage is subtracted from the shared counters.
+    :return: A JSON-serializable results dict.
+    """
+    llm_simulation = llm_simulation if llm_simulation is not None else {'latency_ms': {'distribution': 'fixed', 'median': 0, 'min': 0}, 'tokens_per_second': 0}
+    factory = RequestFactory()
+    recorder = _QueryRecorder()
+    usage_recorder = _UsageRecorder()
+    ingress_at = {}
+    errors = []
+
+    def run_task(func, args, kwargs):
+        with recorder.attributed_to(_sender_of(func, args)):
+            return func(*args, **kwargs)
+
+    senders, created_questions = _seed_users(prefix, messages_per_stage)
+    clear_reachability_cache()
+    try:
+        with patch.object(llm_usage, '_add_usage', usage_recorder), \
+                FakeGraphAPIServer(latency_ms=graph_latency_ms) as graph_api, override_settings(
+            LLM_BACKEND='chat.llm_backends.SimulatedLLMBackend',
+            LLM_SIMULATION=llm_simulation,
+            FACEBOOK_GRAPH_API_URL=graph_api.messages_url,
+            FACEBOOK_PAGE_ACCESS_TOKEN=settings.FACEBOOK_PAGE_ACCESS_TOKEN or 'benchmark-token',
+        ):
+            started = time.monotonic()
+            with local_worker_pool(workers, wrap_task=run_task):
+                for sequence, (stage, sender_id) in enumerate(senders):
+                    payload = json.dumps(webhook_event_payload(sender_id, STAGE_MESSAGES[stage], f"m_bench_{sequence}", page_id='BENCHMARK_PAGE'))
+                    ingress_at[sender_id] = time.monotonic()
+                    with recorder.attributed_to(sender_id):
+                        response = webhook_callback(factory.post('/chat/webhook/', data=payload, content_type='application/json'))
+                    if response.status_code != 200:
+                        errors.append({'sender_id': sender_id, 'status': response.status_code})
+                    if arrival_interval_ms:
+                        time.sleep(arrival_interval_ms / 1000)
+            duration = time.monotonic() - started
+            graph_events = list(graph_api.events)
+            graph_report = graph_api.report()
+            graph_started_at = graph_api.started_at
+    finally:
+        _cleanup(prefix, created_questions, usage_recorder)
+
+    last_delivery = {}
+    for event in graph_events:
+        if 'text' in event:
+            last_delivery[event['recipient_id']] = graph_started_at + event['received_at']
+
+    latencies = {}
+    for stage, sender_id in senders:
+        if sender_id in last_delivery:
+            latencies.setdefault(stage, []).append(round((last_delivery[sender_id] - ingress_at[sender_id]) * 1000, 2))
+    all_latencies = [value for values in latencies.values() for value in values]
+    per_message_queries = [recorder.queries.get(sender_id, 0) for _, sender_id in senders]
+    total_queries = sum(recorder.queries.values())
+    total_lock_wait = sum(recorder.lock_wait.values())
+
+    return {
+        'label': label,
+        'recorded_at': timezone.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'mock_exam_pipelined_grading': getattr(settings, 'MOCK_EXAM_PIPELINED_GRADING', False),
+        },
+        'config': {
+            'messages_per_stage': messages_per_stage,
+            'workers': workers,
+            'llm_simulation': llm_simulation,
+            'graph_latency_ms': graph_latency_ms,
+            'arrival_interval_ms': arrival_interval_ms,
+        },
+        'messages': len(senders),
+        'delivered': len(all_latencies),
+        'duration_seconds': round(duration, 3),
+        'throughput_messages_per_second': round(len(senders) / duration, 2) if duration else None,
+        'latency_ms': _distribution(all_latencies),
+        'latency_ms_by_stage': {stage: _distribution(values) for stage, values in latencies.items()},
+        'db_queries': {
+            'total': total_queries,
+            'per_message': _distribution(per_message_queries),
+            'unattributed': recorder.queries.get(None, 0), # Background tasks not tied to one incoming message
+        },
+        'lock_wait_ms': {
+            'total': round(total_lock_wait, 2),
+            'per_message_mean': round(total_lock_wait / len(senders), 2) if senders else None,
+        },
+        'graph_api': {key: graph_report[key] for key in ('messages', 'sender_actions', 'throttled', 'unreachable')},
+        'errors': errors,
+    }
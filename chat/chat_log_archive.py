@@ -0,0 +1,222 @@
+import gzip
+import json
+import logging
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+from .leases import acquire_lease, renew_lease, release_lease
+from .models import User, ChatLog, ChatLogArchive
+from .task_queue import enqueue_task
+
+try:
+    import zstandard
+except ImportError: # Optional; gzip is used without it
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVAL_LEASE_NAME = 'archive_chat_logs'
+
+
+def _archive_codec():
+    codec = getattr(settings, 'CHAT_LOG_ARCHIVE_CODEC', 'gzip')
+    if codec == 'zstd' and zstandard is None:
+        logger.warning("CHAT_LOG_ARCHIVE_CODEC is 'zstd' but the zstandard package isn't installed. Using gzip.")
+        return 'gzip'
+    return codec
+
+
+def _compress(codec, payload):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(payload)
+    return gzip.compress(payload, compresslevel=6)
+
+
+def _decompress(codec, data):
+    data = bytes(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This chat log archive is zstd-compressed; install the zstandard package to read it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def encode_chat_logs(logs, codec='gzip'):
+    """Serializes ChatLogs as one JSON object per line and compresses them."""
+    lines = (
+        json.dumps({
+            'id': log.id,
+            'sender_type': log.sender_type,
+            'message_content': log.message_content,
+            'timestamp': log.timestamp.isoformat(),
+        }, ensure_ascii=False)
+        for log in logs
+    )
+    return _compress(codec, '\n'.join(lines).encode('utf-8'))
+
+
+def decode_chat_logs(archive):
+    """
+    Unpacks an archive chunk into unsaved ChatLog instances (with their original
+    ids and timestamps), so callers can treat them like rows of the hot table.
+    """
+    logs = []
+    for line in _decompress(archive.codec, archive.data).decode('utf-8').splitlines():
+        row = json.loads(line)
+        logs.append(ChatLog(
+            id=row['id'],
+            user_id=archive.user_id,
+            sender_type=row['sender_type'],
+            message_content=row['message_content'],
+            timestamp=datetime.fromisoformat(row['timestamp']),
+        ))
+    return logs
+
+
+def get_chat_history(user_id, include_archived=True, since=None):
+    """
+    Read-through view of a user's whole conversation, for the admin and exports:
+    archived logs (decompressed) and the logs still in the hot table, oldest first.
+    :param since: Only return logs written at or after this datetime.
+    """
+    logs = ChatLog.objects.filter(user_id=user_id)
+    if since is not None:
+        logs = logs.filter(timestamp__gte=since)
+    history = list(logs)
+    if include_archived:
+        archives = ChatLogArchive.objects.filter(user_id=user_id)
+        if since is not None:
+            archives = archives.filter(last_timestamp__gte=since)
+        for archive in archives:
+            history.extend(log for log in decode_chat_logs(archive) if since is None or log.timestamp >= since)
+    return sorted(history, key=lambda log: (log.timestamp, log.id))
+
+
+def _archivable_logs(user, older_than, keep_latest):
+    """The user's logs that may leave the hot table: summarized ones, plus (optionally) old ones."""
+    condition = Q(id__lte=user.summarized_through_log_id)
+    if older_than is not None:
+        condition |= Q(timestamp__lt=older_than)
+    logs = ChatLog.objects.filter(condition, user=user)
+    if keep_latest <= 0:
+        return logs
+    # Never archive the most recent messages; stage handlers and re-engagement read them
+    boundary = list(ChatLog.objects.filter(user=user).order_by('-id').values_list('id', flat=True)[keep_latest - 1:keep_latest])
+    if not boundary:
+        return logs.none()
+    return logs.filter(id__lt=boundary[0])
+
+
+def archive_user_chat_logs(user, older_than=None, keep_latest=20, max_logs=5000, codec=None):
+    """
+    Moves up to max_logs archivable ChatLogs of one user into ChatLogArchive chunks
+    (one per calendar month) and deletes them from the hot table, in one transaction.
+    :return: The number of logs archived.
+    """
+    codec = codec or _archive_codec()
+    with transaction.atomic():
+        # Serializes with process_messenger_message and with another archival task for the same user
+        list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        logs = list(_archivable_logs(user, older_than, keep_latest).order_by('id')[:max_logs])
+        if not logs:
+            return 0
+        months = {}
+        for log in logs:
+            months.setdefault(log.timestamp.date().replace(day=1), []).append(log)
+        last_chunks = dict(
+            ChatLogArchive.objects.filter(user=user, month__in=months).values_list('month').annotate(last=Max('chunk'))
+        )
+        ChatLogArchive.objects.bulk_create([
+            ChatLogArchive(
+                user=user,
+                month=month,
+                chunk=last_chunks.get(month, 0) + 1,
+                codec=codec,
+                data=encode_chat_logs(month_logs, codec),
+                log_count=len(month_logs),
+                first_log_id=month_logs[0].id,
+                last_log_id=month_logs[-1].id,
+                first_timestamp=min(log.timestamp for log in month_logs),
+                last_timestamp=max(log.timestamp for log in month_logs),
+            )
+            for month, month_logs in months.items()
+        ])
+        ChatLog.objects.filter(id__in=[log.id for log in logs]).delete()
+    return len(logs)
+
+
+def archive_chat_logs(older_than_days=None, keep_latest=None, users_per_batch=None, max_users=None):
+    """
+    Periodic job: finds the users with archivable ChatLogs (summarized ones, and with
+    older_than_days old ones) in primary-key batches and enqueues one
+    archive_chat_log_batch task per batch, so each task stays well within the task
+    timeout. Guarded by a lease so only one dispatch is active.
+    Arguments default to the CHAT_LOG_ARCHIVE_* settings.
+    :return: Totals of users and batches enqueued (None if another run holds the lease).
+    """
+    lease_seconds = getattr(settings, 'CHAT_LOG_ARCHIVE_LEASE_SECONDS', 900)
+    lease_run_id = acquire_lease(ARCHIVAL_LEASE_NAME, lease_seconds)
+    if lease_run_id is None:
+        logger.info("Another chat log archival run is in progress. Skipping.")
+        return None
+    try:
+        return _dispatch_archival(
+            lease_run_id,
+            lease_seconds,
+            older_than_days if older_than_days is not None else getattr(settings, 'CHAT_LOG_ARCHIVE_AFTER_DAYS', None),
+            keep_latest if keep_latest is not None else getattr(settings, 'CHAT_LOG_ARCHIVE_KEEP_LATEST', 20),
+            users_per_batch or getattr(settings, 'CHAT_LOG_ARCHIVE_BATCH_USERS', 200),
+            max_users,
+        )
+    finally:
+        release_lease(ARCHIVAL_LEASE_NAME, lease_run_id)
+
+
+def _users_with_archivable_logs(older_than):
+    """Users with at least one summarized (or, with older_than, old) ChatLog in the hot table."""
+    logs = ChatLog.objects.filter(user=OuterRef('pk'))
+    condition = Q(summarized_through_log_id__gt=0) & Exists(logs.filter(id__lte=OuterRef('summarized_through_log_id')))
+    if older_than is not None:
+        condition |= Exists(logs.filter(timestamp__lt=older_than))
+    return User.objects.filter(condition)
+
+
+def _dispatch_archival(lease_run_id, lease_seconds, older_than_days, keep_latest, users_per_batch, max_users):
+    older_than = timezone.now() - timedelta(days=older_than_days) if older_than_days else None
+    totals = {'users': 0, 'batches': 0}
+    user_id_query = _users_with_archivable_logs(older_than).order_by('user_id').values_list('user_id', flat=True)
+    last_user_id = None
+    while max_users is None or totals['users'] < max_users:
+        limit = users_per_batch if max_users is None else min(users_per_batch, max_users - totals['users'])
+        batch = user_id_query if last_user_id is None else user_id_query.filter(user_id__gt=last_user_id)
+        batch = list(batch[:limit])
+        if not batch:
+            break
+        enqueue_task(archive_chat_log_batch, batch, older_than=older_than, keep_latest=keep_latest,
+                     q_options={'group': 'chat-log-archive'})
+        totals['users'] += len(batch)
+        totals['batches'] += 1
+        last_user_id = batch[-1]
+        if not renew_lease(ARCHIVAL_LEASE_NAME, lease_run_id, lease_seconds):
+            logger.warning("Lost the chat log archival lease. Stopping this run.")
+            break
+    logger.info(f"Chat log archival enqueued {totals['users']} users in {totals['batches']} batches.")
+    return totals
+
+
+def archive_chat_log_batch(user_ids, older_than=None, keep_latest=20):
+    """
+    Task: archives the ChatLogs of one batch of users (see archive_chat_logs).
+    A failure for one user doesn't stop the rest.
+    :return: The number of logs archived.
+    """
+    archived = 0
+    for user in User.objects.filter(user_id__in=user_ids):
+        try:
+            archived += archive_user_chat_logs(user, older_than=older_than, keep_latest=keep_latest)
+        except Exception as e:
+            logger.error(f"Failed to archive chat logs of user {user.user_id}: {e}", exc_info=True)
+    logger.info(f"Archived {archived} chat logs of {len(user_ids)} users.")
+    return archived
@@ -0,0 +1,98 @@
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# The buffer of the innermost buffer_chat_logs() block running in this context, if any
+_active_buffer = ContextVar('chat_log_buffer', default=None)
+
+
+class ChatLogBuffer:
+    """
+    ChatLogs created (through ChatLog.objects.create) while the buffer is active.
+    flush() writes them with one bulk INSERT, in creation (and so timestamp) order,
+    and fills in their ids.
+    """
+
+    def __init__(self):
+        self.logs = []
+        self.written = [] # Flushed logs; they reach the cached conversation rings on commit
+
+    def add(self, log):
+        self.logs.append(log)
+
+    def pending_for(self, user_id):
+        """Logs of one user created in this block, oldest first: the written ones (with ids), then the buffered ones."""
+        return [log for log in self.written + self.logs if log.user_id == user_id]
+
+    def flush(self):
+        """
+        Writes the buffered logs and adds them to the cached conversation rings.
+        :return: The written ChatLogs, with their ids set.
+        """
+        from .conversation_cache import record_chat_logs # Local import to avoid circular dependency
+        from .models import ChatLog
+
+        logs, self.logs = self.logs, []
+        if not logs:
+            return []
+        ChatLog.objects.bulk_create(logs)
+        if any(log.pk is None for log in logs):
+            _assign_ids(logs)
+        self.written.extend(logs)
+        record_chat_logs(logs) # bulk_create sends no post_save
+        return logs
+
+
+def _assign_ids(logs):
+    """
+    Backends that can't return ids from a bulk INSERT (MySQL): read back each user's
+    rows since the oldest buffered timestamp and match them to the buffered logs by
+    (sender_type, timestamp, message_content). Other writers (re-engagement, cron
+    jobs) don't take the user's row lock, so the newest ids may not be ours.
+    """
+    from .models import ChatLog # Local import to avoid circular dependency
+
+    by_user = {}
+    for log in logs:
+        by_user.setdefault(log.user_id, []).append(log)
+    for user_id, user_logs in by_user.items():
+        unmatched = {}
+        for log in user_logs:
+            unmatched.setdefault((log.sender_type, log.timestamp, log.message_content), deque()).append(log)
+        rows = ChatLog.objects.filter(user_id=user_id, timestamp__gte=min(log.timestamp for log in user_logs)).order_by('id')
+        for log_id, *key in rows.values_list('id', 'sender_type', 'timestamp', 'message_content'):
+            candidates = unmatched.get(tuple(key))
+            if candidates:
+                candidates.popleft().pk = log_id
+        missing = sum(len(candidates) for candidates in unmatched.values())
+        if missing:
+            logger.warning(f"Couldn't read back the ids of {missing} ChatLogs of user {user_id}")
+
+
+def active_chat_log_buffer():
+    """The buffer ChatLog.objects.create() currently adds to, or None."""
+    return _active_buffer.get()
+
+
+@contextmanager
+def buffer_chat_logs():
+    """
+    Collects every ChatLog.objects.create() inside the block and writes them with a
+    single bulk INSERT when the block exits (use it inside the task's transaction).
+    Call flush() on the yielded buffer to write earlier, e.g., before reading the
+    logs back. Nested blocks share the outer buffer. Nothing is written if the block raises.
+    """
+    buffer = _active_buffer.get()
+    if buffer is not None:
+        yield buffer
+        return
+    buffer = ChatLogBuffer()
+    token = _active_buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _active_buffer.reset(token)
+    buffer.flush()
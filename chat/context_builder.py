@@ -0,0 +1,168 @@
+import functools
+import logging
+import math
+from dataclasses import dataclass, field
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError: # Optional; token counts are estimated from the text length without it
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_ENCODING = 'o200k_base' # Encoding of the gpt-5 models
+CHARS_PER_TOKEN = 4 # Estimate used without tiktoken
+TRUNCATION_MARK = '…'
+
+# Token budgets per call type (the prompt category of the call), overridable per key through
+# settings.LLM_CONTEXT_BUDGETS. Only the packed context counts; the fixed prompt text is extra.
+DEFAULT_CONTEXT_BUDGETS = {
+    'GENERAL_BOT': {
+        'total': 2000,     # Summary + recent turns + current message together
+        'message': 600,    # Current message
+        'summary': 300,    # User.summary
+        'turn': 250,       # Any single past turn (long legal answers are clipped)
+        'max_turns': 12,   # Past turns fetched; the oldest are dropped first when over budget
+    },
+    'SUMMARIZATION': {
+        'total': 5000,     # Room for the whole 14-message chunk at the per-turn cap
+        'message': 0,
+        'summary': 400,    # Existing summary being merged
+        'turn': 300,
+        'max_turns': None, # The caller picks the chunk
+    },
+    'RE_ENGAGEMENT': {
+        'total': 800,
+        'message': 0,
+        'summary': 200,
+        'turn': 120,
+        'max_turns': 5,
+    },
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e: # e.g. the encoding file can't be downloaded
+        logger.warning(f"Couldn't load the {TOKENIZER_ENCODING} tokenizer, estimating token counts instead: {e}")
+        return None
+
+
+def count_tokens(text):
+    """Number of tokens in text, counted locally (estimated at 4 characters per token without tiktoken)."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_tokens(text, max_tokens):
+    """Cuts text to at most max_tokens tokens, keeping its beginning and marking the cut."""
+    if not text or max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens - 1]).rstrip() + TRUNCATION_MARK
+    return text[:max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARK)].rstrip() + TRUNCATION_MARK
+
+
+def get_context_budget(call_type):
+    """The token budget for a call type (DEFAULT_CONTEXT_BUDGETS merged with settings), or None if it has none."""
+    overrides = getattr(settings, 'LLM_CONTEXT_BUDGETS', {}).get(call_type)
+    defaults = DEFAULT_CONTEXT_BUDGETS.get(call_type)
+    if defaults is None and overrides is None:
+        return None
+    return {**(defaults or {}), **(overrides or {})}
+
+
+@dataclass
+class PackedContext:
+    summary: str = ''
+    turns: list = field(default_factory=list) # Oldest first
+    message: str = ''
+    tokens: int = 0
+    dropped_turns: int = 0
+
+    @property
+    def conversation_history(self):
+        return "\n".join(self.turns)
+
+
+def build_context(call_type, turns=(), summary=None, message=None):
+    """
+    Packs the current message, the user's summary and their recent turns into the call type's
+    token budget (see get_context_budget). Priority goes to the current message, then the
+    summary, then the turns from newest to oldest; each part is clipped to its own cap and
+    the oldest turns are dropped once the total is used up.
+    :param turns: Formatted turns, oldest first, as a list (a turn can span several lines).
+    :return: A PackedContext.
+    """
+    budget = get_context_budget(call_type)
+    if budget is None:
+        raise ValueError(f"No context budget for call type {call_type}")
+    if isinstance(turns, str):
+        raise TypeError("turns must be a list of formatted turns, not a string")
+    turns = [turn for turn in turns if turn]
+    if budget.get('max_turns') is not None:
+        turns = turns[-budget['max_turns']:] if budget['max_turns'] > 0 else []
+
+    remaining = budget['total']
+    packed_message = truncate_tokens(message, min(budget['message'], remaining)) if message else ''
+    remaining -= count_tokens(packed_message)
+    packed_summary = truncate_tokens(summary, min(budget['summary'], remaining)) if summary else ''
+    remaining -= count_tokens(packed_summary)
+
+    packed_turns = []
+    for turn in reversed(turns):
+        turn = truncate_tokens(turn, budget['turn'])
+        cost = count_tokens(turn) + 1 # Plus the newline joining it to the history
+        if cost > remaining:
+            if not packed_turns and remaining > 1:
+                packed_turns.append(truncate_tokens(turn, remaining - 1)) # Never leave out the latest turn entirely
+                remaining = 0
+            break
+        packed_turns.append(turn)
+        remaining -= cost
+    packed_turns.reverse()
+
+    context = PackedContext(
+        summary=packed_summary,
+        turns=packed_turns,
+        message=packed_message,
+        tokens=budget['total'] - remaining,
+        dropped_turns=len(turns) - len(packed_turns),
+    )
+    if context.dropped_turns:
+        logger.info(f"{call_type} context over its {budget['total']}-token budget: dropped {context.dropped_turns} of {len(turns)} turns.")
+    return context
+
+
+def pack_prompt_context(call_type, prompt_context):
+    """
+    Applies build_context to a prompt template's context, replacing the 'user_summary',
+    'conversation_history' and 'message_text' values it has. Returns prompt_context
+    unchanged for call types without a budget or without a conversation history.
+    """
+    if 'conversation_history' not in prompt_context or get_context_budget(call_type) is None:
+        return prompt_context
+    context = build_context(
+        call_type,
+        turns=prompt_context['conversation_history'] or (),
+        summary=prompt_context.get('user_summary'),
+        message=prompt_context.get('message_text'),
+    )
+    packed = dict(prompt_context, conversation_history=context.conversation_history)
+    if 'user_summary' in prompt_context:
+        packed['user_summary'] = context.summary
+    if 'message_text' in prompt_context:
+        packed['message_text'] = context.message
+    return packed
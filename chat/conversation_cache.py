@@ -0,0 +1,196 @@
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .chat_log_buffer import active_chat_log_buffer
+from .utils import cache_is_shared, fetch_recent_chat_logs
+
+logger = logging.getLogger(__name__)
+
+# Per-user ring buffer of the latest formatted ChatLog lines, kept in the shared cache:
+#   {'entries': [(chat_log_id, "SENDER_TYPE: content"), ...], 'complete': bool}
+# oldest first, at most CONVERSATION_RING_SIZE entries. 'complete' means the ring holds
+# the user's whole (hot) history, so counts past a ChatLog id can be answered from it.
+CONVERSATION_RING_KEY = "conversation:ring:{user_id}"
+# Bumped whenever ChatLogs of the user are committed, so a rebuild that raced with them can tell
+CONVERSATION_RING_VERSION_KEY = "conversation:ring-version:{user_id}"
+# Held while a ring is updated in place, so concurrent writers don't lose each other's entries
+CONVERSATION_RING_LOCK_KEY = "conversation:ring-lock:{user_id}"
+RING_LOCK_SECONDS = 5
+
+
+def _ring_size():
+    return getattr(settings, 'CONVERSATION_RING_SIZE', 24)
+
+
+def _ring_ttl():
+    return getattr(settings, 'CONVERSATION_RING_TTL', 86400)
+
+
+def rings_enabled():
+    """
+    Whether rings are cached: settings.CONVERSATION_RING_ENABLED, by default only with a
+    shared cache. With per-process caches each worker would keep serving its own ring,
+    missing every turn the other workers handled.
+    """
+    enabled = getattr(settings, 'CONVERSATION_RING_ENABLED', None)
+    return cache_is_shared() if enabled is None else enabled
+
+
+def format_chat_log(log):
+    """The "SENDER_TYPE: content" line used as conversation context in prompts."""
+    return f"{log.sender_type}: {log.message_content}"
+
+
+def _build_ring(logs):
+    size = _ring_size()
+    logs = sorted(logs, key=lambda log: log.id)
+    return {
+        'entries': [(log.id, format_chat_log(log)) for log in logs[-size:]],
+        'complete': len(logs) <= size,
+    }
+
+
+def get_conversation_rings(user_ids):
+    """
+    Returns {user_id: ring} for the given users. Cached rings cost one cache round
+    trip for all users; misses are rebuilt from ChatLog in a single query and cached.
+    With rings disabled (see rings_enabled) they are always built from ChatLog.
+    """
+    user_ids = list(user_ids)
+    if not rings_enabled():
+        recent_logs = fetch_recent_chat_logs(user_ids, limit=_ring_size() + 1)
+        return {user_id: _build_ring(recent_logs[user_id]) for user_id in user_ids}
+    keys = {CONVERSATION_RING_KEY.format(user_id=user_id): user_id for user_id in user_ids}
+    cached = cache.get_many(keys)
+    rings = {keys[key]: ring for key, ring in cached.items()}
+    missing = [user_id for user_id in user_ids if user_id not in rings]
+    if missing:
+        version_keys = {CONVERSATION_RING_VERSION_KEY.format(user_id=user_id): user_id for user_id in missing}
+        versions = cache.get_many(version_keys)
+        # One more than the ring holds, to tell whether the ring covers the whole history
+        recent_logs = fetch_recent_chat_logs(missing, limit=_ring_size() + 1)
+        built = {user_id: _build_ring(recent_logs[user_id]) for user_id in missing}
+        cache.set_many({CONVERSATION_RING_KEY.format(user_id=user_id): ring for user_id, ring in built.items()}, _ring_ttl())
+        # A ChatLog committed while the rings were read may be missing from them: drop those
+        # rings (the writer found no ring to update) so the next read rebuilds them
+        raced = [key for key, value in cache.get_many(version_keys).items() if versions.get(key) != value]
+        if raced:
+            cache.delete_many([CONVERSATION_RING_KEY.format(user_id=version_keys[key]) for key in raced])
+        rings.update(built)
+    return rings
+
+
+def get_conversation_ring(user_id):
+    return get_conversation_rings([user_id])[user_id]
+
+
+def _latest_lines(user_id, ring, limit, buffer):
+    lines = [line for _, line in ring['entries']]
+    if buffer is not None:
+        # Logs created in this task reach the ring on commit; they are the newest messages
+        ring_ids = {log_id for log_id, _ in ring['entries']}
+        lines.extend(format_chat_log(log) for log in buffer.pending_for(user_id) if log.pk not in ring_ids)
+    return lines[-limit:] if limit else []
+
+
+def get_recent_conversation(user_id, limit=5):
+    """The user's latest `limit` formatted messages, oldest first."""
+    return get_recent_conversations([user_id], limit)[user_id]
+
+
+def get_recent_conversations(user_ids, limit=5):
+    """{user_id: latest `limit` formatted messages, oldest first} for several users at once."""
+    buffer = active_chat_log_buffer()
+    return {
+        user_id: _latest_lines(user_id, ring, limit, buffer)
+        for user_id, ring in get_conversation_rings(user_ids).items()
+    }
+
+
+def get_unsummarized_conversation(user_id, summarized_through_log_id):
+    """
+    The user's messages after the summarization watermark as [(id, line), ...], oldest
+    first, or None when the ring can't tell (the ring is full and all of it is past
+    the watermark, so older unsummarized messages may exist). Flush any ChatLog
+    buffer first: unwritten logs have no id yet.
+    """
+    ring = get_conversation_ring(user_id)
+    entries = ring['entries']
+    buffer = active_chat_log_buffer()
+    if buffer is not None:
+        # Logs written in this task aren't in the ring until the transaction commits
+        ring_ids = {log_id for log_id, _ in entries}
+        entries = entries + [(log.pk, format_chat_log(log)) for log in buffer.pending_for(user_id) if log.pk is not None and log.pk not in ring_ids]
+    if not ring['complete'] and (not entries or entries[0][0] > summarized_through_log_id):
+        return None
+    return [(log_id, line) for log_id, line in entries if log_id > summarized_through_log_id]
+
+
+@contextmanager
+def _ring_lock(user_id):
+    """Per-user lock around an in-place ring update; yields whether it was acquired within RING_LOCK_SECONDS."""
+    key = CONVERSATION_RING_LOCK_KEY.format(user_id=user_id)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + RING_LOCK_SECONDS
+    acquired = cache.add(key, token, RING_LOCK_SECONDS)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.005)
+        acquired = cache.add(key, token, RING_LOCK_SECONDS)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def _bump_ring_version(user_id):
+    key = CONVERSATION_RING_VERSION_KEY.format(user_id=user_id)
+    cache.add(key, 0, _ring_ttl() * 2)
+    try:
+        cache.incr(key)
+    except ValueError: # Expired in between; any new value tells a concurrent rebuild
+        cache.set(key, uuid.uuid4().hex, _ring_ttl() * 2)
+
+
+def _append_to_rings(logs):
+    by_user = {}
+    for log in logs:
+        by_user.setdefault(log.user_id, []).append(log)
+    for user_id, user_logs in by_user.items():
+        _bump_ring_version(user_id)
+        key = CONVERSATION_RING_KEY.format(user_id=user_id)
+        with _ring_lock(user_id) as locked:
+            if not locked:
+                logger.warning(f"Couldn't lock the conversation ring of user {user_id}; dropping it.")
+                cache.delete(key)
+                continue
+            ring = cache.get(key)
+            if ring is None:
+                continue
+            entries = dict(ring['entries'])
+            for log in user_logs:
+                entries[log.id] = format_chat_log(log)
+            ordered = sorted(entries.items())
+            size = _ring_size()
+            cache.set(key, {'entries': ordered[-size:], 'complete': ring['complete'] and len(ordered) <= size}, _ring_ttl())
+
+
+def record_chat_logs(logs):
+    """
+    Write-through: once the current transaction commits, appends newly saved ChatLogs
+    to their users' cached rings (nothing changes if it rolls back). Users without a
+    cached ring are skipped; the next read rebuilds it from the database.
+    """
+    if not rings_enabled():
+        return
+    logs = list(logs)
+    transaction.on_commit(lambda: _append_to_rings(logs))
+
+
+def forget_conversation(user_id):
+    """Drops a user's cached ring, e.g., when the user is created or deleted."""
+    cache.delete(CONVERSATION_RING_KEY.format(user_id=user_id))
@@ -0,0 +1,227 @@
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_ERROR = {
+    "error": {
+        "message": "(#613) Calls to this api have exceeded the rate limit.",
+        "type": "OAuthException",
+        "code": 613,
+    }
+}
+UNREACHABLE_ERROR = {
+    "error": {
+        "message": "(#100) No matching user found",
+        "type": "OAuthException",
+        "code": 100,
+        "error_subcode": 2018001,
+    }
+}
+
+
+def webhook_event_payload(sender_id, text, mid, page_id='PAGE_ID'):
+    """
+    A Messenger webhook POST body carrying one text message, as Facebook sends it to
+    chat.views.webhook_callback. Used to drive the webhook with synthetic traffic.
+    """
+    now_ms = int(time.time() * 1000)
+    return {
+        'object': 'page',
+        'entry': [{
+            'id': page_id,
+            'time': now_ms,
+            'messaging': [{
+                'sender': {'id': sender_id},
+                'recipient': {'id': page_id},
+                'timestamp': now_ms,
+                'message': {'mid': mid, 'text': text},
+            }],
+        }],
+    }
+
+
+class FakeGraphAPIServer:
+    """
+    Local stand-in for the Messenger Send API, for end-to-end throughput tests.
+    Accepts the POSTs made by chat.messenger_api (point settings.FACEBOOK_GRAPH_API_URL
+    at messages_url), records every message and sender action in arrival order,
+    and can inject latency, #613 throttling and 2018001 "unreachable" errors.
+
+    Also serves GET /report (see report()) and POST /reset, so a server started with
+    `manage.py run_fake_graph_api` can be inspected from another process.
+
+    Usable as a context manager in tests:
+        with FakeGraphAPIServer(latency_ms=(5, 20)) as graph_api:
+            with override_settings(FACEBOOK_GRAPH_API_URL=graph_api.messages_url):
+                ...
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, throttle_rate=0.0, unreachable_recipients=(), seed=None):
+        """
+        :param latency_ms: Response delay in milliseconds, a number or a (min, max) range.
+        :param throttle_rate: Probability of answering with error #613.
+        :param unreachable_recipients: Recipient ids answered with error 2018001.
+        """
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self.unreachable_recipients = set(unreachable_recipients)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reset()
+
+        server = self
+        class Handler(_GraphAPIRequestHandler):
+            fake_server = server
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def messages_url(self):
+        return f"{self.base_url}/v24.0/me/messages"
+
+    def start(self):
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-graph-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset(self):
+        """Forgets every recorded event."""
+        with self._lock:
+            self.events = []
+            self.throttled_count = 0
+            self.unreachable_count = 0
+            self.started_at = time.monotonic()
+
+    def _delay_seconds(self):
+        latency = self.latency_ms
+        if isinstance(latency, (tuple, list)):
+            with self._lock:
+                latency = self._random.uniform(*latency)
+        return latency / 1000
+
+    def handle_send(self, payload):
+        """Returns (status, response body) for one Send API request and records it."""
+        time.sleep(self._delay_seconds())
+        recipient_id = str((payload.get('recipient') or {}).get('id'))
+
+        with self._lock:
+            if recipient_id in self.unreachable_recipients:
+                self.unreachable_count += 1
+                return 400, UNREACHABLE_ERROR
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                self.throttled_count += 1
+                return 400, THROTTLED_ERROR
+
+            event = {
+                'seq': len(self.events) + 1,
+                'recipient_id': recipient_id,
+                'received_at': time.monotonic() - self.started_at,
+            }
+            if 'sender_action' in payload:
+                event['sender_action'] = payload['sender_action']
+            else:
+                event['text'] = (payload.get('message') or {}).get('text')
+            self.events.append(event)
+
+        if 'sender_action' in payload:
+            return 200, {"recipient_id": recipient_id}
+        return 200, {"recipient_id": recipient_id, "message_id": f"m_fake_{event['seq']}"}
+
+    def messages_for(self, recipient_id):
+        """Texts delivered to a recipient, in arrival order."""
+        with self._lock:
+            return [e['text'] for e in self.events if e['recipient_id'] == recipient_id and 'text' in e]
+
+    def report(self):
+        """
+        Summary of the traffic so far: totals, error counts, throughput and each
+        recipient's messages and sender actions in arrival order.
+        """
+        with self._lock:
+            events = list(self.events)
+            throttled, unreachable = self.throttled_count, self.unreachable_count
+        recipients = {}
+        for event in events:
+            entry = recipients.setdefault(event['recipient_id'], {'messages': [], 'sender_actions': [], 'sequence': []})
+            if 'text' in event:
+                entry['messages'].append(event['text'])
+                entry['sequence'].append(('message', event['text']))
+            else:
+                entry['sender_actions'].append(event['sender_action'])
+                entry['sequence'].append(('sender_action', event['sender_action']))
+        messages = sum(len(entry['messages']) for entry in recipients.values())
+        elapsed = events[-1]['received_at'] if events else 0
+        return {
+            'messages': messages,
+            'sender_actions': len(events) - messages,
+            'throttled': throttled,
+            'unreachable': unreachable,
+            'messages_per_second': round(messages / elapsed, 2) if elapsed else None,
+            'recipients': recipients,
+        }
+
+
+class _GraphAPIRequestHandler(BaseHTTPRequestHandler):
+    fake_server = None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/report':
+            self._send_json(200, self.fake_server.report())
+        else:
+            self._send_json(404, {"error": {"message": "Unknown path"}})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if path == '/reset':
+            self.fake_server.reset()
+            self._send_json(200, {"success": True})
+            return
+        if not path.endswith('/me/messages'):
+            self._send_json(404, {"error": {"message": "Unknown path"}})
+            return
+        try:
+            payload = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON", "code": 100}})
+            return
+        self._send_json(*self.fake_server.handle_send(payload))
+
+    def log_message(self, format, *args):
+        logger.debug(f"Fake Graph API: {format % args}")
@@ -0,0 +1,53 @@
+import logging
+import uuid
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import JobLease
+
+logger = logging.getLogger(__name__)
+
+def acquire_lease(name, ttl_seconds):
+    """
+    Takes the named lease for ttl_seconds if nobody holds it or the holder's lease expired.
+    The common path is a single conditional UPDATE, so only one worker can win.
+    :return: The run id of the new holder, or None if the lease is held elsewhere.
+    """
+    now = timezone.now()
+    run_id = str(uuid.uuid4())
+    expires_at = now + timedelta(seconds=ttl_seconds)
+
+    leases = JobLease.objects.filter(name=name)
+    if leases.filter(expires_at__lte=now).update(run_id=run_id, expires_at=expires_at, acquired_at=now):
+        return run_id
+    if leases.exists():
+        logger.info(f"Lease {name} is held by another run; skipping.")
+        return None
+
+    # First run of this job
+    try:
+        with transaction.atomic():
+            JobLease.objects.create(name=name, run_id=run_id, expires_at=expires_at, acquired_at=now)
+        return run_id
+    except IntegrityError:
+        logger.info(f"Lease {name} was taken by a concurrent run; skipping.")
+        return None
+
+def renew_lease(name, run_id, ttl_seconds):
+    """
+    Extends a lease still held by run_id.
+    :return: False if the lease was lost (expired and taken by another run).
+    """
+    expires_at = timezone.now() + timedelta(seconds=ttl_seconds)
+    return bool(JobLease.objects.filter(name=name, run_id=run_id).update(expires_at=expires_at))
+
+def release_lease(name, run_id, forget=False):
+    """
+    Ends a lease early, if run_id still holds it. forget=True deletes the lease row instead,
+    for per-user leases that would otherwise leave a row behind for every user.
+    """
+    leases = JobLease.objects.filter(name=name, run_id=run_id)
+    if forget:
+        leases.delete()
+    else:
+        leases.update(expires_at=timezone.now())
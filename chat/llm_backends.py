@@ -0,0 +1,184 @@
+import abc
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from types import SimpleNamespace
+import openai
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+class LLMBackend(abc.ABC):
+    """
+    Makes chat completion calls for AIIntegration. create_completion takes the
+    keyword arguments of openai.chat.completions.create and returns an object shaped
+    like its response (choices[0].message.content, usage).
+    """
+
+    @abc.abstractmethod
+    def create_completion(self, **request):
+        ...
+
+
+class OpenAIBackend(LLMBackend):
+    """The real OpenAI API."""
+
+    def create_completion(self, **request):
+        return openai.chat.completions.create(**request)
+
+
+class SimulatedLLMError(openai.OpenAIError):
+    """Injected failure from SimulatedLLMBackend; handled like any OpenAI error."""
+
+
+DEFAULT_SIMULATION = {
+    'seed': None,              # Seed for latency and error draws; None for a fresh seed per process
+    'latency_ms': {            # Time to first token
+        'distribution': 'lognormal', # 'fixed', 'uniform' or 'lognormal'
+        'median': 800,         # fixed value / lognormal median
+        'sigma': 0.5,          # lognormal spread
+        'min': 200,            # uniform lower bound, and floor for every distribution
+        'max': 3000,           # uniform upper bound, and ceiling for every distribution
+    },
+    'tokens_per_second': 80,   # Generation speed; 0 disables generation time
+    'completion_tokens': 60,   # Length of free-text replies (capped by max_completion_tokens)
+    'error_rate': 0.0,         # Probability that a call raises SimulatedLLMError
+    'grading_response': {      # JSON returned for response_format={"type": "json_object"} requests
+        'legal_writing_feedback': 'Clear and organized. Use complete sentences for each element.',
+        'legal_basis_feedback': 'Cites the correct provision but should quote the operative text.',
+        'application_feedback': 'Applies the law to most of the facts; address the exception raised.',
+        'conclusion_feedback': 'States a conclusion consistent with the analysis.',
+        'score': None,         # None derives a stable score (60-95) from the request
+    },
+    'prompt_cache': {          # Upstream prompt caching, reported as usage.prompt_tokens_details.cached_tokens
+        'min_tokens': 1024,    # Shortest cached prefix
+        'increment': 128,      # Cached prefixes count in steps of this many tokens
+    },
+}
+
+
+class SimulatedLLMBackend(LLMBackend):
+    """
+    Offline stand-in for load tests and benchmarks. Replies are deterministic for a
+    given request; latency, generation time and injected errors follow
+    settings.LLM_SIMULATION (merged over DEFAULT_SIMULATION).
+    """
+
+    def __init__(self, config=None):
+        self.config = self._merge(DEFAULT_SIMULATION, config if config is not None else getattr(settings, 'LLM_SIMULATION', {}))
+        self._random = random.Random(self.config['seed'])
+        self._random_lock = threading.Lock() # random.Random isn't safe to share across threads
+        self._seen_prefixes = set() # Hashes of the leading messages of earlier requests
+        self._prefix_lock = threading.Lock()
+
+    @classmethod
+    def _merge(cls, defaults, overrides):
+        merged = dict(defaults)
+        for key, value in (overrides or {}).items():
+            merged[key] = cls._merge(defaults[key], value) if isinstance(defaults.get(key), dict) and isinstance(value, dict) else value
+        return merged
+
+    def _draw_latency_seconds(self):
+        latency = self.config['latency_ms']
+        with self._random_lock:
+            if latency['distribution'] == 'fixed':
+                value = latency['median']
+            elif latency['distribution'] == 'uniform':
+                value = self._random.uniform(latency['min'], latency['max'])
+            else:
+                value = self._random.lognormvariate(0, latency['sigma']) * latency['median']
+        return min(max(value, latency['min']), latency['max']) / 1000
+
+    def _should_fail(self):
+        with self._random_lock:
+            return self._random.random() < self.config['error_rate']
+
+    def _cached_tokens(self, request):
+        """
+        Tokens of the longest run of leading messages already sent with the same model,
+        like a prefix cache that never evicts (but only caches from min_tokens up).
+        """
+        prompt_cache = self.config['prompt_cache']
+        digest = hashlib.sha256(str(request.get('model')).encode('utf-8'))
+        prefix_tokens = cached = 0
+        with self._prefix_lock:
+            if len(self._seen_prefixes) > 100000:
+                self._seen_prefixes.clear()
+            for message in request.get('messages') or []:
+                digest.update(json.dumps(message, sort_keys=True, default=str).encode('utf-8'))
+                prefix_tokens += max(1, len(str(message.get('content') or '')) // 4)
+                key = digest.copy().hexdigest()
+                if key in self._seen_prefixes:
+                    cached = prefix_tokens
+                else:
+                    self._seen_prefixes.add(key)
+        if cached < prompt_cache['min_tokens']:
+            return 0
+        return cached - cached % prompt_cache['increment'] if prompt_cache['increment'] else cached
+
+    def _content(self, request, digest):
+        if (request.get('response_format') or {}).get('type') == 'json_object':
+            grading = dict(self.config['grading_response'])
+            if grading.get('score') is None:
+                grading['score'] = 60 + int(digest[:8], 16) % 36
+            return json.dumps(grading)
+
+        token_count = self.config['completion_tokens']
+        if request.get('max_completion_tokens'):
+            token_count = min(token_count, request['max_completion_tokens'])
+        words = [f"simulated-{digest[i % 56:i % 56 + 8]}" for i in range(max(token_count, 1))]
+        return ' '.join(words)
+
+    def create_completion(self, **request):
+        payload = json.dumps(request, sort_keys=True, default=str)
+        digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        prompt_tokens = max(1, len(payload) // 4)
+        cached_tokens = min(self._cached_tokens(request), prompt_tokens)
+
+        time.sleep(self._draw_latency_seconds())
+        if self._should_fail():
+            raise SimulatedLLMError(f"Simulated failure for {request.get('model')} request.")
+
+        content = self._content(request, digest)
+        completion_tokens = max(1, len(content) // 4)
+        if self.config['tokens_per_second']:
+            time.sleep(completion_tokens / self.config['tokens_per_second'])
+
+        return SimpleNamespace(
+            id=f"simulated-{digest[:12]}",
+            model=request.get('model'),
+            choices=[SimpleNamespace(index=0, finish_reason='stop', message=SimpleNamespace(role='assistant', content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+            ),
+        )
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_llm_backend():
+    """Returns the (per-process) instance of settings.LLM_BACKEND."""
+    path = getattr(settings, 'LLM_BACKEND', 'chat.llm_backends.OpenAIBackend')
+    backend = _backends.get(path)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(path)
+            if backend is None:
+                backend = _backends[path] = import_string(path)()
+                logger.info(f"Using LLM backend {path}.")
+    return backend
+
+@receiver(setting_changed)
+def _reset_llm_backends(setting, **kwargs):
+    """Drops cached backends when their settings change (e.g., override_settings in tests)."""
+    if setting in ('LLM_BACKEND', 'LLM_SIMULATION'):
+        with _backends_lock:
+            _backends.clear()
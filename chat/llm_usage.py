@@ -0,0 +1,73 @@
+import logging
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import LLMUsage
+
+logger = logging.getLogger(__name__)
+
+USAGE_FIELDS = ('calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens')
+
+
+def _token_count(value):
+    return value if isinstance(value, int) else 0
+
+
+def usage_from_response(response):
+    """
+    Token counts of a chat completion response as a dict with 'prompt_tokens', 'cached_tokens'
+    and 'completion_tokens'. Missing fields count as 0.
+    """
+    usage = getattr(response, 'usage', None)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': _token_count(getattr(usage, 'prompt_tokens', None)),
+        'cached_tokens': _token_count(getattr(details, 'cached_tokens', None)),
+        'completion_tokens': _token_count(getattr(usage, 'completion_tokens', None)),
+    }
+
+
+def record_llm_usage(call_type, model, response):
+    """
+    Adds one upstream call and its token usage to today's LLMUsage row for the call type and
+    model. Inside a transaction the write waits for the commit, so the shared row is not locked
+    for the rest of the caller's transaction (the usage of a call whose transaction rolls back
+    is not recorded). Failures are logged and never reach the caller.
+    """
+    usage = usage_from_response(response)
+    day = timezone.now().date()
+    transaction.on_commit(lambda: _add_usage(day, call_type, model, usage))
+
+
+def _add_usage(day, call_type, model, usage):
+    """Adds one call and its usage to a LLMUsage row. The common path is a single UPDATE."""
+    increments = {field: F(field) + usage[field] for field in usage}
+    try:
+        rows = LLMUsage.objects.filter(day=day, call_type=call_type, model=model)
+        if rows.update(calls=F('calls') + 1, **increments):
+            return
+        # First call of the day for this call type and model
+        try:
+            with transaction.atomic():
+                LLMUsage.objects.create(day=day, call_type=call_type, model=model, calls=1, **usage)
+        except IntegrityError:
+            # Another worker created the row first
+            rows.update(calls=F('calls') + 1, **increments)
+    except Exception as e:
+        logger.warning(f"Could not record LLM usage for {call_type}: {e}")
+
+
+def get_llm_usage(day=None):
+    """
+    Usage per call type on a day (today by default), summed over models: a dict of call type to
+    a dict with 'calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens' and 'cache_hit_rate'
+    (the share of prompt tokens that were cached).
+    """
+    day = day or timezone.now().date()
+    rows = LLMUsage.objects.filter(day=day).values('call_type').annotate(**{field: Sum(field) for field in USAGE_FIELDS})
+    usage = {}
+    for row in rows:
+        call_type = row.pop('call_type')
+        row['cache_hit_rate'] = row['cached_tokens'] / row['prompt_tokens'] if row['prompt_tokens'] else 0.0
+        usage[call_type] = row
+    return usage
@@ -0,0 +1,224 @@
+import json
+import logging
+import random
+import threading
+import time
+import requests
+from .benchmark import percentile
+from .fake_graph_api import webhook_event_payload
+
+logger = logging.getLogger(__name__)
+
+FIRST_NAMES = ['Maria', 'Jose', 'Andrea', 'Miguel', 'Patricia', 'Paolo', 'Katrina', 'Ramon', 'Bea', 'Carlo']
+LAST_NAMES = ['Santos', 'Reyes', 'Cruz', 'Bautista', 'Garcia', 'Mendoza', 'Torres', 'Villanueva']
+GREETINGS = ["Hi", "Hello po", "Good evening!", "Hi, I saw your page", "Hello, is this the bar review bot?"]
+NAME_REPLIES = ["{first} {last}", "I'm {first}", "My name is {first} {last}", "{first} po", "It's {first} {last}, law graduate"]
+MARKETING_REPLIES = ["yes", "Yes!", "start", "yes po", "sure, yes"]
+EXAM_ANSWERS = {
+    'short': [
+        "Yes, the contract is void.",
+        "No. The accused is not liable.",
+        "I don't know.",
+        "Valid, because there was consent.",
+    ],
+    'medium': [
+        "The contract is voidable because consent was vitiated by fraud. Under Article 1390 of the Civil Code, "
+        "the injured party may bring an action for annulment within four years from discovery.",
+        "The warrantless arrest was invalid. None of the instances under Rule 113, Section 5 apply, so the "
+        "evidence seized is inadmissible under the exclusionary rule.",
+        "The corporation is liable. The officer acted within the scope of apparent authority and the "
+        "corporation clothed him with that authority by its prior acts.",
+    ],
+    'long': [
+        "I would answer in the negative. First, the requisites of a valid contract under Article 1318 are consent, "
+        "an object certain and a cause of the obligation. Here, consent was given by a person who was insane at the "
+        "time, which makes the contract voidable rather than void under Article 1390. Second, ratification may be "
+        "express or tacit, and the acceptance of benefits after regaining sanity amounts to tacit ratification under "
+        "Article 1393. Third, once ratified, the action to annul is extinguished under Article 1392, and the cleansing "
+        "of the defect retroacts to the constitution of the contract. Therefore the heirs can no longer seek annulment.",
+        "The accused may invoke self-defense, but it will not prosper. The three requisites under Article 11 of the "
+        "Revised Penal Code are unlawful aggression, reasonable necessity of the means employed, and lack of sufficient "
+        "provocation. Unlawful aggression is the indispensable element, and it ceased when the victim ran away. When the "
+        "accused pursued and stabbed him, he became the aggressor. At most, incomplete self-defense is unavailable because "
+        "unlawful aggression is absent, so the accused is liable for homicide, with the mitigating circumstance of "
+        "voluntary surrender if he gave himself up to the authorities before arrest.",
+    ],
+}
+GENERAL_QUESTIONS = [
+    "What is the difference between void and voidable contracts?",
+    "Can you explain the doctrine of piercing the corporate veil?",
+    "Thanks! How should I review for remedial law?",
+    "What are the elements of estafa?",
+    "ok",
+    "Explain the rule on double jeopardy and when it attaches.",
+    "What's the prescriptive period for oral contracts?",
+]
+
+
+def build_user_script(rng, general_messages=3, exam_answers=8):
+    """
+    The messages one simulated student sends, in order: a greeting, their name,
+    "yes" to the marketing pitch, the mock exam answers (mixed short, medium and
+    long) and free-form GENERAL_BOT questions.
+    """
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    script = [
+        rng.choice(GREETINGS),
+        rng.choice(NAME_REPLIES).format(first=first, last=last),
+        rng.choice(MARKETING_REPLIES),
+    ]
+    for _ in range(exam_answers):
+        length = rng.choices(['short', 'medium', 'long'], weights=[2, 5, 3])[0]
+        script.append(rng.choice(EXAM_ANSWERS[length]))
+    script.extend(rng.choice(GENERAL_QUESTIONS) for _ in range(general_messages))
+    return script
+
+
+def arrival_offsets(users, arrival_rate, burst_size, rng):
+    """
+    Start offsets (seconds) for each simulated user. Users arrive in bursts of
+    burst_size; bursts follow a Poisson process so the average rate is arrival_rate
+    users per second. A rate of 0 starts everyone at once.
+    """
+    offsets = []
+    now = 0.0
+    burst_size = max(1, burst_size)
+    while len(offsets) < users:
+        offsets.extend([now] * min(burst_size, users - len(offsets)))
+        if arrival_rate:
+            now += rng.expovariate(arrival_rate / burst_size)
+    return offsets
+
+
+class _ReplyWatcher:
+    """Polls a fake Graph API /report to tell when a simulated user has been answered."""
+
+    def __init__(self, report_url, poll_interval=0.25):
+        self.report_url = report_url
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._fetched_at = 0.0
+
+    def message_count(self, recipient_id):
+        with self._lock:
+            if time.monotonic() - self._fetched_at >= self.poll_interval:
+                try:
+                    recipients = requests.get(self.report_url, timeout=10).json().get('recipients', {})
+                    self._counts = {key: len(value['messages']) for key, value in recipients.items()}
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    logger.warning(f"Could not fetch the Graph API report from {self.report_url}: {e}")
+                self._fetched_at = time.monotonic()
+            return self._counts.get(recipient_id, 0)
+
+    def wait_for_reply(self, recipient_id, baseline, timeout):
+        """
+        Waits until the recipient has received a reply on top of the loading message.
+        :return: Seconds waited, or None on timeout.
+        """
+        started = time.monotonic()
+        while time.monotonic() - started < timeout:
+            if self.message_count(recipient_id) >= baseline + 2:
+                return time.monotonic() - started
+            time.sleep(self.poll_interval)
+        return None
+
+
+def cleanup_load_test_users(prefix='loadtest-'):
+    """
+    Deletes the simulated users (ids starting with prefix, with their chat logs and exam
+    results) and their quota counters. Must run against the webhook server's database.
+    LLMUsage totals can't be told apart from real traffic and are left as they are.
+    :return: The number of users deleted.
+    """
+    from .models import User # Local import: the load test itself only talks HTTP
+    from .quotas import purge_user_quota_counters
+    purge_user_quota_counters(prefix)
+    deleted = User.objects.filter(user_id__startswith=prefix).count()
+    User.objects.filter(user_id__startswith=prefix).delete()
+    return deleted
+
+
+def run_load_test(webhook_url, users=10, arrival_rate=1.0, burst_size=1, think_time=5.0, general_messages=3,
+                  graph_report_url=None, reply_timeout=120.0, seed=None, prefix='loadtest-', request_timeout=30.0):
+    """
+    Simulates concurrent Messenger users posting to a running webhook, one thread per user.
+    Between messages each user "thinks" for an exponentially distributed time with mean
+    think_time. With graph_report_url (a fake Graph API /report endpoint) each user also
+    waits for the bot's reply before thinking, like a real student.
+    :return: A JSON-serializable summary.
+    """
+    rng = random.Random(seed)
+    offsets = arrival_offsets(users, arrival_rate, burst_size, rng)
+    watcher = _ReplyWatcher(graph_report_url) if graph_report_url else None
+    lock = threading.Lock()
+    webhook_latencies, reply_latencies = [], []
+    errors = []
+    stats = {'requests': 0, 'completed_users': 0, 'reply_timeouts': 0}
+    run_id = int(time.time())
+
+    def simulate_user(index, start_offset, script, user_rng):
+        sender_id = f"{prefix}{run_id}-{index}"
+        time.sleep(max(0.0, start_offset - (time.monotonic() - started)))
+        for sequence, text in enumerate(script):
+            baseline = watcher.message_count(sender_id) if watcher else 0
+            sent_at = time.monotonic()
+            try:
+                # Sequences restart for every user, so the sender id keeps message ids unique
+                payload = webhook_event_payload(sender_id, text, f"m_loadtest_{sender_id}_{sequence}", page_id='LOADTEST_PAGE')
+                response = requests.post(webhook_url, json=payload, timeout=request_timeout)
+                failed = response.status_code != 200 and f"HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                failed = str(e)
+            with lock:
+                stats['requests'] += 1
+                webhook_latencies.append(round((time.monotonic() - sent_at) * 1000, 2))
+                if failed:
+                    errors.append({'sender_id': sender_id, 'sequence': sequence, 'error': failed})
+            if failed:
+                return
+            if watcher:
+                waited = watcher.wait_for_reply(sender_id, baseline, reply_timeout)
+                with lock:
+                    if waited is None:
+                        stats['reply_timeouts'] += 1
+                    else:
+                        reply_latencies.append(round(waited * 1000, 2))
+            if sequence < len(script) - 1 and think_time:
+                time.sleep(user_rng.expovariate(1 / think_time))
+        with lock:
+            stats['completed_users'] += 1
+
+    threads = [
+        threading.Thread(
+            target=simulate_user,
+            args=(index, offset, build_user_script(rng, general_messages), random.Random(rng.random())),
+            daemon=True,
+        )
+        for index, offset in enumerate(offsets)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - started
+
+    def distribution(values):
+        return {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99), 'max': max(values) if values else None}
+
+    return {
+        'config': {
+            'webhook_url': webhook_url, 'users': users, 'arrival_rate': arrival_rate, 'burst_size': burst_size,
+            'think_time': think_time, 'general_messages': general_messages, 'seed': seed,
+            'waits_for_replies': bool(watcher),
+        },
+        'duration_seconds': round(duration, 3),
+        'requests': stats['requests'],
+        'requests_per_second': round(stats['requests'] / duration, 2) if duration else None,
+        'completed_users': stats['completed_users'],
+        'webhook_latency_ms': distribution(webhook_latencies),
+        'reply_latency_ms': distribution(reply_latencies) if watcher else None,
+        'reply_timeouts': stats['reply_timeouts'],
+        'errors': errors,
+    }
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from chat.chat_log_archive import archive_chat_logs
+
+
+class Command(BaseCommand):
+    help = ('Moves summarized (and optionally old) chat logs out of the ChatLog table into compressed '
+            'per-user, per-month ChatLogArchive chunks, one task queue task per batch of users. '
+            'Defaults come from the CHAT_LOG_ARCHIVE_* settings.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None, help='Also archive logs older than this, summarized or not.')
+        parser.add_argument('--keep-latest', type=int, default=None, help='Most recent logs per user that always stay in ChatLog.')
+        parser.add_argument('--users-per-batch', type=int, default=None, help='Users per enqueued archival task.')
+        parser.add_argument('--max-users', type=int, default=None, help='Stop after enqueuing this many users.')
+
+    def handle(self, *args, **options):
+        totals = archive_chat_logs(
+            older_than_days=options['older_than_days'],
+            keep_latest=options['keep_latest'],
+            users_per_batch=options['users_per_batch'],
+            max_users=options['max_users'],
+        )
+        if totals is None:
+            self.stdout.write(self.style.WARNING("Another archival run is in progress."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Enqueued archival of {totals['users']} users in {totals['batches']} tasks."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from chat.models import UserCategoryScore
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user, per-category exam score aggregates from existing ExamResult rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', dest='user_id', help='Only rebuild the aggregates of this user (Facebook PSID).')
+
+    def handle(self, *args, **options):
+        rows = UserCategoryScore.rebuild(user_id=options['user_id'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} category score aggregate(s)."))
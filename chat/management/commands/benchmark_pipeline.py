@@ -0,0 +1,44 @@
+import json
+from django.core.management.base import BaseCommand
+from chat.benchmark import run_pipeline_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks webhook-to-delivery across all stages with the simulated LLM backend and a fake Graph API, '
+            'and writes the results as JSON. Creates (and then deletes) synthetic users in the configured database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages-per-stage', type=int, default=10)
+        parser.add_argument('--workers', type=int, default=4, help='Local worker threads running the queued tasks (0 runs them inline).')
+        parser.add_argument('--llm-latency-ms', type=float, default=0, help='Median simulated LLM latency (lognormal).')
+        parser.add_argument('--llm-tokens-per-second', type=float, default=0, help='Simulated generation speed (0 for instant).')
+        parser.add_argument('--llm-error-rate', type=float, default=0.0)
+        parser.add_argument('--graph-latency-ms', type=float, default=0)
+        parser.add_argument('--arrival-interval-ms', type=float, default=0, help='Pause between incoming webhook requests.')
+        parser.add_argument('--label', default='', help='Name of this run, e.g., the release being measured.')
+        parser.add_argument('--output', help='Path of the JSON results file (printed to stdout if omitted).')
+
+    def handle(self, *args, **options):
+        llm_latency = options['llm_latency_ms']
+        results = run_pipeline_benchmark(
+            messages_per_stage=options['messages_per_stage'],
+            workers=options['workers'],
+            llm_simulation={
+                'latency_ms': {'distribution': 'lognormal', 'median': llm_latency, 'min': 0, 'max': max(llm_latency * 10, 1)},
+                'tokens_per_second': options['llm_tokens_per_second'],
+                'error_rate': options['llm_error_rate'],
+            },
+            graph_latency_ms=options['graph_latency_ms'],
+            arrival_interval_ms=options['arrival_interval_ms'],
+            label=options['label'],
+        )
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f"{results['messages']} messages, {results['throughput_messages_per_second']} msg/s, "
+                f"p95 {results['latency_ms']['p95']} ms. Results written to {options['output']}."
+            ))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,55 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from chat.synthetic_data import generate_synthetic_data, delete_synthetic_data, DEFAULT_STAGE_WEIGHTS, SYNTHETIC_PREFIX
+
+
+class Command(BaseCommand):
+    help = ('Bulk-generates synthetic users with chat logs, exam results and category scores for scale testing '
+            '(e.g., --users 1000000 --logs-per-user 50). Never run this against the production database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--logs-per-user', type=float, default=20, help='Mean ChatLogs per user.')
+        parser.add_argument('--questions', type=int, default=200, help='Minimum size of the question bank (topped up with synthetic questions).')
+        parser.add_argument('--days', type=float, default=90, help='Spread of last activity, skewed towards recent.')
+        parser.add_argument('--stages', default=json.dumps(DEFAULT_STAGE_WEIGHTS), help='JSON object of stage weights.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users built and inserted per transaction.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT statement.')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--delete', action='store_true', help='Remove previously generated synthetic data instead.')
+
+    def handle(self, *args, **options):
+        if options['delete']:
+            deleted = delete_synthetic_data()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} synthetic users and their data."))
+            return
+
+        try:
+            stage_weights = json.loads(options['stages'])
+        except json.JSONDecodeError as e:
+            raise CommandError(f"--stages is not valid JSON: {e}")
+        unknown = set(stage_weights) - set(DEFAULT_STAGE_WEIGHTS)
+        if unknown:
+            raise CommandError(f"Unknown stage(s) in --stages: {', '.join(sorted(unknown))}")
+
+        def report(totals):
+            self.stdout.write(
+                f"{totals['users']}/{options['users']} users, {totals['chat_logs']} chat logs, "
+                f"{totals['exam_results']} exam results ({totals['seconds']}s)"
+            )
+
+        totals = generate_synthetic_data(
+            users=options['users'],
+            logs_per_user=options['logs_per_user'],
+            questions=options['questions'],
+            days=options['days'],
+            stage_weights=stage_weights,
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            progress=report,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {totals.get('users', 0)} users (ids starting with '{SYNTHETIC_PREFIX}'). "
+            f"Remove them with --delete."
+        ))
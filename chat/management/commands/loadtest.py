@@ -0,0 +1,51 @@
+import json
+from django.core.management.base import BaseCommand
+from chat.loadtest import run_load_test, cleanup_load_test_users
+
+
+class Command(BaseCommand):
+    help = ('Simulates concurrent Messenger users (onboarding, marketing, an 8-question mock exam, then free chat) '
+            'posting to a running webhook. Pair with run_fake_graph_api and LLM_BACKEND set to the simulated backend '
+            'so no real messages or API calls are made. Simulated users are named loadtest-<run>-<n>; '
+            'remove them with --cleanup (against the webhook server\'s database).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/chat/webhook/', help='Webhook to post to.')
+        parser.add_argument('--users', type=int, default=10, help='Number of simulated users.')
+        parser.add_argument('--arrival-rate', type=float, default=1.0, help='Average new users per second (0 starts everyone at once).')
+        parser.add_argument('--burst-size', type=int, default=1, help='Users arriving together in each burst.')
+        parser.add_argument('--think-time', type=float, default=5.0, help='Mean seconds a user waits before their next message.')
+        parser.add_argument('--general-messages', type=int, default=3, help='Free-form GENERAL_BOT messages after the exam.')
+        parser.add_argument('--graph-report-url', help="A fake Graph API's /report URL; users then wait for each reply before thinking.")
+        parser.add_argument('--reply-timeout', type=float, default=120.0)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', help='Path of the JSON summary (printed to stdout if omitted).')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Only delete the loadtest-* users of earlier runs (and their quota counters), then exit.')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted = cleanup_load_test_users()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} simulated users."))
+            return
+        summary = run_load_test(
+            webhook_url=options['url'],
+            users=options['users'],
+            arrival_rate=options['arrival_rate'],
+            burst_size=options['burst_size'],
+            think_time=options['think_time'],
+            general_messages=options['general_messages'],
+            graph_report_url=options['graph_report_url'],
+            reply_timeout=options['reply_timeout'],
+            seed=options['seed'],
+        )
+        output = json.dumps(summary, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f"{summary['requests']} requests from {summary['completed_users']}/{options['users']} users in "
+                f"{summary['duration_seconds']}s. Summary written to {options['output']}."
+            ))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from chat.fake_graph_api import FakeGraphAPIServer
+
+
+class Command(BaseCommand):
+    help = 'Runs a local fake of the Messenger Send API for load tests (see chat.fake_graph_api).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, nargs='+', default=[0], help='Fixed delay, or a min and max for a uniform delay.')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='Probability of answering with error #613.')
+        parser.add_argument('--unreachable', default='', help='Comma-separated recipient ids answered with error 2018001.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        latency = options['latency_ms']
+        server = FakeGraphAPIServer(
+            host=options['host'],
+            port=options['port'],
+            latency_ms=tuple(latency[:2]) if len(latency) > 1 else latency[0],
+            throttle_rate=options['throttle_rate'],
+            unreachable_recipients=[r for r in options['unreachable'].split(',') if r],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Fake Graph API listening. Set FACEBOOK_GRAPH_API_URL={server.messages_url}"))
+        self.stdout.write(f"Traffic report: GET {server.base_url}/report, reset: POST {server.base_url}/reset")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
@@ -3,27 +3,82 @@ import logging
 import requests
 from django.conf import settings
 from chat.models import User # Import the User model
+from chat.request_context import get_context_user
 import os 
+import threading
+import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
-# Facebook Graph API base URL
+# Facebook Graph API Send API URL (settings.FACEBOOK_GRAPH_API_URL overrides it, e.g., for a local fake server)
 GRAPH_API_URL = "https://graph.facebook.com/v24.0/me/messages"
 
-def _get_user_by_fb_id(fb_id: str):
-    """Helper function to safely retrieve a User object by fb_id."""
-    try:
-        return User.objects.get(user_id=fb_id)
-    except User.DoesNotExist:
+def _graph_api_url():
+    return getattr(settings, 'FACEBOOK_GRAPH_API_URL', None) or GRAPH_API_URL
+
+# Process-local LRU cache of recipients' reachability: {fb_id: (is_reachable, expires_at)}, holding
+# at most settings.MESSENGER_REACHABILITY_CACHE_SIZE recipients.
+# Used when no User is loaded for the current request (e.g., in the webhook view).
+_reachability_cache = OrderedDict()
+_reachability_lock = threading.Lock()
+
+def _remember_reachability(fb_id, is_reachable):
+    ttl = getattr(settings, 'MESSENGER_REACHABILITY_CACHE_TTL', 60)
+    max_size = getattr(settings, 'MESSENGER_REACHABILITY_CACHE_SIZE', 10000)
+    with _reachability_lock:
+        _reachability_cache[fb_id] = (is_reachable, time.monotonic() + ttl)
+        _reachability_cache.move_to_end(fb_id)
+        while len(_reachability_cache) > max_size:
+            _reachability_cache.popitem(last=False) # Least recently used
+
+def _is_messenger_reachable(fb_id: str) -> bool:
+    """
+    Returns whether a recipient can be messaged, preferring the User already loaded
+    for this request, then the local cache, and only then the database.
+    Unknown users are considered reachable.
+    """
+    user = get_context_user(fb_id)
+    if user is not None:
+        return user.is_messenger_reachable
+
+    with _reachability_lock:
+        cached = _reachability_cache.get(fb_id)
+        if cached is not None and cached[1] > time.monotonic():
+            _reachability_cache.move_to_end(fb_id)
+            return cached[0]
+
+    is_reachable = User.objects.filter(user_id=fb_id).values_list('is_messenger_reachable', flat=True).first()
+    if is_reachable is None:
         logger.debug(f"User with fb_id {fb_id} not found in the database.")
-        return None
+        is_reachable = True
+    _remember_reachability(fb_id, is_reachable)
+    return is_reachable
+
+def forget_reachability(fb_id: str):
+    """Drops the cached reachability of a recipient (called when the User row changes)."""
+    with _reachability_lock:
+        _reachability_cache.pop(fb_id, None)
+
+def clear_reachability_cache():
+    """Empties the local reachability cache."""
+    with _reachability_lock:
+        _reachability_cache.clear()
+
+def _mark_unreachable(fb_id: str):
+    """Flags a recipient as unreachable after Facebook reports error 2018001."""
+    if User.objects.filter(user_id=fb_id).update(is_messenger_reachable=False):
+        logger.warning(f"User {fb_id} marked as unreachable due to Facebook API error.")
+    user = get_context_user(fb_id)
+    if user is not None:
+        user.is_messenger_reachable = False
+    _remember_reachability(fb_id, False)
 
 def send_messenger_message(recipient_id, message_text):
     """
     Sends a text message to a Facebook Messenger user.
     """
-    user = _get_user_by_fb_id(recipient_id)
-    if user and not user.is_messenger_reachable:
+    if not _is_messenger_reachable(recipient_id):
         logger.warning(f"Skipping message to unreachable user {recipient_id}.")
         return False
 
@@ -48,7 +103,7 @@ def send_messenger_message(recipient_id, message_text):
     })
     
     try:
-        response = requests.post(GRAPH_API_URL, params=params, headers=headers, data=data)
+        response = requests.post(_graph_api_url(), params=params, headers=headers, data=data)
         response.raise_for_status() # Raise an exception for HTTP errors
         logger.info(f"Message sent to {recipient_id}: {message_text}")
         logger.info(f"Facebook API response: {response.json()}")
@@ -64,10 +119,7 @@ def send_messenger_message(recipient_id, message_text):
             error_data = json.loads(error_response)
             if error_data.get("error", {}).get("code") == 100 and \
                error_data.get("error", {}).get("error_subcode") == 2018001:
-                if user:
-                    user.is_messenger_reachable = False
-                    user.save()
-                    logger.warning(f"User {recipient_id} marked as unreachable due to Facebook API error.")
+                _mark_unreachable(recipient_id)
         except json.JSONDecodeError:
             logger.error(f"Could not decode JSON from error response: {error_response}")
         
@@ -80,8 +132,7 @@ def send_sender_action(recipient_id, action):
     """
     Sends a sender action (e.g., 'typing_on', 'typing_off', 'mark_seen') to a Facebook Messenger user.
     """
-    user = _get_user_by_fb_id(recipient_id)
-    if user and not user.is_messenger_reachable:
+    if not _is_messenger_reachable(recipient_id):
         logger.debug(f"Skipping sender action '{action}' to unreachable user {recipient_id}.")
         return False
 
@@ -99,7 +150,7 @@ def send_sender_action(recipient_id, action):
     })
 
     try:
-        response = requests.post(GRAPH_API_URL, params=params, headers=headers, data=data)
+        response = requests.post(_graph_api_url(), params=params, headers=headers, data=data)
         response.raise_for_status()
         logger.info(f"Sender action '{action}' sent to {recipient_id}")
         return True
@@ -113,10 +164,7 @@ def send_sender_action(recipient_id, action):
             error_data = json.loads(error_response)
             if error_data.get("error", {}).get("code") == 100 and \
                error_data.get("error", {}).get("error_subcode") == 2018001:
-                if user:
-                    user.is_messenger_reachable = False
-                    user.save()
-                    logger.warning(f"User {recipient_id} marked as unreachable due to Facebook API error.")
+                _mark_unreachable(recipient_id)
         except json.JSONDecodeError:
             logger.error(f"Could not decode JSON from error response: {error_response}")
         
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 07:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_alter_user_gpt_5_2_last_reset_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_number', models.IntegerField()),
+                ('answer_text', models.TextField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('GRADED', 'Graded'), ('DELIVERED', 'Delivered')], default='PENDING', max_length=20)),
+                ('feedback', models.JSONField(blank=True, null=True)),
+                ('is_final', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.user')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
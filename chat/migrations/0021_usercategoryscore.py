@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-19 07:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_category_scores(apps, schema_editor):
+    ExamResult = apps.get_model('chat', 'ExamResult')
+    UserCategoryScore = apps.get_model('chat', 'UserCategoryScore')
+    totals = ExamResult.objects.values('user_id', 'question__category').annotate(total=Sum('score'), count=Count('id'))
+    UserCategoryScore.objects.bulk_create([
+        UserCategoryScore(user_id=row['user_id'], category=row['question__category'], total_score=row['total'], result_count=row['count'])
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0020_examsubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCategoryScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=50)),
+                ('total_score', models.IntegerField(default=0)),
+                ('result_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.user')),
+            ],
+            options={
+                'ordering': ['id'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'category'), name='unique_user_category_score')],
+            },
+        ),
+        migrations.RunPython(backfill_category_scores, migrations.RunPython.noop),
+    ]
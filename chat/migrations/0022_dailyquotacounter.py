@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-19 08:00
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def carry_over_todays_gpt_5_2_usage(apps, schema_editor):
+    User = apps.get_model('chat', 'User')
+    DailyQuotaCounter = apps.get_model('chat', 'DailyQuotaCounter')
+    today = timezone.now().date()
+    users = User.objects.filter(gpt_5_2_last_reset_date=today, gpt_5_2_daily_count__gt=0)
+    DailyQuotaCounter.objects.bulk_create([
+        DailyQuotaCounter(name='gpt-5.2', scope=f"user:{user_id}", day=today, count=count)
+        for user_id, count in users.values_list('user_id', 'gpt_5_2_daily_count')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0021_usercategoryscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyQuotaCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('scope', models.CharField(max_length=120)),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('name', 'scope', 'day'), name='unique_daily_quota_counter')],
+            },
+        ),
+        migrations.RunPython(carry_over_todays_gpt_5_2_usage, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='user',
+            name='gpt_5_2_daily_count',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='gpt_5_2_last_reset_date',
+        ),
+    ]
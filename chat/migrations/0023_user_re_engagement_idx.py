@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0022_dailyquotacounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['current_stage', 're_engagement_stage_index', 'last_interaction_timestamp'], name='user_re_engagement_idx'),
+        ),
+    ]
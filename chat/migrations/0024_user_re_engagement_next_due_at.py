@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-19 08:05
+
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import F, Q
+
+# Window start hours of each re-engagement stage at the time of this migration
+RE_ENGAGEMENT_WINDOW_STARTS = [1, 5, 11, 21]
+
+
+def backfill_next_due_at(apps, schema_editor):
+    User = apps.get_model('chat', 'User')
+    users = User.objects.filter(
+        current_stage__in=['ONBOARDING', 'MARKETING', 'GENERAL_BOT'],
+        last_interaction_timestamp__isnull=False,
+    )
+    for index, min_hours in enumerate(RE_ENGAGEMENT_WINDOW_STARTS):
+        stage_filter = Q(re_engagement_stage_index=index)
+        if index == 0:
+            stage_filter |= Q(re_engagement_stage_index__isnull=True)
+        users.filter(stage_filter).update(
+            re_engagement_next_due_at=F('last_interaction_timestamp') + timedelta(hours=min_hours)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0023_user_re_engagement_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_re_engagement_idx',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='re_engagement_next_due_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['re_engagement_next_due_at'], name='user_re_engagement_due_idx'),
+        ),
+        migrations.RunPython(backfill_next_due_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0024_user_re_engagement_next_due_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReEngagementRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('due_users', models.IntegerField(default=0)),
+                ('completed_users', models.IntegerField(default=0)),
+                ('total_chunks', models.IntegerField(default=0)),
+                ('completed_chunks', models.IntegerField(default=0)),
+                ('sent_count', models.IntegerField(default=0)),
+                ('skipped_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0025_reengagementrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('run_id', models.CharField(max_length=36)),
+                ('expires_at', models.DateTimeField()),
+                ('acquired_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reengagementrun',
+            name='lease_run_id',
+            field=models.CharField(blank=True, default='', max_length=36),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-19 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0026_joblease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReEngagementDraft',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage_index', models.IntegerField()),
+                ('based_on_interaction', models.DateTimeField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('READY', 'Ready'), ('FAILED', 'Failed'), ('SENT', 'Sent')], default='PENDING', max_length=20)),
+                ('message', models.TextField(blank=True, null=True)),
+                ('batch_id', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'batch_id'], name='re_engagement_draft_batch_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'stage_index', 'based_on_interaction'), name='unique_re_engagement_draft')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0028_settable_log_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatlog',
+            index=models.Index(fields=['user', 'timestamp'], name='chatlog_user_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examresult',
+            index=models.Index(fields=['user', 'question'], name='examresult_user_question_idx'),
+        ),
+    ]
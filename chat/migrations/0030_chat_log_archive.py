@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-19 08:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_summarized_through(apps, schema_editor):
+    # Summarization used to always fold in the user's oldest 14 logs
+    User = apps.get_model('chat', 'User')
+    ChatLog = apps.get_model('chat', 'ChatLog')
+    for user_id in User.objects.exclude(summary__isnull=True).exclude(summary='').values_list('user_id', flat=True).iterator():
+        fourteenth = ChatLog.objects.filter(user_id=user_id).order_by('timestamp', 'id').values_list('id', flat=True)[13:14]
+        if fourteenth:
+            User.objects.filter(user_id=user_id).update(summarized_through_log_id=fourteenth[0])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0029_chatlog_examresult_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='summarized_through_log_id',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ChatLogArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('chunk', models.PositiveIntegerField(default=1)),
+                ('codec', models.CharField(choices=[('gzip', 'gzip'), ('zstd', 'Zstandard')], default='gzip', max_length=10)),
+                ('data', models.BinaryField()),
+                ('log_count', models.PositiveIntegerField()),
+                ('first_log_id', models.BigIntegerField()),
+                ('last_log_id', models.BigIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.user')),
+            ],
+            options={
+                'ordering': ['user', 'month', 'chunk'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'month', 'chunk'), name='unique_chat_log_archive_chunk')],
+            },
+        ),
+        migrations.RunPython(backfill_summarized_through, migrations.RunPython.noop),
+    ]
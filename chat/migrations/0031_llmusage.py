@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0030_chat_log_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('call_type', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=50)),
+                ('calls', models.IntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('cached_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'LLM usage',
+                'verbose_name_plural': 'LLM usage',
+                'constraints': [models.UniqueConstraint(fields=('day', 'call_type', 'model'), name='unique_llm_usage')],
+            },
+        ),
+    ]
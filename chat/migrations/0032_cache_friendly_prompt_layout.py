@@ -0,0 +1,62 @@
+# Generated by Django 5.2 on 2026-10-19 08:38
+
+from django.db import migrations
+
+# Default user prompt templates reordered so fixed instructions come before per-call values (see chat.prompt_layout).
+# Only rows still holding the previous default are updated; prompts edited in the admin are left alone.
+# (name, previous default, new default)
+REORDERED_PROMPTS = [
+    (
+        'QUICK_REPLY_USER_PROMPT_TEMPLATE',
+        'Based on this conversation: {conversation_history}, provide a quick, one-sentence reply.',
+        'Provide a quick, one-sentence reply based on this conversation:\n{conversation_history}',
+    ),
+    (
+        'SUMMARIZE_USER_PROMPT_WITH_EXISTING_SUMMARY_TEMPLATE',
+        'Here is a previous summary: {existing_summary}. Summarize the following new conversation chunk and merge it with the previous summary, keeping it under 1000 characters: {conversation_chunk}',
+        'Summarize the following new conversation chunk and merge it with the previous summary, keeping it under 1000 characters.\nPrevious summary: {existing_summary}\nNew conversation chunk:\n{conversation_chunk}',
+    ),
+    (
+        'SUMMARIZE_USER_PROMPT_WITHOUT_EXISTING_SUMMARY_TEMPLATE',
+        'Summarize the following conversation chunk under 1000 characters: {conversation_chunk}',
+        'Summarize the following conversation chunk under 1000 characters.\nConversation chunk:\n{conversation_chunk}',
+    ),
+    (
+        'GRADE_EXAM_USER_PROMPT_TEMPLATE',
+        '\nPlease grade the following legal exam answer provided by a user. The goal is to assess how well the user\'s answer aligns with the provided Expected Answer.\n\nHere are the details:\n\nQuestion:\n{question_text}\n\nUser\'s Answer:\n{user_answer}\n\nExpected Answer / Key Points (This is the lawyer\'s ideal answer):\n{expected_answer}\n\nBased on the alignment between the "User\'s Answer" and the "Expected Answer / Key Points", provide feedback on the following 5 points and assign a score out of 100. The closer the user\'s answer is to the Expected Answer, the higher the score.\n\nThe output MUST be a JSON object with the following keys:\n- "legal_writing_feedback": (String) Feedback on the legal writing, spelling, and professional legal tone.\n- "legal_basis_feedback": (String) Feedback on whether relevant laws, legal principles, and jurisprudence were correctly cited and applied.\n- "application_feedback": (String) Feedback on how effectively the law was applied to the facts presented in the question.\n- "conclusion_feedback": (String) Feedback on the correctness and clarity of the final answer or conclusion.\n- "score": (Integer) A numerical score between 1 and 100.\n',
+        '\nPlease grade the following legal exam answer provided by a user. The goal is to assess how well the user\'s answer aligns with the provided Expected Answer.\n\nBased on the alignment between the "User\'s Answer" and the "Expected Answer / Key Points", provide feedback on the following 5 points and assign a score out of 100. The closer the user\'s answer is to the Expected Answer, the higher the score.\n\nThe output MUST be a JSON object with the following keys:\n- "legal_writing_feedback": (String) Feedback on the legal writing, spelling, and professional legal tone.\n- "legal_basis_feedback": (String) Feedback on whether relevant laws, legal principles, and jurisprudence were correctly cited and applied.\n- "application_feedback": (String) Feedback on how effectively the law was applied to the facts presented in the question.\n- "conclusion_feedback": (String) Feedback on the correctness and clarity of the final answer or conclusion.\n- "score": (Integer) A numerical score between 1 and 100.\n\nHere are the details:\n\nQuestion:\n{question_text}\n\nExpected Answer / Key Points (This is the lawyer\'s ideal answer):\n{expected_answer}\n\nUser\'s Answer:\n{user_answer}\n',
+    ),
+    (
+        'RE_ENGAGEMENT_USER_PROMPT_TEMPLATE',
+        'The user\'s first name is \'{first_name}\'. They are currently in the \'{current_stage}\' stage. Their summary is: "{user_summary}".\nHere\'s a brief snippet of their recent conversation history, if available:\n{conversation_history}\n\nPlease generate a re-engagement message that is most suitable for this user based on the system guidelines.\n',
+        'Please generate a re-engagement message that is most suitable for this user based on the system guidelines, using their details and recent conversation below.\n\nThe user\'s first name is \'{first_name}\'. They are currently in the \'{current_stage}\' stage. Their summary is: "{user_summary}".\nHere\'s a brief snippet of their recent conversation history, if available:\n{conversation_history}\n',
+    ),
+    (
+        'ASSESSMENT_USER_PROMPT_TEMPLATE',
+        "A student has completed a mock bar exam. Here is their performance aggregated by legal category:\n\n{categorized_scores}\n\nPlease provide a personalized assessment highlighting the student's strengths based on these results.\nExample format for categorized_scores:\n- Criminal Law (Avg Score: 85)\n- Civil Law (Avg Score: 92)\n- Labor Law (Avg Score: 78)\n",
+        "A student has completed a mock bar exam. Please provide a personalized assessment highlighting the student's strengths based on their performance aggregated by legal category, given below in this format:\n- Criminal Law (Avg Score: 85)\n- Civil Law (Avg Score: 92)\n- Labor Law (Avg Score: 78)\n\nHere is their performance:\n\n{categorized_scores}\n",
+    ),
+]
+
+
+def reorder_prompts(apps, schema_editor):
+    Prompt = apps.get_model('chat', 'Prompt')
+    for name, previous, new in REORDERED_PROMPTS:
+        Prompt.objects.filter(name=name, text_content=previous).update(text_content=new)
+
+
+def restore_prompts(apps, schema_editor):
+    Prompt = apps.get_model('chat', 'Prompt')
+    for name, previous, new in REORDERED_PROMPTS:
+        Prompt.objects.filter(name=name, text_content=new).update(text_content=previous)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0031_llmusage'),
+    ]
+
+    operations = [
+        migrations.RunPython(reorder_prompts, restore_prompts),
+    ]
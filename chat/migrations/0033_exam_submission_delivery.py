@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0032_cache_friendly_prompt_layout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='examsubmission',
+            name='grading_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='examsubmission',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('GRADED', 'Graded'), ('FEEDBACK_SENT', 'Feedback sent'), ('DELIVERED', 'Delivered')], default='PENDING', max_length=20),
+        ),
+    ]
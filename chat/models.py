@@ -1,8 +1,106 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Sum, Count
 from legal.models import Course # Import the Course model
 from django.utils import timezone # Import timezone for default date
+from contextlib import contextmanager
+from datetime import timedelta
+from .chat_log_buffer import active_chat_log_buffer
 
-class User(models.Model):
+# Re-engagement windows as (min_hours, max_hours) of inactivity, one per stage.
+RE_ENGAGEMENT_INTERVALS = [
+    (1, 2),    # Stage 1: 1 to 2 hours
+    (5, 6),    # Stage 2: 5 to 6 hours
+    (11, 12),  # Stage 3: 11 to 12 hours
+    (21, 22),  # Stage 4: 21 to 22 hours
+]
+RE_ENGAGEMENT_STAGES = ['ONBOARDING', 'MARKETING', 'GENERAL_BOT'] # Stages whose users get re-engagement messages
+
+class DirtyFieldsMixin:
+    """
+    Tracks which concrete fields changed since the instance was loaded or last saved,
+    so save() only writes those columns (and skips the UPDATE when nothing changed).
+    Inside coalesce_saves(), repeated save() calls are collapsed into a single flush.
+    """
+    _coalesce_depth = 0
+    _save_requested = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_fields()
+        return instance
+
+    def _field_values(self):
+        # Deferred fields are not in __dict__ and are never reported as dirty
+        return {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    def _snapshot_fields(self):
+        self._saved_values = self._field_values()
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or getattr(self, '_saved_values', None) is None:
+            self._snapshot_fields()
+        else:
+            # Only the reloaded fields are clean again; other pending changes stay dirty
+            current_values = self._field_values()
+            for name in fields:
+                attname = self._meta.get_field(name).attname
+                if attname in current_values:
+                    self._saved_values[attname] = current_values[attname]
+
+    def get_dirty_fields(self):
+        """
+        Returns the attnames of fields changed since the last load/save,
+        or None when the instance has no saved state to compare against.
+        """
+        saved_values = getattr(self, '_saved_values', None)
+        if saved_values is None:
+            return None
+        return [
+            name for name, value in self._field_values().items()
+            if name not in saved_values or saved_values[name] != value
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._coalesce_depth:
+            self._save_requested = True # Written once when the outermost coalesce_saves() block exits
+            return
+
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert') and not args:
+            dirty_fields = self.get_dirty_fields()
+            if dirty_fields is not None:
+                if not dirty_fields:
+                    return # Nothing changed, skip the UPDATE
+                kwargs['update_fields'] = dirty_fields
+
+        super().save(*args, **kwargs)
+        self._snapshot_fields()
+
+    @contextmanager
+    def coalesce_saves(self):
+        """
+        Collapses every save() made inside the block into one UPDATE of the changed
+        fields when the block exits. Nothing is written if the block raises.
+        """
+        self._coalesce_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._coalesce_depth -= 1
+            if not self._coalesce_depth:
+                self._save_requested = False
+            raise
+        self._coalesce_depth -= 1
+        if not self._coalesce_depth and self._save_requested:
+            self._save_requested = False
+            self.save()
+
+class User(DirtyFieldsMixin, models.Model):
     # Enum for current_stage
     STAGE_CHOICES = [
         ('ONBOARDING', 'Onboarding'),
@@ -41,14 +139,42 @@ class User(models.Model):
     last_re_engagement_message_sent_at = models.DateTimeField(blank=True, null=True) # Timestamp of when the last re-engagement message was sent
     is_registered_website_user = models.BooleanField(default=False)
     is_messenger_reachable = models.BooleanField(default=True)
+    re_engagement_next_due_at = models.DateTimeField(blank=True, null=True, editable=False) # When the next re-engagement stage opens; kept up to date by save()
+    summarized_through_log_id = models.BigIntegerField(default=0, editable=False) # ChatLogs up to this id are folded into summary (and may be archived)
 
-    # New fields for gpt-5.2 usage tracking
-    gpt_5_2_daily_count = models.IntegerField(default=0)
-    gpt_5_2_last_reset_date = models.DateField(default=timezone.now)
+    # Fields that determine re_engagement_next_due_at
+    RE_ENGAGEMENT_SCHEDULE_FIELDS = {'current_stage', 'last_interaction_timestamp', 're_engagement_stage_index'}
+
+    class Meta:
+        indexes = [
+            # Serves the re-engagement dispatcher's "who is due now" query
+            models.Index(fields=['re_engagement_next_due_at'], name='user_re_engagement_due_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} ({self.user_id})"
 
+    def compute_re_engagement_next_due_at(self):
+        """
+        Returns when the user's next re-engagement window opens, or None when no
+        further message is scheduled (no interaction yet, all stages sent, or in a
+        stage that isn't re-engaged).
+        """
+        if (self.last_interaction_timestamp is None
+                or self.current_stage not in RE_ENGAGEMENT_STAGES
+                or (self.re_engagement_stage_index or 0) >= len(RE_ENGAGEMENT_INTERVALS)):
+            return None
+        min_hours = RE_ENGAGEMENT_INTERVALS[self.re_engagement_stage_index or 0][0]
+        return self.last_interaction_timestamp + timedelta(hours=min_hours)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if not self._coalesce_depth and (update_fields is None or self.RE_ENGAGEMENT_SCHEDULE_FIELDS & set(update_fields)):
+            self.re_engagement_next_due_at = self.compute_re_engagement_next_due_at()
+            if update_fields is not None and 're_engagement_next_due_at' not in update_fields:
+                kwargs['update_fields'] = list(update_fields) + ['re_engagement_next_due_at']
+        super().save(*args, **kwargs)
+
 class Question(models.Model):
     CATEGORY_CHOICES = [
         ('CRIMINAL_LAW', 'Criminal Law'),
@@ -66,10 +192,33 @@ class Question(models.Model):
     question_text = models.TextField()
     expected_answer = models.TextField()
 
+    def save(self, *args, **kwargs):
+        # UserCategoryScore totals results by question category; moving a question moves its results
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous_category = Question.objects.filter(pk=self.pk).values_list('category', flat=True).first()
+            super().save(*args, **kwargs)
+            if previous_category is not None and previous_category != self.category:
+                user_ids = list(ExamResult.objects.filter(question=self).values_list('user_id', flat=True).distinct())
+                if user_ids:
+                    UserCategoryScore.rebuild(user_ids=user_ids, category=previous_category)
+                    UserCategoryScore.rebuild(user_ids=user_ids, category=self.category)
 
     def __str__(self):
         return f"{self.category}: {self.question_text[:50]}..."
 
+class ChatLogManager(models.Manager):
+    def create(self, **kwargs):
+        """Inside buffer_chat_logs(), queues the log for one bulk INSERT instead of writing it now."""
+        buffer = active_chat_log_buffer()
+        if buffer is None:
+            return super().create(**kwargs)
+        log = self.model(**kwargs)
+        buffer.add(log)
+        return log
+
+
 class ChatLog(models.Model):
     SENDER_TYPE_CHOICES = [
         ('USER', 'User'),
@@ -80,12 +229,54 @@ class ChatLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE) # FK to Users
     sender_type = models.CharField(max_length=20, choices=SENDER_TYPE_CHOICES)
     message_content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False) # A default rather than auto_now_add so imports and generated data can set it
+
+    objects = ChatLogManager()
+
+    class Meta:
+        indexes = [
+            # Latest-N / chronological history of one user. (user, id) order needs no extra
+            # index: InnoDB and SQLite secondary indexes already end with the primary key.
+            models.Index(fields=['user', 'timestamp'], name='chatlog_user_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender_type} - {self.user.user_id} - {self.timestamp}"
 
 
+class ChatLogArchive(models.Model):
+    """
+    Cold storage for ChatLog rows moved out of the hot table by chat.chat_log_archive:
+    one compressed JSONL chunk of a user's logs for one calendar month. A user-month
+    can hold several chunks, one per archival pass.
+    """
+    CODEC_CHOICES = [
+        ('gzip', 'gzip'),
+        ('zstd', 'Zstandard'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()  # First day of the month the logs were written in
+    chunk = models.PositiveIntegerField(default=1)
+    codec = models.CharField(max_length=10, choices=CODEC_CHOICES, default='gzip')
+    data = models.BinaryField()
+    log_count = models.PositiveIntegerField()
+    first_log_id = models.BigIntegerField()
+    last_log_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'chunk'], name='unique_chat_log_archive_chunk'),
+        ]
+        ordering = ['user', 'month', 'chunk']
+
+    def __str__(self):
+        return f"{self.log_count} logs of {self.user_id} for {self.month:%Y-%m} (chunk {self.chunk})"
+
+
 class ExamResult(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
@@ -94,11 +285,262 @@ class ExamResult(models.Model):
     legal_basis_feedback = models.TextField(blank=True, null=True)
     application_feedback = models.TextField(blank=True, null=True)
     conclusion_feedback = models.TextField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Per-user joins to Question for the category aggregates and strength assessment
+            models.Index(fields=['user', 'question'], name='examresult_user_question_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the per-category aggregate in the same transaction as the result itself
+        adding = self._state.adding
+        with transaction.atomic():
+            previous = None
+            if not adding:
+                # The result may be moving to another user or question category
+                previous = ExamResult.objects.filter(pk=self.pk).values_list('user_id', 'question__category').first()
+            super().save(*args, **kwargs)
+            if adding:
+                UserCategoryScore.add_score(self.user_id, self.question.category, self.score)
+                return
+            current = (self.user_id, self.question.category)
+            for user_id, category in {current, previous} - {None}:
+                UserCategoryScore.rebuild(user_id=user_id, category=category)
 
     def __str__(self):
         return f"Exam Result for {self.user.first_name} on Question {self.question.id} - Score: {self.score}"
 
+class UserCategoryScore(models.Model):
+    """
+    Running score totals per user and question category, maintained whenever
+    an ExamResult is written so assessments never rescan the user's history.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    category = models.CharField(max_length=50)
+    total_score = models.IntegerField(default=0)
+    result_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='unique_user_category_score'),
+        ]
+        ordering = ['id']
+
+    @property
+    def average_score(self):
+        return self.total_score / self.result_count if self.result_count else 0
+
+    @classmethod
+    def _increment(cls, user_id, category, score, count):
+        return cls.objects.filter(user_id=user_id, category=category).update(
+            total_score=F('total_score') + score,
+            result_count=F('result_count') + count,
+            updated_at=timezone.now(),
+        )
+
+    @classmethod
+    def add_score(cls, user_id, category, score):
+        """
+        Atomically adds one exam score to the user's category totals.
+        """
+        if cls._increment(user_id, category, score, 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, category=category, total_score=score, result_count=1)
+        except IntegrityError:
+            # Another worker created the row first; fall back to the increment
+            cls._increment(user_id, category, score, 1)
+
+    @classmethod
+    def rebuild(cls, user_id=None, category=None, user_ids=None):
+        """
+        Recomputes totals from ExamResult rows. With no arguments every user is
+        backfilled; user_id (or several user_ids) and/or category narrow the rebuild.
+        :return: The number of aggregate rows written.
+        """
+        results = ExamResult.objects.all()
+        existing = cls.objects.all()
+        if user_id is not None:
+            results = results.filter(user_id=user_id)
+            existing = existing.filter(user_id=user_id)
+        if user_ids is not None:
+            results = results.filter(user_id__in=user_ids)
+            existing = existing.filter(user_id__in=user_ids)
+        if category is not None:
+            results = results.filter(question__category=category)
+            existing = existing.filter(category=category)
+
+        totals = results.values('user_id', 'question__category').annotate(total=Sum('score'), count=Count('id'))
+        with transaction.atomic():
+            existing.delete()
+            cls.objects.bulk_create([
+                cls(user_id=row['user_id'], category=row['question__category'], total_score=row['total'], result_count=row['count'])
+                for row in totals
+            ], batch_size=1000)
+        return len(totals)
+
+class ExamSubmission(models.Model):
+    """
+    An exam answer waiting for (or done with) asynchronous grading.
+    Submissions are delivered back to the user strictly in creation order.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('GRADED', 'Graded'),
+        ('FEEDBACK_SENT', 'Feedback sent'),  # Final submission: feedback sent, strength assessment not yet
+        ('DELIVERED', 'Delivered'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    question_number = models.IntegerField()  # 1-8, position of the question in the exam
+    answer_text = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    feedback = models.JSONField(blank=True, null=True)  # Raw grading result from the AI
+    is_final = models.BooleanField(default=False)  # Last question of the exam, triggers the strength assessment
+    created_at = models.DateTimeField(auto_now_add=True)
+    grading_started_at = models.DateTimeField(blank=True, null=True)  # Latest grading attempt, to spot stuck ones
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Submission {self.question_number}/8 for {self.user.user_id} - {self.status}"
+
+class DailyQuotaCounter(models.Model):
+    """
+    Usage counter for one quota (e.g., an AI model) and one scope (a user or
+    'global') on one UTC day. Incremented with conditional UPDATEs, see chat.quotas.
+    """
+    name = models.CharField(max_length=100)  # Quota name, e.g. 'gpt-5.2'
+    scope = models.CharField(max_length=120)  # 'global' or 'user:<PSID>'
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'scope', 'day'], name='unique_daily_quota_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} [{self.scope}] {self.day}: {self.count}"
+
+class LLMUsage(models.Model):
+    """
+    Token usage of the LLM calls of one call type (the prompt category, e.g. 'GENERAL_BOT')
+    and model on one UTC day, including the prompt tokens served from the upstream prompt
+    cache. Incremented with UPDATEs after every upstream call, see chat.llm_usage.
+    """
+    day = models.DateField()
+    call_type = models.CharField(max_length=50)
+    model = models.CharField(max_length=50)
+    calls = models.IntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    cached_tokens = models.BigIntegerField(default=0) # Part of prompt_tokens read from the prompt cache
+    completion_tokens = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "LLM usage"
+        verbose_name_plural = "LLM usage"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'call_type', 'model'], name='unique_llm_usage'),
+        ]
+
+    @property
+    def cache_hit_rate(self):
+        """Share of prompt tokens that were cached."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def __str__(self):
+        return f"{self.call_type} ({self.model}) {self.day}: {self.calls} calls"
+
+class ReEngagementDraft(models.Model):
+    """
+    A re-engagement message generated ahead of time (see chat.re_engagement_drafts).
+    A draft is only used for the stage and the last interaction it was written for.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('READY', 'Ready'),
+        ('FAILED', 'Failed'),
+        ('SENT', 'Sent'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    stage_index = models.IntegerField()  # 0-based index into RE_ENGAGEMENT_INTERVALS
+    based_on_interaction = models.DateTimeField()  # User's last_interaction_timestamp when the draft was requested
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    message = models.TextField(blank=True, null=True)
+    batch_id = models.CharField(max_length=100, blank=True, default='')  # Bulk job the draft was generated in
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'stage_index', 'based_on_interaction'], name='unique_re_engagement_draft'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'batch_id'], name='re_engagement_draft_batch_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stage {self.stage_index + 1} draft for {self.user_id} - {self.status}"
+
+class JobLease(models.Model):
+    """
+    Time-limited exclusive lease on a named job, so a periodic job runs on only
+    one worker/node at a time. See chat.leases.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    run_id = models.CharField(max_length=36)  # Identifies the holder; only it may release the lease
+    expires_at = models.DateTimeField()
+    acquired_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.run_id} until {self.expires_at}"
+
+class ReEngagementRun(models.Model):
+    """
+    Report of one re-engagement dispatch. The cron only finds due users and fans
+    them out in chunks; each chunk task adds its outcomes to the counters here.
+    """
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)  # Set when the last chunk reports back
+    lease_run_id = models.CharField(max_length=36, blank=True, default='')  # JobLease run id of the dispatch
+    due_users = models.IntegerField(default=0)
+    completed_users = models.IntegerField(default=0)  # Inactive beyond every stage, closed out without a message
+    total_chunks = models.IntegerField(default=0)
+    completed_chunks = models.IntegerField(default=0)
+    sent_count = models.IntegerField(default=0)
+    skipped_count = models.IntegerField(default=0)  # No longer due when the chunk ran, or the window had closed
+    failed_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Re-engagement run {self.pk} at {self.started_at}: {self.sent_count}/{self.due_users} sent"
+
+    @classmethod
+    def record_chunk(cls, run_id, sent=0, skipped=0, failed=0):
+        """Adds a chunk's outcomes atomically and closes the run once every chunk has reported."""
+        cls.objects.filter(pk=run_id).update(
+            completed_chunks=F('completed_chunks') + 1,
+            sent_count=F('sent_count') + sent,
+            skipped_count=F('skipped_count') + skipped,
+            failed_count=F('failed_count') + failed,
+        )
+        cls.close_if_done(run_id)
+
+    @classmethod
+    def close_if_done(cls, run_id):
+        """Sets finished_at once every chunk has reported."""
+        cls.objects.filter(pk=run_id, finished_at__isnull=True, completed_chunks__gte=F('total_chunks')).update(finished_at=timezone.now())
+
 class Prompt(models.Model):
     # Define choices for categories based on the identified prompt types
     CATEGORY_CHOICES = [
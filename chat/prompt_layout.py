@@ -0,0 +1,54 @@
+import hashlib
+from django.conf import settings
+
+# Stable prompt prefix per call type (the prompt category of the call): the prompts, by name, sent
+# first as system messages and identical for every call of that type. Everything that varies per call
+# goes after them in the user prompt, whose templates (chat.prompts) also keep their fixed instructions
+# first, so upstream prompt caching can reuse the prefix. Overridable through settings.LLM_PROMPT_PREFIXES.
+DEFAULT_PROMPT_PREFIXES = {
+    'GENERAL_BOT': ('GENERAL_BOT_SYSTEM_PROMPT',),
+    'QUICK_REPLY': ('QUICK_REPLY_SYSTEM_PROMPT',),
+    'SUMMARIZATION': ('SUMMARIZE_SYSTEM_PROMPT',),
+    'EXAM_GRADING': ('GRADE_EXAM_SYSTEM_PROMPT',),
+    'RE_ENGAGEMENT': ('RE_ENGAGEMENT_SYSTEM_PROMPT',),
+    'ASSESSMENT': ('ASSESSMENT_SYSTEM_PROMPT',),
+    'NAME_EXTRACTION': ('NAME_EXTRACTION_SYSTEM_PROMPT',),
+}
+
+
+def get_prompt_prefix(call_type):
+    """The names of the prompts making up a call type's stable prefix, in order."""
+    prefixes = {**DEFAULT_PROMPT_PREFIXES, **getattr(settings, 'LLM_PROMPT_PREFIXES', {})}
+    if call_type not in prefixes:
+        raise ValueError(f"No prompt prefix declared for call type {call_type}")
+    return tuple(prefixes[call_type])
+
+
+def build_prompt_messages(prefix_prompts, user_prompt):
+    """Chat messages for a call: the static prefix prompts first, as system messages, then the variable user prompt."""
+    messages = [{"role": "system", "content": prompt} for prompt in prefix_prompts]
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+
+def stable_prefix(messages):
+    """The leading system messages of a request, i.e. the part shared by every call of its type."""
+    prefix = []
+    for message in messages:
+        if message.get('role') != 'system':
+            break
+        prefix.append(message)
+    return prefix
+
+
+def prompt_cache_key(call_type, messages):
+    """
+    The prompt_cache_key for a request: its call type plus a short hash of its stable prefix, so
+    requests sharing a prefix are routed to the same upstream cache and a prompt edited in the
+    admin starts a fresh one.
+    """
+    digest = hashlib.sha256()
+    for message in stable_prefix(messages):
+        digest.update(message['content'].encode('utf-8'))
+        digest.update(b'\0')
+    return f"premier:{call_type.lower()}:{digest.hexdigest()[:16]}"
@@ -12,41 +12,33 @@ If you cannot provide a satisfactory answer, gently state so and suggest rephras
 Also, when appropriate, you can recommend the law review center's website: https://premierebarreview.com/
 """
 
-GENERAL_BOT_USER_PROMPT_TEMPLATE = """The user's first name is '{user_first_name}'. Their summarized persona/history is: "{user_summary}".
-Here is the current query from the user: "{message_text}".
+# User prompt templates keep their fixed instructions first and the per-call values last (the current
+# message at the very end), so repeated calls share the longest possible prefix for upstream prompt caching.
+GENERAL_BOT_USER_PROMPT_TEMPLATE = """Please provide a helpful and professional response to the user's current query based on the system guidelines, using their details and recent conversation below for context.
+
+The user's first name is '{user_first_name}'. Their summarized persona/history is: "{user_summary}".
 Here is a brief snippet of their recent conversation history, if available:
 {conversation_history}
 
-Please provide a helpful and professional response based on the system guidelines.
+Here is the current query from the user: "{message_text}".
 """
 
 # Quick Reply Prompts
 QUICK_REPLY_SYSTEM_PROMPT = """You are a helpful assistant providing very brief replies.
 Ensure your replies are easy to read on Messenger by using proper spacing (e.g., newlines between distinct thoughts or items).
 Use relevant, subtle, guiding emojis (e.g., ✨, 💡, ✅) to enhance readability and engagement without being overly expressive."""
-QUICK_REPLY_USER_PROMPT_TEMPLATE = "Based on this conversation: {conversation_history}, provide a quick, one-sentence reply."
+QUICK_REPLY_USER_PROMPT_TEMPLATE = "Provide a quick, one-sentence reply based on this conversation:\n{conversation_history}"
 
 # Summarization Prompts
 SUMMARIZE_SYSTEM_PROMPT = "You are an AI assistant that summarizes conversations concisely."
-SUMMARIZE_USER_PROMPT_WITH_EXISTING_SUMMARY_TEMPLATE = "Here is a previous summary: {existing_summary}. Summarize the following new conversation chunk and merge it with the previous summary, keeping it under 1000 characters: {conversation_chunk}"
-SUMMARIZE_USER_PROMPT_WITHOUT_EXISTING_SUMMARY_TEMPLATE = "Summarize the following conversation chunk under 1000 characters: {conversation_chunk}"
+SUMMARIZE_USER_PROMPT_WITH_EXISTING_SUMMARY_TEMPLATE = "Summarize the following new conversation chunk and merge it with the previous summary, keeping it under 1000 characters.\nPrevious summary: {existing_summary}\nNew conversation chunk:\n{conversation_chunk}"
+SUMMARIZE_USER_PROMPT_WITHOUT_EXISTING_SUMMARY_TEMPLATE = "Summarize the following conversation chunk under 1000 characters.\nConversation chunk:\n{conversation_chunk}"
 
 # Exam Grading Prompts
 GRADE_EXAM_SYSTEM_PROMPT = "You are a legal expert AI assistant tasked with grading law exam answers objectively and providing constructive feedback in JSON format."
 GRADE_EXAM_USER_PROMPT_TEMPLATE = """
 Please grade the following legal exam answer provided by a user. The goal is to assess how well the user's answer aligns with the provided Expected Answer.
 
-Here are the details:
-
-Question:
-{question_text}
-
-User's Answer:
-{user_answer}
-
-Expected Answer / Key Points (This is the lawyer's ideal answer):
-{expected_answer}
-
 Based on the alignment between the "User's Answer" and the "Expected Answer / Key Points", provide feedback on the following 5 points and assign a score out of 100. The closer the user's answer is to the Expected Answer, the higher the score.
 
 The output MUST be a JSON object with the following keys:
@@ -55,6 +47,17 @@ The output MUST be a JSON object with the following keys:
 - "application_feedback": (String) Feedback on how effectively the law was applied to the facts presented in the question.
 - "conclusion_feedback": (String) Feedback on the correctness and clarity of the final answer or conclusion.
 - "score": (Integer) A numerical score between 1 and 100.
+
+Here are the details:
+
+Question:
+{question_text}
+
+Expected Answer / Key Points (This is the lawyer's ideal answer):
+{expected_answer}
+
+User's Answer:
+{user_answer}
 """
 
 # Re-engagement Prompts
@@ -74,11 +77,11 @@ Examples of messages you can generate (choose and adapt based on context, do not
 - Success Story Snippet: "Remember Sarah, who aced her Civil Law exam after just a month with us? Your success story could be next! 🚀"
 - Mental Health Check: "Law school journey can be tough. Remember to take breaks and breathe. Your well-being is paramount. 💙"
 """
-RE_ENGAGEMENT_USER_PROMPT_TEMPLATE = """The user's first name is '{first_name}'. They are currently in the '{current_stage}' stage. Their summary is: "{user_summary}".
+RE_ENGAGEMENT_USER_PROMPT_TEMPLATE = """Please generate a re-engagement message that is most suitable for this user based on the system guidelines, using their details and recent conversation below.
+
+The user's first name is '{first_name}'. They are currently in the '{current_stage}' stage. Their summary is: "{user_summary}".
 Here's a brief snippet of their recent conversation history, if available:
 {conversation_history}
-
-Please generate a re-engagement message that is most suitable for this user based on the system guidelines.
 """
 
 # User Strength Assessment Prompts
@@ -92,15 +95,14 @@ Use relevant, subtle, guiding emojis (e.g., ✨, 💡, ✅) to enhance readabili
 Keep the assessment concise, around 100-200 words.
 """
 
-ASSESSMENT_USER_PROMPT_TEMPLATE = """A student has completed a mock bar exam. Here is their performance aggregated by legal category:
-
-{categorized_scores}
-
-Please provide a personalized assessment highlighting the student's strengths based on these results.
-Example format for categorized_scores:
+ASSESSMENT_USER_PROMPT_TEMPLATE = """A student has completed a mock bar exam. Please provide a personalized assessment highlighting the student's strengths based on their performance aggregated by legal category, given below in this format:
 - Criminal Law (Avg Score: 85)
 - Civil Law (Avg Score: 92)
 - Labor Law (Avg Score: 78)
+
+Here is their performance:
+
+{categorized_scores}
 """
 
 # Name Extraction Prompts
@@ -0,0 +1,146 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import DailyQuotaCounter
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_SCOPE = 'global'
+
+# The unit taken ahead of time by reserve_quota(), for the consume_quota() call made later in this context
+_reservation = ContextVar('quota_reservation', default=None)
+
+def _user_scope(user_id):
+    return f"user:{user_id}"
+
+def get_quota_limits(name):
+    """
+    Returns the configured limits for a quota as a dict with 'per_user' and 'global' keys.
+    A missing or None limit means unlimited.
+    """
+    return getattr(settings, 'AI_MODEL_QUOTAS', {}).get(name, {})
+
+def _try_increment(name, scope, day, limit):
+    """
+    Takes one unit from a counter if it is below limit. The common path is a single
+    conditional UPDATE, so concurrent workers can never push a counter past its limit.
+    :return: True if the unit was granted.
+    """
+    if limit <= 0:
+        return False # Disabled: the first-use create below would grant one unit
+    counters = DailyQuotaCounter.objects.filter(name=name, scope=scope, day=day)
+    if counters.filter(count__lt=limit).update(count=F('count') + 1):
+        return True
+    if counters.exists():
+        return False # Limit reached for today
+
+    # First use of the day for this scope
+    try:
+        with transaction.atomic():
+            DailyQuotaCounter.objects.create(name=name, scope=scope, day=day, count=1)
+        return True
+    except IntegrityError:
+        # Another worker created the counter first; retry the conditional increment
+        return bool(counters.filter(count__lt=limit).update(count=F('count') + 1))
+
+def _release(name, scope, day):
+    DailyQuotaCounter.objects.filter(name=name, scope=scope, day=day, count__gt=0).update(count=F('count') - 1)
+
+def consume_quota(name, user_id=None):
+    """
+    Takes one unit of the named daily quota for a user (if a per-user limit is set)
+    and for everyone (if a global limit is set).
+    :param name: The quota name, a key of settings.AI_MODEL_QUOTAS (e.g., 'gpt-5.2').
+    :param user_id: The user consuming the quota, or None for global-only quotas.
+    :return: True if the unit was granted, False if any limit has been reached.
+    """
+    reservation = _reservation.get()
+    if reservation is not None and not reservation['used'] and (reservation['name'], reservation['user_id']) == (name, user_id):
+        reservation['used'] = True
+        return reservation['granted']
+
+    limits = get_quota_limits(name)
+    per_user_limit = limits.get('per_user')
+    global_limit = limits.get('global')
+    day = timezone.now().date()
+
+    if global_limit is not None and not _try_increment(name, GLOBAL_SCOPE, day, global_limit):
+        logger.info(f"Global daily quota for {name} reached ({global_limit}).")
+        return False
+
+    if per_user_limit is not None and user_id is not None:
+        if not _try_increment(name, _user_scope(user_id), day, per_user_limit):
+            if global_limit is not None:
+                _release(name, GLOBAL_SCOPE, day) # Give back the global unit taken above
+            logger.info(f"User {user_id}: daily quota for {name} reached ({per_user_limit}).")
+            return False
+
+    return True
+
+def release_quota(name, user_id=None, day=None):
+    """Gives back one unit taken by consume_quota() on a day (today by default)."""
+    limits = get_quota_limits(name)
+    day = day or timezone.now().date()
+    if limits.get('global') is not None:
+        _release(name, GLOBAL_SCOPE, day)
+    if limits.get('per_user') is not None and user_id is not None:
+        _release(name, _user_scope(user_id), day)
+
+@contextmanager
+def reserve_quota(name, user_id=None):
+    """
+    Takes one unit of a quota now, for a consume_quota(name, user_id) made later inside
+    a long transaction. That call gets the reserved outcome without touching the counters,
+    whose rows would otherwise stay locked (serializing every caller on the global row)
+    until the transaction commits. Use it before the transaction opens; a granted unit
+    nobody consumed is given back when the block exits.
+    Yields whether the unit was granted.
+    """
+    day = timezone.now().date()
+    reservation = {'name': name, 'user_id': user_id, 'granted': consume_quota(name, user_id), 'used': False}
+    token = _reservation.set(reservation)
+    try:
+        yield reservation['granted']
+    finally:
+        _reservation.reset(token)
+        if reservation['granted'] and not reservation['used']:
+            release_quota(name, user_id, day)
+
+def purge_user_quota_counters(user_id_prefix):
+    """
+    Deletes the per-user counters of users whose id starts with user_id_prefix (synthetic
+    users of benchmarks and load tests) and takes their units back out of the global counters.
+    Returns the number of per-user counters removed.
+    """
+    user_counters = DailyQuotaCounter.objects.filter(scope__startswith=_user_scope(user_id_prefix))
+    for counter in user_counters.values('name', 'day').annotate(used=Sum('count')):
+        DailyQuotaCounter.objects.filter(name=counter['name'], scope=GLOBAL_SCOPE, day=counter['day'], count__gte=counter['used']).update(
+            count=F('count') - counter['used'])
+    deleted, _ = user_counters.delete()
+    return deleted
+
+def get_quota_usage(name, user_id=None, day=None):
+    """
+    Returns how many units of a quota were used on a day (today by default),
+    for a user or, with no user_id, globally.
+    """
+    scope = _user_scope(user_id) if user_id is not None else GLOBAL_SCOPE
+    day = day or timezone.now().date()
+    counter = DailyQuotaCounter.objects.filter(name=name, scope=scope, day=day).values_list('count', flat=True).first()
+    return counter or 0
+
+def purge_quota_counters(keep_days=None):
+    """
+    Deletes counters older than keep_days (settings.QUOTA_COUNTER_KEEP_DAYS, 30 by default).
+    Run from the cron dispatch. Returns the number of rows removed.
+    """
+    if keep_days is None:
+        keep_days = getattr(settings, 'QUOTA_COUNTER_KEEP_DAYS', 30)
+    cutoff = timezone.now().date() - timedelta(days=keep_days)
+    deleted, _ = DailyQuotaCounter.objects.filter(day__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,147 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .ai_integration import AIIntegration, RE_ENGAGEMENT_MODEL
+from .leases import acquire_lease, release_lease
+from .models import User, ReEngagementDraft
+from .conversation_cache import get_recent_conversations
+
+logger = logging.getLogger(__name__)
+
+ai_integration_service = AIIntegration()
+
+PREGENERATION_LEASE_NAME = 'pregenerate_re_engagement_drafts'
+
+def get_batch_backend():
+    """Returns an instance of the configured settings.RE_ENGAGEMENT_BATCH_BACKEND."""
+    return import_string(getattr(settings, 'RE_ENGAGEMENT_BATCH_BACKEND', 'chat.batch_backends.OpenAIBatchBackend'))()
+
+def _apply_results(drafts, results):
+    """Stores a bulk job's results on its drafts; drafts without a result are marked FAILED."""
+    for draft in drafts:
+        message = results.get(str(draft.pk))
+        if message:
+            draft.status, draft.message = 'READY', message
+        else:
+            draft.status = 'FAILED'
+        draft.updated_at = timezone.now()
+    ReEngagementDraft.objects.bulk_update(drafts, ['status', 'message', 'updated_at'])
+
+def pregenerate_re_engagement_drafts():
+    """
+    Requests drafts for users whose next re-engagement stage opens within
+    RE_ENGAGEMENT_PREGENERATION_LOOKAHEAD_HOURS, as one bulk job on the configured backend.
+    """
+    lease_run_id = acquire_lease(PREGENERATION_LEASE_NAME, getattr(settings, 'RE_ENGAGEMENT_LEASE_SECONDS', 300))
+    if lease_run_id is None:
+        logger.info("Another re-engagement pre-generation run is in progress. Skipping.")
+        return 0
+    try:
+        return _pregenerate(lease_run_id)
+    finally:
+        release_lease(PREGENERATION_LEASE_NAME, lease_run_id)
+
+def _pregenerate(lease_run_id):
+    now = timezone.now()
+    lookahead = timedelta(hours=getattr(settings, 'RE_ENGAGEMENT_PREGENERATION_LOOKAHEAD_HOURS', 3))
+    max_drafts = getattr(settings, 'RE_ENGAGEMENT_PREGENERATION_MAX_BATCH', 1000)
+
+    # Drafts a run created but never submitted (it died before handing them to the backend) are
+    # requested again; runs hold the lease, so any older than its TTL are not in flight
+    abandoned = Q(status='PENDING', batch_id='', created_at__lt=now - timedelta(seconds=getattr(settings, 'RE_ENGAGEMENT_LEASE_SECONDS', 300)))
+    has_draft = ReEngagementDraft.objects.filter(
+        user=OuterRef('pk'),
+        stage_index=Coalesce(OuterRef('re_engagement_stage_index'), 0),
+        based_on_interaction=OuterRef('last_interaction_timestamp'),
+    ).exclude(abandoned)
+    # Users already drafted are filtered out before the cap, so they can't crowd out everyone due later
+    users = list(User.objects.filter(
+        re_engagement_next_due_at__gt=now,
+        re_engagement_next_due_at__lte=now + lookahead,
+    ).filter(~Exists(has_draft)).order_by('re_engagement_next_due_at')[:max_drafts])
+    if not users:
+        return 0
+
+    with transaction.atomic():
+        drafts = ReEngagementDraft.objects.bulk_create([
+            ReEngagementDraft(user=user, stage_index=user.re_engagement_stage_index or 0, based_on_interaction=user.last_interaction_timestamp)
+            for user in users
+        ], ignore_conflicts=True)
+    # Re-read to get primary keys on every backend (ignore_conflicts doesn't return them)
+    drafts = list(ReEngagementDraft.objects.filter(
+        user__in=users, status='PENDING', batch_id='',
+    ).select_related('user'))
+    drafts = [
+        draft for draft in drafts
+        if draft.stage_index == (draft.user.re_engagement_stage_index or 0)
+        and draft.based_on_interaction == draft.user.last_interaction_timestamp
+    ]
+    if not drafts:
+        return 0
+
+    recent_conversations = get_recent_conversations([draft.user_id for draft in drafts], limit=5)
+    requests = []
+    for draft in drafts:
+        requests.append({
+            'custom_id': str(draft.pk),
+            'model': RE_ENGAGEMENT_MODEL,
+            'messages': ai_integration_service.build_re_engagement_messages(
+                draft.user.first_name, draft.user.current_stage, draft.user.summary, recent_conversations[draft.user_id]
+            ),
+        })
+
+    backend = get_batch_backend()
+    try:
+        batch_id, results = backend.submit(requests)
+    except Exception as e:
+        logger.error(f"Failed to submit re-engagement pre-generation batch: {e}", exc_info=True)
+        ReEngagementDraft.objects.filter(pk__in=[draft.pk for draft in drafts]).update(status='FAILED')
+        return 0
+
+    ReEngagementDraft.objects.filter(pk__in=[draft.pk for draft in drafts]).update(batch_id=batch_id)
+    if results is not None:
+        _apply_results(drafts, results)
+    logger.info(f"Pre-generation run {lease_run_id}: requested {len(drafts)} re-engagement drafts in batch {batch_id}.")
+    return len(drafts)
+
+def collect_re_engagement_drafts():
+    """
+    Polls the unfinished bulk jobs and stores their results, then drops drafts that
+    are too old to be used.
+    """
+    backend = get_batch_backend()
+    batch_ids = ReEngagementDraft.objects.filter(status='PENDING').exclude(batch_id='').values_list('batch_id', flat=True).distinct()
+    for batch_id in list(batch_ids):
+        try:
+            results = backend.poll(batch_id)
+        except Exception as e:
+            logger.error(f"Failed to poll re-engagement batch {batch_id}: {e}", exc_info=True)
+            continue
+        if results is not None:
+            _apply_results(list(ReEngagementDraft.objects.filter(status='PENDING', batch_id=batch_id)), results)
+            logger.info(f"Collected re-engagement batch {batch_id}.")
+
+    retention = timedelta(hours=getattr(settings, 'RE_ENGAGEMENT_DRAFT_RETENTION_HOURS', 48))
+    ReEngagementDraft.objects.filter(created_at__lt=timezone.now() - retention).delete()
+
+def take_re_engagement_draft(user, stage_index):
+    """
+    Returns the ready draft for the user's stage and current last interaction, marking
+    it SENT so it is used once, or None when there isn't one (send-time generation then applies).
+    """
+    draft = ReEngagementDraft.objects.filter(
+        user=user,
+        stage_index=stage_index,
+        based_on_interaction=user.last_interaction_timestamp,
+        status='READY',
+    ).first()
+    if draft is None:
+        return None
+    if not ReEngagementDraft.objects.filter(pk=draft.pk, status='READY').update(status='SENT', updated_at=timezone.now()):
+        return None
+    return draft.message
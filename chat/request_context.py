@@ -0,0 +1,28 @@
+import contextvars
+from contextlib import contextmanager
+
+# The User currently being processed by this task/thread. Set by the pipeline entry points
+# (process_messenger_message, deliver_exam_feedback, re-engagement) so helpers such as
+# chat.messenger_api and chat.ai_integration reuse the already-loaded (and locked) row
+# instead of querying it again.
+_current_user = contextvars.ContextVar('chat_current_user', default=None)
+
+@contextmanager
+def user_context(user):
+    """
+    Makes `user` available to everything called inside the block via get_context_user().
+    """
+    token = _current_user.set(user)
+    try:
+        yield user
+    finally:
+        _current_user.reset(token)
+
+def get_context_user(user_id):
+    """
+    Returns the User loaded for the current request if it matches user_id, otherwise None.
+    """
+    user = _current_user.get()
+    if user is not None and user.user_id == user_id:
+        return user
+    return None
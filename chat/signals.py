@@ -0,0 +1,79 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import ExamResult, UserCategoryScore, Prompt, User, ChatLog
+from .utils import invalidate_prompt_snapshot
+
+
+# Users whose ExamResults were deleted and whose category scores await a recompute, and the
+# connection's on-commit list the recompute was registered in
+_deleted_result_users = threading.local()
+
+
+def _recompute_category_scores():
+    user_ids = getattr(_deleted_result_users, 'user_ids', None)
+    if not user_ids:
+        return # Already done by an earlier callback of the same commit
+    _deleted_result_users.user_ids = set()
+    UserCategoryScore.rebuild(user_ids=sorted(user_ids))
+
+
+@receiver(post_delete, sender=ExamResult)
+def recompute_category_scores_after_delete(sender, instance, **kwargs):
+    """
+    Keeps UserCategoryScore in step when results are deleted, including cascades. Rows
+    only note their user (no queries); once the delete commits, the scores of all those
+    users are recomputed together in one aggregate query.
+    """
+    user_ids = getattr(_deleted_result_users, 'user_ids', None)
+    if user_ids is None:
+        user_ids = _deleted_result_users.user_ids = set()
+    # One callback per transaction. Django replaces the on-commit list whenever it drops
+    # callbacks (commit, rollback, savepoint rollback), so a new list means re-registering.
+    hooks = transaction.get_connection().run_on_commit
+    register = not user_ids or getattr(_deleted_result_users, 'hooks', None) is not hooks
+    user_ids.add(instance.user_id)
+    if register:
+        _deleted_result_users.hooks = hooks
+        transaction.on_commit(_recompute_category_scores)
+
+
+@receiver(post_save, sender=Prompt)
+@receiver(post_delete, sender=Prompt)
+def reload_prompts_on_change(sender, instance, **kwargs):
+    """Makes every process pick up admin edits to prompts on its next snapshot check."""
+    invalidate_prompt_snapshot()
+    # Bump again once committed, in case another process reloaded before the edit was visible
+    transaction.on_commit(invalidate_prompt_snapshot)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_messenger_reachability(sender, instance, update_fields=None, **kwargs):
+    """Drops the cached reachability whenever it may have changed."""
+    if update_fields is None or 'is_messenger_reachable' in update_fields:
+        from .messenger_api import forget_reachability # Local import to avoid circular dependency
+        forget_reachability(instance.user_id)
+
+
+@receiver(post_save, sender=ChatLog)
+def add_chat_log_to_conversation_ring(sender, instance, created, **kwargs):
+    """Write-through update of the user's cached recent conversation."""
+    if created:
+        from .conversation_cache import record_chat_logs # Local import to avoid circular dependency
+        record_chat_logs([instance])
+
+
+@receiver(post_save, sender=User)
+def forget_conversation_of_new_user(sender, instance, created, **kwargs):
+    """A new user can't have a cached conversation yet (e.g., a PSID that was deleted and came back)."""
+    if created:
+        from .conversation_cache import forget_conversation # Local import to avoid circular dependency
+        forget_conversation(instance.user_id)
+
+
+@receiver(post_delete, sender=User)
+def forget_conversation_of_deleted_user(sender, instance, **kwargs):
+    from .conversation_cache import forget_conversation # Local import to avoid circular dependency
+    forget_conversation(instance.user_id)
@@ -1,5 +1,7 @@
 import logging
 from ..utils import generate_persuasion_messages
+from ..conversation_cache import get_recent_conversation
+from ..context_builder import get_context_budget
 from ..models import User, ChatLog # Import User and ChatLog models
 from ..ai_integration import AIIntegration # Import AIIntegration directly
 
@@ -28,9 +30,8 @@ def handle_general_bot_stage(user, messaging_event):
     elif user.exam_question_counter == -1: # Already sent initial message
         # General query handling
         if message_text:
-            # Retrieve the last few messages for context to send to AI
-            last_messages = ChatLog.objects.filter(user=user).order_by('-timestamp')[:5]
-            conversation_context = "\n".join([f"{log.sender_type}: {log.message_content}" for log in last_messages[::-1]])
+            # Retrieve the recent messages for context; generate_chat_response keeps as many as fit the token budget
+            conversation_context = get_recent_conversation(user.user_id, limit=get_context_budget('GENERAL_BOT')['max_turns'])
             
             prompt_context = {
                 'user_first_name': user.first_name,
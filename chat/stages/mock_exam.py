@@ -1,14 +1,83 @@
 import logging
+from django.conf import settings
 from django.db import transaction
-from ..models import User, Question
+from ..models import User, Question, ExamSubmission
 from ..utils import get_random_exam_question, generate_persuasion_messages
 from ..ai_integration import AIIntegration # Import AIIntegration directly
+from ..task_queue import enqueue_task
 
 logger = logging.getLogger(__name__)
 
 # Instantiate AIIntegration for use within this stage handler
 ai_integration_service = AIIntegration()
 
+def format_exam_feedback(feedback):
+    """
+    Builds the Messenger feedback text from a grading result.
+    :param feedback: The dict returned by AIIntegration.grade_exam_answer.
+    :return: A tuple of (feedback_message, exam_result_fields). exam_result_fields is None when no score was given.
+    """
+    feedback_message = "Here's the feedback on your answer:\n"
+    exam_score = None
+    legal_writing_feedback = None
+    legal_basis_feedback = None
+    application_feedback = None
+    conclusion_feedback = None
+
+    if feedback and isinstance(feedback, dict):
+        if 'legal_writing_feedback' in feedback:
+            legal_writing_feedback = feedback['legal_writing_feedback']
+            feedback_message += f"- Legal Writing: {legal_writing_feedback}\n"
+        if 'legal_basis_feedback' in feedback:
+            legal_basis_feedback = feedback['legal_basis_feedback']
+            feedback_message += f"- Legal Basis: {legal_basis_feedback}\n"
+        if 'application_feedback' in feedback:
+            application_feedback = feedback['application_feedback']
+            feedback_message += f"- Application: {application_feedback}\n"
+        if 'conclusion_feedback' in feedback:
+            conclusion_feedback = feedback['conclusion_feedback']
+            feedback_message += f"- Conclusion: {conclusion_feedback}\n"
+        if 'score' in feedback:
+            exam_score = feedback['score']
+            feedback_message += f"Your score: {exam_score}/100\n"
+    else:
+        feedback_message += "I'm sorry, I couldn't generate detailed feedback at this time.\n"
+
+    if exam_score is None:
+        return feedback_message, None
+
+    return feedback_message, {
+        'score': exam_score,
+        'legal_writing_feedback': legal_writing_feedback,
+        'legal_basis_feedback': legal_basis_feedback,
+        'application_feedback': application_feedback,
+        'conclusion_feedback': conclusion_feedback,
+    }
+
+def _finish_exam(user):
+    """Moves the user out of the exam once the last answer has been received."""
+    user.current_stage = 'GENERAL_BOT' # Transition to Conversion & General Bot
+    user.exam_question_counter = 0
+    user.last_question_id_asked = None
+    user.save()
+
+def _submit_for_pipelined_grading(user, question, message_text):
+    """
+    Stores the answer and schedules grading in the background once the current
+    transaction commits, so the worker never sees an uncommitted submission.
+    """
+    from ..tasks import grade_exam_submission # Import locally to avoid circular dependency
+    submission = ExamSubmission.objects.create(
+        user=user,
+        question=question,
+        question_number=user.exam_question_counter,
+        answer_text=message_text,
+        is_final=user.exam_question_counter >= 8,
+    )
+    transaction.on_commit(lambda: enqueue_task(grade_exam_submission, submission.id))
+    logger.info(f"Queued answer {submission.question_number}/8 of user {user.user_id} for grading (submission {submission.id}).")
+    return submission
+
 def handle_mock_exam_stage(user, messaging_event):
     """
     Handles the logic for the MOCK_EXAM stage.
@@ -57,55 +126,27 @@ def handle_mock_exam_stage(user, messaging_event):
             user.save()
             return response_messages
         
-        # Grade the answer using AI
-        feedback = ai_integration_service.grade_exam_answer(
-            user_id=user.user_id,
-            question_text=current_question.question_text,
-            user_answer=message_text,
-            expected_answer=current_question.expected_answer
-        )
-        logger.info(f"Received feedback from AI integration service: {feedback}") # Added log
-
-        feedback_message = "Here's the feedback on your answer:\n"
-        exam_score = None
-        legal_writing_feedback = None
-        legal_basis_feedback = None
-        application_feedback = None
-        conclusion_feedback = None
-
-        if feedback and isinstance(feedback, dict):
-            if 'legal_writing_feedback' in feedback:
-                legal_writing_feedback = feedback['legal_writing_feedback']
-                feedback_message += f"- Legal Writing: {legal_writing_feedback}\n"
-            if 'legal_basis_feedback' in feedback:
-                legal_basis_feedback = feedback['legal_basis_feedback']
-                feedback_message += f"- Legal Basis: {legal_basis_feedback}\n"
-            if 'application_feedback' in feedback:
-                application_feedback = feedback['application_feedback']
-                feedback_message += f"- Application: {application_feedback}\n"
-            if 'conclusion_feedback' in feedback:
-                conclusion_feedback = feedback['conclusion_feedback']
-                feedback_message += f"- Conclusion: {conclusion_feedback}\n"
-            if 'score' in feedback:
-                exam_score = feedback['score']
-                feedback_message += f"Your score: {exam_score}/100\n"
+        if getattr(settings, 'MOCK_EXAM_PIPELINED_GRADING', False):
+            # Grading happens in the background; feedback is delivered by grade_exam_submission.
+            _submit_for_pipelined_grading(user, current_question, message_text)
+            response_messages.append("Got your answer! ✅ I'll send your feedback as soon as it's graded.")
         else:
-            feedback_message += "I'm sorry, I couldn't generate detailed feedback at this time.\n"
-        
-        response_messages.append(feedback_message)
-
-        # Save the exam result
-        if exam_score is not None:
-            from ..models import ExamResult # Import locally to avoid circular dependency
-            ExamResult.objects.create(
-                user=user,
-                question=current_question,
-                score=exam_score,
-                legal_writing_feedback=legal_writing_feedback,
-                legal_basis_feedback=legal_basis_feedback,
-                application_feedback=application_feedback,
-                conclusion_feedback=conclusion_feedback,
+            # Grade the answer using AI
+            feedback = ai_integration_service.grade_exam_answer(
+                user_id=user.user_id,
+                question_text=current_question.question_text,
+                user_answer=message_text,
+                expected_answer=current_question.expected_answer
             )
+            logger.info(f"Received feedback from AI integration service: {feedback}") # Added log
+
+            feedback_message, exam_result_fields = format_exam_feedback(feedback)
+            response_messages.append(feedback_message)
+
+            # Save the exam result
+            if exam_result_fields is not None:
+                from ..models import ExamResult # Import locally to avoid circular dependency
+                ExamResult.objects.create(user=user, question=current_question, **exam_result_fields)
 
         if user.exam_question_counter < 8:
             # Send next question
@@ -124,6 +165,11 @@ def handle_mock_exam_stage(user, messaging_event):
                 # Persuasion messages for early exam end due to no more questions
                 persuasion = generate_persuasion_messages(user, 'exam_opt_out') # Using opt_out context as it's an unexpected end
                 response_messages.extend(persuasion)
+        elif getattr(settings, 'MOCK_EXAM_PIPELINED_GRADING', False):
+            # Exam finished; the assessment and closing messages follow the last graded feedback.
+            response_messages.append("You have completed all 8 mock exam questions! Great job! Your remaining feedback and strength assessment will arrive shortly.")
+            _finish_exam(user)
+            logger.info(f"User {user.user_id} completed mock exam (grading pending) and transitioned to GENERAL_BOT stage.")
         else:
             # Exam finished, generate strength assessment and then transition to next stage
             response_messages.append("You have completed all 8 mock exam questions! Great job!")
@@ -140,10 +186,7 @@ def handle_mock_exam_stage(user, messaging_event):
                 message_content=strength_assessment_message
             )
 
-            user.current_stage = 'GENERAL_BOT' # Transition to Conversion & General Bot
-            user.exam_question_counter = 0
-            user.last_question_id_asked = None
-            user.save()
+            _finish_exam(user)
             logger.info(f"User {user.user_id} completed mock exam, received strength assessment, and transitioned to GENERAL_BOT stage.")
             # Add persuasion messages for exam completion
             persuasion = generate_persuasion_messages(user, 'exam_finished')
@@ -0,0 +1,210 @@
+import logging
+import random
+import time
+from datetime import timedelta
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import (
+    User, ChatLog, ExamResult, Question, UserCategoryScore, RE_ENGAGEMENT_INTERVALS,
+)
+
+logger = logging.getLogger(__name__)
+
+SYNTHETIC_PREFIX = 'synthetic-'
+SYNTHETIC_QUESTION_MARKER = '[synthetic]'
+DEFAULT_STAGE_WEIGHTS = {'ONBOARDING': 0.15, 'MARKETING': 0.20, 'MOCK_EXAM': 0.10, 'GENERAL_BOT': 0.55}
+
+FIRST_NAMES = ['Maria', 'Jose', 'Andrea', 'Miguel', 'Patricia', 'Paolo', 'Katrina', 'Ramon', 'Bea', 'Carlo', 'Liza', 'Mark']
+ACADEMIC_STATUSES = ['Law student', 'Law graduate', 'Bar repeater', 'Lawyer']
+USER_MESSAGES = [
+    "Hi", "yes", "What is the difference between void and voidable contracts?",
+    "The accused is liable for homicide because the aggression had ceased when he pursued the victim.",
+    "Can you explain the doctrine of piercing the corporate veil?", "ok thanks", "How should I review for remedial law?",
+    "The contract is voidable because consent was vitiated by fraud under Article 1390 of the Civil Code.",
+]
+BOT_MESSAGES = [
+    "Nice to meet you! Ready to test your legal skills with a free AI-powered assessment exam?",
+    "Here's the feedback on your answer: your legal basis is correct, but cite the specific article.",
+    "Next question (3/8):\n\nA sold B a parcel of land. What are the remedies of B if A fails to deliver?",
+    "Piercing the corporate veil disregards the separate personality of a corporation when it is used to defeat public convenience, justify wrong or protect fraud.",
+    "Great question! Prescription for oral contracts is six years under Article 1145.",
+]
+
+
+def _activity_age(rng, days):
+    """How long ago a user was last active: mostly recent, with a long tail up to `days`."""
+    return timedelta(days=min(days, rng.expovariate(4 / days)))
+
+
+def _re_engagement_stage_index(hours_inactive):
+    """The stage index the re-engagement job would have reached for a user inactive this long."""
+    return sum(1 for min_hours, _ in RE_ENGAGEMENT_INTERVALS if hours_inactive > min_hours)
+
+
+def ensure_questions(count, rng):
+    """Tops the question bank up to `count` questions with marked synthetic ones; returns the bank."""
+    questions = list(Question.objects.exclude(expected_answer=''))
+    missing = count - len(questions)
+    if missing > 0:
+        categories = [value for value, _ in Question.CATEGORY_CHOICES]
+        Question.objects.bulk_create([
+            Question(
+                category=rng.choice(categories),
+                question_text=f"{SYNTHETIC_QUESTION_MARKER} Question {i}: A sold B a parcel of land. Discuss the rights of the parties.",
+                expected_answer="Discuss the obligations of the vendor under Articles 1495 and 1547 of the Civil Code.",
+            )
+            for i in range(missing)
+        ], batch_size=1000)
+        questions = list(Question.objects.exclude(expected_answer=''))
+    return questions
+
+
+def _insert_chat_logs(rows, batch_size):
+    """
+    Inserts ChatLog rows with executemany() instead of bulk_create(): compiling model
+    instances dominates bulk_create() time, and ChatLog is by far the largest table.
+    """
+    table = connection.ops.quote_name(ChatLog._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(column) for column in ('user_id', 'sender_type', 'message_content', 'timestamp'))
+    sql = f"INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s)"
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, [(user_id, sender_type, content, adapt(timestamp)) for user_id, sender_type, content, timestamp in rows[start:start + batch_size]])
+
+
+def _build_user(rng, user_id, stage, now, days, questions, logs_per_user):
+    """Builds one user with a coherent history; returns (user, chat_logs, exam_results)."""
+    last_interaction = now - _activity_age(rng, days)
+    first_seen = last_interaction - timedelta(days=rng.uniform(0, 30))
+    user = User(
+        user_id=user_id,
+        first_name=rng.choice(FIRST_NAMES) if stage != 'ONBOARDING' else None,
+        current_stage=stage,
+        academic_status=rng.choice(ACADEMIC_STATUSES) if stage != 'ONBOARDING' else None,
+        last_interaction_timestamp=last_interaction,
+        is_messenger_reachable=rng.random() > 0.03,
+    )
+    answered = 0
+    if stage == 'MOCK_EXAM':
+        user.exam_question_counter = rng.randint(1, 8)
+        user.last_question_id_asked = rng.choice(questions)
+        answered = user.exam_question_counter - 1
+    elif stage == 'GENERAL_BOT':
+        user.exam_question_counter = -1
+        answered = 8 if rng.random() < 0.8 else rng.randint(0, 7)
+        if rng.random() < 0.6:
+            user.summary = "Law graduate reviewing for the bar; weakest in remedial law, asks about contracts."
+    if stage in ('ONBOARDING', 'MARKETING', 'GENERAL_BOT'):
+        user.re_engagement_stage_index = _re_engagement_stage_index((now - last_interaction).total_seconds() / 3600)
+        if user.re_engagement_stage_index:
+            user.last_re_engagement_message_sent_at = last_interaction + timedelta(hours=RE_ENGAGEMENT_INTERVALS[user.re_engagement_stage_index - 1][0])
+    # bulk_create doesn't call save(), so keep the denormalized schedule column right here
+    user.re_engagement_next_due_at = user.compute_re_engagement_next_due_at()
+
+    log_count = max(2, int(rng.expovariate(1 / logs_per_user))) if logs_per_user else 0
+    span = (last_interaction - first_seen).total_seconds()
+    offsets = sorted(rng.uniform(0, span) for _ in range(log_count - 1)) + [span]
+    # Plain (user_id, sender_type, message_content, timestamp) rows; see _insert_chat_logs()
+    chat_logs = [
+        (
+            user_id,
+            'USER' if i % 2 == 0 else 'SYSTEM_AI',
+            rng.choice(USER_MESSAGES if i % 2 == 0 else BOT_MESSAGES),
+            first_seen + timedelta(seconds=offset),
+        )
+        for i, offset in enumerate(offsets[:log_count])
+    ]
+    exam_results = [
+        ExamResult(
+            user_id=user_id,
+            question=question,
+            score=rng.randint(40, 100),
+            legal_writing_feedback="Clear and organized.",
+            legal_basis_feedback="Cite the specific provision.",
+            application_feedback="Apply the law to each fact.",
+            conclusion_feedback="State the conclusion first.",
+            timestamp=first_seen + timedelta(seconds=span * (i + 1) / (answered + 1)),
+        )
+        for i, question in enumerate(rng.sample(questions, min(answered, len(questions))))
+    ]
+    return user, chat_logs, exam_results
+
+
+def generate_synthetic_data(users=1000, logs_per_user=20, questions=200, days=90, stage_weights=None,
+                            chunk_size=5000, batch_size=2000, seed=None, prefix=SYNTHETIC_PREFIX, progress=None):
+    """
+    Bulk-inserts realistic User, ChatLog, ExamResult, UserCategoryScore and Question rows
+    for scale testing. Users are built in chunks (each inserted in its own transaction),
+    with stage, activity, exam progress and re-engagement state consistent with each other.
+    User ids start with prefix so delete_synthetic_data() can remove them again.
+    :param logs_per_user: Mean ChatLogs per user (exponentially distributed).
+    :param days: Last activity is spread over this many days, skewed towards recent.
+    :param progress: Optional callable receiving the running totals after each chunk.
+    :return: Totals of the rows created per model.
+    """
+    rng = random.Random(seed)
+    stage_weights = stage_weights or DEFAULT_STAGE_WEIGHTS
+    stages, weights = list(stage_weights), list(stage_weights.values())
+    question_bank = ensure_questions(max(questions, 8), rng) # A full mock exam needs 8
+    now = timezone.now()
+    run_id = f"{prefix}{int(time.time())}-"
+    totals = {'users': 0, 'chat_logs': 0, 'exam_results': 0, 'category_scores': 0}
+    started = time.monotonic()
+
+    for chunk_start in range(0, users, chunk_size):
+        chunk_users, chunk_logs, chunk_results = [], [], []
+        for i in range(chunk_start, min(users, chunk_start + chunk_size)):
+            user, chat_logs, exam_results = _build_user(rng, f"{run_id}{i}", rng.choices(stages, weights)[0], now, days, question_bank, logs_per_user)
+            chunk_users.append(user)
+            chunk_logs.extend(chat_logs)
+            chunk_results.extend(exam_results)
+
+        scores = {}
+        for result in chunk_results:
+            key = (result.user_id, result.question.category)
+            total, count = scores.get(key, (0, 0))
+            scores[key] = (total + result.score, count + 1)
+
+        with transaction.atomic():
+            User.objects.bulk_create(chunk_users, batch_size=batch_size)
+            _insert_chat_logs(chunk_logs, batch_size)
+            ExamResult.objects.bulk_create(chunk_results, batch_size=batch_size)
+            UserCategoryScore.objects.bulk_create([
+                UserCategoryScore(user_id=user_id, category=category, total_score=total, result_count=count)
+                for (user_id, category), (total, count) in scores.items()
+            ], batch_size=batch_size)
+
+        totals['users'] += len(chunk_users)
+        totals['chat_logs'] += len(chunk_logs)
+        totals['exam_results'] += len(chunk_results)
+        totals['category_scores'] += len(scores)
+        totals['seconds'] = round(time.monotonic() - started, 1)
+        if progress:
+            progress(dict(totals))
+    return totals
+
+
+def delete_synthetic_data(prefix=SYNTHETIC_PREFIX, batch_size=10000):
+    """
+    Removes everything generate_synthetic_data() created, in batches of users so
+    each DELETE stays short. Synthetic questions are removed once no results use them.
+    :return: The number of users deleted.
+    """
+    deleted = 0
+    while True:
+        user_ids = list(User.objects.filter(user_id__startswith=prefix).values_list('user_id', flat=True)[:batch_size])
+        if not user_ids:
+            break
+        with transaction.atomic():
+            # Delete the big child tables directly rather than through the cascade collector
+            ChatLog.objects.filter(user_id__in=user_ids).delete()
+            # A raw DELETE skips the post_delete receiver (row fetches plus a category score
+            # recompute); the users' scores are deleted right after anyway
+            results = ExamResult.objects.filter(user_id__in=user_ids)
+            results._raw_delete(results.db)
+            UserCategoryScore.objects.filter(user_id__in=user_ids).delete()
+            User.objects.filter(user_id__in=user_ids).delete()
+        deleted += len(user_ids)
+    Question.objects.filter(question_text__startswith=SYNTHETIC_QUESTION_MARKER, examresult__isnull=True).delete()
+    return deleted
@@ -1,11 +1,18 @@
 import logging
+from contextlib import nullcontext
+from datetime import timedelta
 from django.conf import settings
-from .models import User, ChatLog, Question
+from .models import User, ChatLog, Question, ExamSubmission, ExamResult, ReEngagementRun, ReEngagementDraft, RE_ENGAGEMENT_INTERVALS
 from .messenger_api import send_messenger_message, send_sender_action
-from .ai_integration import AIIntegration # Import AIIntegration directly
+from .request_context import user_context
+from .ai_integration import AIIntegration, GENERAL_BOT_QUOTA # Import AIIntegration directly
+from .quotas import reserve_quota
 from django.utils import timezone # Import timezone utilities
 from django.db import transaction # ADD THIS IMPORT
+from django.db.models import F, Q
 from chat.task_queue import enqueue_task # NEW: Import enqueue_task
+from .leases import acquire_lease, release_lease, renew_lease
+from .re_engagement_drafts import take_re_engagement_draft
 
 # Instantiate AIIntegration for use within tasks
 ai_integration_service = AIIntegration()
@@ -13,17 +20,16 @@ ai_integration_service = AIIntegration()
 # Import stage handlers
 from .stages.onboarding import handle_onboarding_stage
 from .stages.marketing import handle_marketing_stage
-from .stages.mock_exam import handle_mock_exam_stage
+from .stages.mock_exam import handle_mock_exam_stage, format_exam_feedback
 from .stages.general_bot import handle_general_bot_stage
+from .utils import generate_persuasion_messages
+from .chat_log_buffer import buffer_chat_logs
+from .conversation_cache import format_chat_log, get_recent_conversations, get_unsummarized_conversation
 
 logger = logging.getLogger(__name__)
 
-RE_ENGAGEMENT_INTERVALS = [
-    (1, 2),    # Stage 1: 1 to 2 hours
-    (5, 6),    # Stage 2: 5 to 6 hours
-    (11, 12),  # Stage 3: 11 to 12 hours
-    (21, 22),  # Stage 4: 21 to 22 hours
-]
+RE_ENGAGEMENT_LEASE_NAME = 'check_inactive_users'
+EXAM_FEEDBACK_LEASE_NAME = 'exam_feedback:{user_id}'
 
 def process_messenger_message(messaging_event): # Removed @shared_task
     """
@@ -68,7 +74,13 @@ def process_messenger_message(messaging_event): # Removed @shared_task
         # The typing_on indicator is already sent by the webhook_callback in views.py.
         # No need to send it again here.
 
-        with transaction.atomic():
+        # A GENERAL_BOT reply takes a unit of the gpt-5.2 quota. Take it now, in autocommit, so the
+        # counter rows (the global one is shared by every worker) are not locked through the LLM call.
+        quota_reservation = nullcontext()
+        if message_text and User.objects.filter(user_id=sender_id, current_stage='GENERAL_BOT', exam_question_counter=-1).exists():
+            quota_reservation = reserve_quota(GENERAL_BOT_QUOTA, user_id=sender_id)
+
+        with quota_reservation, transaction.atomic():
             user = None # Initialize user outside the try block
             
             # Step 4: Get User Data & Step 5: Save User Message (now transactional)
@@ -82,175 +94,447 @@ def process_messenger_message(messaging_event): # Removed @shared_task
                 created = True
                 logger.info(f"New user created: {sender_id}")
 
-            # If user's first_name is empty, do not automatically set it here.
-            # The onboarding stage will explicitly ask for and set the name.
-            if user.first_name in ["New User", "Guest", None, ""]:
-                # If a new user and no message_text is provided, ensure first_name is None for onboarding to prompt.
-                if not message_text or not message_text.strip():
-                    user.first_name = None # Ensure it's explicitly None for the onboarding stage to pick up
-                    logger.info(f"User {sender_id} first_name set to None for onboarding prompt.")
-            # message_consumed_for_name remains False at this point,
-            # it will be handled by handle_onboarding_stage if appropriate.
-            user.save() # Save potential changes (like setting first_name to None)
+            # Every user.save() below (including those in the stage handlers) is collapsed
+            # into a single UPDATE of the changed columns before the transaction commits.
+            # ChatLogs are likewise buffered and written with one bulk INSERT (see chat.chat_log_buffer).
+            with user_context(user), user.coalesce_saves(), buffer_chat_logs() as chat_logs:
+                # If user's first_name is empty, do not automatically set it here.
+                # The onboarding stage will explicitly ask for and set the name.
+                if user.first_name in ["New User", "Guest", None, ""]:
+                    # If a new user and no message_text is provided, ensure first_name is None for onboarding to prompt.
+                    if not message_text or not message_text.strip():
+                        user.first_name = None # Ensure it's explicitly None for the onboarding stage to pick up
+                        logger.info(f"User {sender_id} first_name set to None for onboarding prompt.")
+                # message_consumed_for_name remains False at this point,
+                # it will be handled by handle_onboarding_stage if appropriate.
+                user.save() # Save potential changes (like setting first_name to None)
             
-            if message_text:
-                ChatLog.objects.create(
-                    user=user,
-                    sender_type='USER',
-                    message_content=message_text
-                )
-                user.last_interaction_timestamp = timezone.now() # Use timezone.now()
-                user.re_engagement_stage_index = 0 # Reset re-engagement stage on user interaction
-                user.last_re_engagement_message_sent_at = None # Reset re-engagement timestamp
-                user.save() # Save last_interaction_timestamp changes
-                logger.info(f"User message logged for {sender_id}: {message_text}")
-            # If message_text is None or empty, we still proceed to stage handlers for processing.
-
-            # Step 7: Determine User Stage and dispatch to appropriate handler
-            logger.info(f"Proceeding with AI logic for user {sender_id} in stage {user.current_stage}")
-
-            response_messages = None
-            if user.current_stage == 'ONBOARDING':
-                response_messages = handle_onboarding_stage(user, messaging_event)
-            elif user.current_stage == 'MARKETING':
-                response_messages = handle_marketing_stage(user, messaging_event)
-            elif user.current_stage == 'MOCK_EXAM':
-                response_messages = handle_mock_exam_stage(user, messaging_event)
-            elif user.current_stage == 'GENERAL_BOT':
-                response_messages = handle_general_bot_stage(user, messaging_event)
-            else:
-                logger.warning(f"Unknown stage for user {sender_id}: {user.current_stage}. Defaulting to General Bot.")
-                response_messages = handle_general_bot_stage(user, messaging_event)
-
-            if response_messages: # This will now be true if the list is not empty
-                for msg in response_messages:
-                    if msg: # Only process and send non-empty messages
-                        # Save SYSTEM_AI message to ChatLog
-                        ChatLog.objects.create(
-                            user=user,
-                            sender_type='SYSTEM_AI',
-                            message_content=msg
-                        )
-                        logger.info(f"Logged SYSTEM_AI message for {sender_id}: {msg}")
+                if message_text:
+                    ChatLog.objects.create(
+                        user=user,
+                        sender_type='USER',
+                        message_content=message_text
+                    )
+                    user.last_interaction_timestamp = timezone.now() # Use timezone.now()
+                    user.re_engagement_stage_index = 0 # Reset re-engagement stage on user interaction
+                    user.last_re_engagement_message_sent_at = None # Reset re-engagement timestamp
+                    user.save() # Save last_interaction_timestamp changes
+                    logger.info(f"User message logged for {sender_id}: {message_text}")
+                # If message_text is None or empty, we still proceed to stage handlers for processing.
+
+                # Step 7: Determine User Stage and dispatch to appropriate handler
+                logger.info(f"Proceeding with AI logic for user {sender_id} in stage {user.current_stage}")
+
+                response_messages = None
+                if user.current_stage == 'ONBOARDING':
+                    response_messages = handle_onboarding_stage(user, messaging_event)
+                elif user.current_stage == 'MARKETING':
+                    response_messages = handle_marketing_stage(user, messaging_event)
+                elif user.current_stage == 'MOCK_EXAM':
+                    response_messages = handle_mock_exam_stage(user, messaging_event)
+                elif user.current_stage == 'GENERAL_BOT':
+                    response_messages = handle_general_bot_stage(user, messaging_event)
+                else:
+                    logger.warning(f"Unknown stage for user {sender_id}: {user.current_stage}. Defaulting to General Bot.")
+                    response_messages = handle_general_bot_stage(user, messaging_event)
+
+                if response_messages: # This will now be true if the list is not empty
+                    for msg in response_messages:
+                        if msg: # Only process and send non-empty messages
+                            # Save SYSTEM_AI message to ChatLog
+                            ChatLog.objects.create(
+                                user=user,
+                                sender_type='SYSTEM_AI',
+                                message_content=msg
+                            )
+                            logger.info(f"Logged SYSTEM_AI message for {sender_id}: {msg}")
         
-                        send_messenger_message(sender_id, msg)
-                        logger.info(f"Sent stage-specific response to {sender_id}: {msg}")
-
-            # Step 11: Context Summarization Check (Sliding Window Algorithm)
-            # After all replies are generated and saved, check if the total number of
-            # unsummarized chat messages for this user exceeds 20.
-            user_chat_logs = ChatLog.objects.filter(user=user).order_by('timestamp')
-            if user_chat_logs.count() > 20:
-                messages_to_summarize = user_chat_logs[:14] # Get the oldest 14 messages
-                conversation_chunk = "\n".join([f"{log.sender_type}: {log.message_content}" for log in messages_to_summarize])
-
-                new_summary_text = ai_integration_service.summarize_conversation(
-                    user_id=user.user_id,
-                    conversation_chunk=conversation_chunk,
-                    existing_summary=user.summary
-                )
-                # Ensure summary is less than 1,000 characters
-                user.summary = (new_summary_text[:999] + '…') if len(new_summary_text) > 1000 else new_summary_text
-                user.save()
-                logger.info(f"Context summarized for user {sender_id}. New summary: {user.summary[:100]}...")
+                            send_messenger_message(sender_id, msg)
+                            logger.info(f"Sent stage-specific response to {sender_id}: {msg}")
+
+                chat_logs.flush() # The summarization check below needs the new logs' ids
 
-                # Optionally, delete the summarized messages to keep the log lean,
-                # or mark them as summarized. For now, we'll just summarize.
+                # Step 11: Context Summarization Check (Sliding Window Algorithm)
+                # After all replies are generated and saved, check if the total number of
+                # unsummarized chat messages for this user exceeds 20.
+                # The cached conversation ring usually answers this without touching ChatLog.
+                unsummarized = get_unsummarized_conversation(user.user_id, user.summarized_through_log_id)
+                if unsummarized is None:
+                    unsummarized_logs = ChatLog.objects.filter(user=user, id__gt=user.summarized_through_log_id).order_by('id')
+                    unsummarized = [(log.id, format_chat_log(log)) for log in unsummarized_logs[:21]]
+                if len(unsummarized) > 20:
+                    messages_to_summarize = unsummarized[:14] # Get the oldest 14 unsummarized messages
+                    new_summary_text = ai_integration_service.summarize_conversation(
+                        user_id=user.user_id,
+                        conversation_chunk=[line for _, line in messages_to_summarize],
+                        existing_summary=user.summary
+                    )
+                    if new_summary_text:
+                        # Ensure summary is less than 1,000 characters
+                        user.summary = (new_summary_text[:999] + '…') if len(new_summary_text) > 1000 else new_summary_text
+                        # Move the watermark past the summarized messages; chat.chat_log_archive
+                        # later moves them out of the hot table.
+                        user.summarized_through_log_id = messages_to_summarize[-1][0]
+                        user.save()
+                        logger.info(f"Context summarized for user {sender_id}. New summary: {user.summary[:100]}...")
+                    else:
+                        # Keep the summary and watermark; the next message retries the same messages
+                        logger.warning(f"Summarization failed for user {sender_id}; will retry on the next message.")
 
     except Exception as e: # Outer exception handler
         logger.error(f"Unhandled error in process_messenger_message task for sender {sender_id}: {e}", exc_info=True)
 
 
 
+def grade_exam_submission(submission_id):
+    """
+    Background task that grades a pipelined exam answer and then delivers
+    every feedback message that is ready, in question order.
+    """
+    try:
+        submission = ExamSubmission.objects.select_related('question').get(pk=submission_id)
+    except ExamSubmission.DoesNotExist:
+        logger.error(f"Exam submission {submission_id} not found for grading.")
+        return
+
+    if submission.status == 'PENDING':
+        ExamSubmission.objects.filter(pk=submission.pk, status='PENDING').update(grading_started_at=timezone.now())
+        # The AI call runs without holding the user lock so the student can keep answering.
+        feedback = ai_integration_service.grade_exam_answer(
+            user_id=submission.user_id,
+            question_text=submission.question.question_text,
+            user_answer=submission.answer_text,
+            expected_answer=submission.question.expected_answer
+        )
+        ExamSubmission.objects.filter(pk=submission.pk, status='PENDING').update(status='GRADED', feedback=feedback)
+        logger.info(f"Graded submission {submission.pk} ({submission.question_number}/8) for user {submission.user_id}.")
+
+    deliver_exam_feedback(submission.user_id)
+
+
+def deliver_exam_feedback(user_id):
+    """
+    Sends graded exam feedback to the user strictly in submission order.
+    Delivery stops at the first submission that is still being graded; the
+    task that grades it will pick up the rest. The final submission is
+    followed by the strength assessment and closing persuasion messages.
+    One task per user delivers at a time, under a per-user lease held across
+    both the reads and the sends, and a submission is only marked delivered
+    once its messages went out. No row lock is held while sending, so the
+    user's new messages never wait on delivery.
+    """
+    lease_name = EXAM_FEEDBACK_LEASE_NAME.format(user_id=user_id)
+    lease_seconds = getattr(settings, 'EXAM_FEEDBACK_LEASE_SECONDS', 120)
+    while True:
+        lease_run_id = acquire_lease(lease_name, lease_seconds)
+        if lease_run_id is None:
+            return # The holder delivers what is ready, and checks again once it lets go
+        try:
+            _deliver_ready_feedback(user_id, lease_name, lease_run_id, lease_seconds)
+        finally:
+            release_lease(lease_name, lease_run_id, forget=True)
+        # A submission graded while the lease was held found it taken; deliver it now
+        head_status = ExamSubmission.objects.filter(user_id=user_id).exclude(status='DELIVERED').values_list('status', flat=True).first()
+        if head_status not in ('GRADED', 'FEEDBACK_SENT'):
+            return
+
+
+def _deliver_ready_feedback(user_id, lease_name, lease_run_id, lease_seconds):
+    user = User.objects.get(user_id=user_id)
+    undelivered = ExamSubmission.objects.filter(user=user).exclude(status='DELIVERED').select_related('question')
+    with user_context(user):
+        for submission in undelivered:
+            if submission.status == 'PENDING':
+                requeue_stale_exam_submissions(ExamSubmission.objects.filter(pk=submission.pk))
+                break
+            if not renew_lease(lease_name, lease_run_id, lease_seconds):
+                logger.warning(f"Lost the exam feedback lease of user {user_id}; another task carries on.")
+                break
+
+            # A failed send raises and leaves the submission as it was, so the next delivery retries it
+            if submission.status == 'GRADED':
+                feedback_message, exam_result_fields = format_exam_feedback(submission.feedback)
+                if feedback_message:
+                    _send_or_raise(user, feedback_message)
+                with transaction.atomic():
+                    if exam_result_fields is not None:
+                        ExamResult.objects.create(user=user, question=submission.question, **exam_result_fields)
+                    if feedback_message:
+                        ChatLog.objects.create(user=user, sender_type='SYSTEM_AI', message_content=feedback_message)
+                    submission.status = 'FEEDBACK_SENT' if submission.is_final else 'DELIVERED'
+                    submission.save(update_fields=['status'])
+
+            if submission.status == 'FEEDBACK_SENT':
+                # The assessment reads the category scores, which now include the final answer
+                closing_messages = [ai_integration_service.generate_strength_assessment(user)]
+                closing_messages.extend(generate_persuasion_messages(user, 'exam_finished'))
+                closing_messages = [msg for msg in closing_messages if msg]
+                for msg in closing_messages:
+                    _send_or_raise(user, msg)
+                with transaction.atomic(), buffer_chat_logs():
+                    for msg in closing_messages:
+                        ChatLog.objects.create(user=user, sender_type='SYSTEM_AI', message_content=msg)
+                    submission.status = 'DELIVERED'
+                    submission.save(update_fields=['status'])
+
+            logger.info(f"Delivered feedback for submission {submission.pk} ({submission.question_number}/8) to user {user.user_id}.")
+
+
+def _send_or_raise(user, message):
+    # send_messenger_message returns False instead of raising on network errors; an unreachable user gets nothing either way
+    if not send_messenger_message(user.user_id, message) and user.is_messenger_reachable:
+        raise RuntimeError(f"Couldn't send exam feedback to user {user.user_id}")
+
+
+def _stale_exam_submissions(submissions, statuses):
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'EXAM_GRADING_TIMEOUT_SECONDS', 300))
+    return submissions.filter(status__in=statuses).filter(
+        Q(grading_started_at__lt=cutoff) | Q(grading_started_at__isnull=True, created_at__lt=cutoff)
+    )
+
+
+def requeue_stale_exam_submissions(submissions=None):
+    """
+    Sends submissions whose grading task died (still PENDING past
+    settings.EXAM_GRADING_TIMEOUT_SECONDS) back for grading. Each one is claimed
+    with a conditional UPDATE, so concurrent callers requeue it only once per timeout.
+    :return: The number of submissions requeued.
+    """
+    submissions = ExamSubmission.objects.all() if submissions is None else submissions
+    requeued = 0
+    for submission_id in _stale_exam_submissions(submissions, ['PENDING']).values_list('pk', flat=True):
+        if _stale_exam_submissions(ExamSubmission.objects.filter(pk=submission_id), ['PENDING']).update(grading_started_at=timezone.now()):
+            logger.warning(f"Exam submission {submission_id} timed out while grading; grading it again.")
+            enqueue_task(grade_exam_submission, submission_id)
+            requeued += 1
+    return requeued
+
+
+def recover_exam_feedback():
+    """
+    Cron task: regrades submissions whose grading timed out and restarts delivery for
+    users whose graded feedback is stuck (e.g., a Messenger send failed).
+    """
+    requeue_stale_exam_submissions()
+    stuck = _stale_exam_submissions(ExamSubmission.objects.all(), ['GRADED', 'FEEDBACK_SENT'])
+    for user_id in stuck.values_list('user_id', flat=True).distinct():
+        enqueue_task(deliver_exam_feedback, user_id)
+
+
+def _eligible_stage_index(hours_since_last_interaction, from_index=0):
+    """
+    Returns the index of the latest RE_ENGAGEMENT_INTERVALS window (at or after
+    from_index) that has opened for the given inactivity, or -1 if none has.
+    """
+    eligible_index = -1
+    for i, (min_h, max_h) in enumerate(RE_ENGAGEMENT_INTERVALS):
+        if i >= from_index and min_h < hours_since_last_interaction:
+            eligible_index = i
+    return eligible_index
+
+
 def check_inactive_users():
     """
-    Periodic task to identify inactive users and send re-engagement messages
-    based on a multi-stage schedule.
+    Periodic task to send re-engagement messages based on a multi-stage schedule.
+    Every User save keeps re_engagement_next_due_at pointing at the opening of their
+    next RE_ENGAGEMENT_INTERVALS window, so only users that are due now are read,
+    from an index. The due users are fanned out to send_re_engagement_chunk tasks
+    so the AI and Messenger calls spread across workers; outcomes are collected
+    in a ReEngagementRun.
     """
     logger.info("Running check_inactive_users task for multi-stage re-engagement...")
-    
+
+    # Overlapping dispatches (slow runs, cron retries, several nodes) must not scan the same users
+    lease_run_id = acquire_lease(RE_ENGAGEMENT_LEASE_NAME, getattr(settings, 'RE_ENGAGEMENT_LEASE_SECONDS', 300))
+    if lease_run_id is None:
+        logger.info("Another check_inactive_users run is in progress. Skipping.")
+        return
+    try:
+        _dispatch_re_engagement(lease_run_id)
+    finally:
+        release_lease(RE_ENGAGEMENT_LEASE_NAME, lease_run_id)
+
+
+def _dispatch_re_engagement(lease_run_id):
     now = timezone.now()
-    
-    # Get all users who are not in a mock exam and have interacted at least once
-    # and whose re_engagement_stage_index__lt indicates they still have stages left.
-    eligible_users = User.objects.filter(
-        current_stage__in=['ONBOARDING', 'MARKETING', 'GENERAL_BOT'],
-        last_interaction_timestamp__isnull=False,
-        re_engagement_stage_index__lt=len(RE_ENGAGEMENT_INTERVALS)
+    batch_size = getattr(settings, 'RE_ENGAGEMENT_BATCH_SIZE', 500)
+    chunk_size = getattr(settings, 'RE_ENGAGEMENT_CHUNK_SIZE', 10)
+
+    due_users = User.objects.filter(re_engagement_next_due_at__lt=now)
+    # While dispatching, total_chunks stays one ahead of the chunks enqueued so far, so
+    # chunks that finish before the last page is read can't close the run
+    run = ReEngagementRun.objects.create(lease_run_id=lease_run_id, total_chunks=1)
+
+    # Users inactive beyond the last window have passed every stage; close them out in one UPDATE.
+    completed_count = due_users.filter(
+        last_interaction_timestamp__lt=now - timedelta(hours=RE_ENGAGEMENT_INTERVALS[-1][1])
+    ).update(re_engagement_stage_index=len(RE_ENGAGEMENT_INTERVALS), re_engagement_next_due_at=None)
+    if completed_count:
+        logger.info(f"{completed_count} users have been inactive beyond all re-engagement stages. Marked as completed.")
+
+    q_options = {'group': 're-engagement'}
+    if getattr(settings, 'RE_ENGAGEMENT_CLUSTER', None):
+        q_options['cluster'] = settings.RE_ENGAGEMENT_CLUSTER # Separate lane so sends don't queue behind incoming messages
+
+    # Read the due user ids in keyset-paginated batches and enqueue each batch's chunks right
+    # away, so memory stays flat however many are due
+    due_count = chunk_count = 0
+    last_user_id = None
+    due_user_id_query = due_users.order_by('user_id').values_list('user_id', flat=True)
+    while True:
+        batch = due_user_id_query if last_user_id is None else due_user_id_query.filter(user_id__gt=last_user_id)
+        batch = list(batch[:batch_size])
+        if not batch:
+            break
+        last_user_id = batch[-1]
+        chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+        ReEngagementRun.objects.filter(pk=run.pk).update(
+            due_users=F('due_users') + len(batch),
+            total_chunks=F('total_chunks') + len(chunks),
+        )
+        for chunk in chunks:
+            enqueue_task(send_re_engagement_chunk, run.pk, chunk, q_options=q_options)
+        due_count += len(batch)
+        chunk_count += len(chunks)
+
+    ReEngagementRun.objects.filter(pk=run.pk).update(completed_users=completed_count, total_chunks=F('total_chunks') - 1)
+    ReEngagementRun.close_if_done(run.pk)
+
+    logger.info(f"Finished checking inactive users. Run {run.pk}: {due_count} due users in {chunk_count} chunks.")
+
+
+def purge_re_engagement_runs(keep_days=None):
+    """
+    Deletes ReEngagementRun reports started more than keep_days ago
+    (settings.RE_ENGAGEMENT_RUN_KEEP_DAYS, 30 by default). Run from the cron dispatch.
+    Returns the number of rows removed.
+    """
+    if keep_days is None:
+        keep_days = getattr(settings, 'RE_ENGAGEMENT_RUN_KEEP_DAYS', 30)
+    deleted, _ = ReEngagementRun.objects.filter(started_at__lt=timezone.now() - timedelta(days=keep_days)).delete()
+    return deleted
+
+
+def send_re_engagement_chunk(run_id, user_ids):
+    """
+    Sends the re-engagement message to each user in the chunk and records the
+    outcomes on the ReEngagementRun. A failure for one user doesn't stop the rest.
+    """
+    sent = skipped = failed = 0
+    recent_conversations = get_recent_conversations(user_ids, limit=5) # Conversation context for the whole chunk at once
+    for user_id in user_ids:
+        try:
+            if re_engage_user(user_id, recent_conversation=recent_conversations.get(user_id)):
+                sent += 1
+            else:
+                skipped += 1
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error re-engaging user {user_id} in run {run_id}: {e}", exc_info=True)
+    ReEngagementRun.record_chunk(run_id, sent=sent, skipped=skipped, failed=failed)
+    logger.info(f"Re-engagement run {run_id} chunk done: {sent} sent, {skipped} skipped, {failed} failed.")
+
+
+def _claim_re_engagement_stage(user, stage_index, sent_at=None):
+    """
+    Moves the user to stage_index only if their row still holds the re-engagement
+    state this worker read (compare-and-set). Exactly one of several workers
+    handling the same user wins, and a user who wrote back in the meantime is left alone.
+    :return: True if this worker claimed the stage.
+    """
+    claimed = user.__class__(
+        current_stage=user.current_stage,
+        last_interaction_timestamp=user.last_interaction_timestamp,
+        re_engagement_stage_index=stage_index,
     )
-    
-    re_engagement_attempts = 0
+    changes = {
+        're_engagement_stage_index': stage_index,
+        're_engagement_next_due_at': claimed.compute_re_engagement_next_due_at(),
+    }
+    if sent_at is not None:
+        changes['last_re_engagement_message_sent_at'] = sent_at
+    return bool(User.objects.filter(
+        user_id=user.user_id,
+        current_stage=user.current_stage,
+        last_interaction_timestamp=user.last_interaction_timestamp,
+        re_engagement_stage_index=user.re_engagement_stage_index,
+    ).update(**changes))
 
-    for user in eligible_users:
-        
-        hours_since_last_interaction = (now - user.last_interaction_timestamp).total_seconds() / 3600
-        # logger.info(f"User {user.user_id}: Hours since last interaction: {hours_since_last_interaction}")
-
-        # Determine the current stage the user is eligible for based on inactivity
-        # This is the stage they *should* be in, not necessarily the one they've received a message for.
-        current_eligible_stage_index = -1
-        for i, (min_h, max_h) in enumerate(RE_ENGAGEMENT_INTERVALS):
-            if min_h < hours_since_last_interaction <= max_h:
-                current_eligible_stage_index = i
-                break
-        
-        # If the user is eligible for a stage (current_eligible_stage_index != -1)
-        # AND they haven't received a message for this specific stage yet (user.re_engagement_stage_index <= current_eligible_stage_index)
-        # AND it's been long enough since the last re-engagement message was sent (to avoid spamming within the same stage window)
-        if current_eligible_stage_index != -1 and user.re_engagement_stage_index <= current_eligible_stage_index:
+
+def re_engage_user(user_id, recent_conversation=None):
+    """
+    Sends the re-engagement message for the stage whose window the user is in.
+    The stage is claimed with a compare-and-set update before the AI call, so a
+    user queued twice (or who wrote back meanwhile) is not messaged again, and no
+    row lock is held while waiting on OpenAI or the Graph API.
+    A draft pre-generated for the stage is sent when available.
+    Returns True if a message was sent.
+    recent_conversation (formatted lines, oldest first) may be prefetched with
+    chat.conversation_cache.get_recent_conversations.
+    """
+    user = User.objects.filter(user_id=user_id).first()
+    now = timezone.now()
+    used_draft = False
+    if user is None or user.re_engagement_next_due_at is None or user.re_engagement_next_due_at >= now:
+        return False
+
+    hours_since_last_interaction = (now - user.last_interaction_timestamp).total_seconds() / 3600
+    current_eligible_stage_index = _eligible_stage_index(hours_since_last_interaction, user.re_engagement_stage_index or 0)
+    if current_eligible_stage_index == -1:
+        return False
+    if hours_since_last_interaction > RE_ENGAGEMENT_INTERVALS[current_eligible_stage_index][1]:
+        # The dispatcher was late and the window has already closed; never message
+        # outside a window, just schedule the next stage.
+        if _claim_re_engagement_stage(user, current_eligible_stage_index + 1):
+            logger.info(f"User {user.user_id} missed re-engagement stage {current_eligible_stage_index + 1}. Skipping to the next stage.")
+        return False
+
+    if not _claim_re_engagement_stage(user, current_eligible_stage_index + 1, sent_at=now):
+        logger.info(f"User {user.user_id} re-engagement stage {current_eligible_stage_index + 1} already claimed or user is active again. Skipping.")
+        return False
+
+    try:
+        with user_context(user): # Lets the Messenger helpers reuse this User
+            logger.info(f"User {user.user_id} eligible for re-engagement stage {current_eligible_stage_index + 1}. Sending message.")
             
-            # Prevent sending multiple messages if cron runs more frequently than window duration
-            can_send_message = True
-            if user.last_re_engagement_message_sent_at and user.re_engagement_stage_index == current_eligible_stage_index + 1:
-                # If a message for this stage has already been sent (stage index incremented)
-                # Check if enough time has passed since that message was sent.
-                # This ensures we don't resend within the same stage if the cron runs multiple times
-                # while the user is still in the same time window and hasn't moved to the next stage.
-                # We consider "enough time" to be roughly half the smallest stage interval (e.g., 30 mins for 1-hour window)
-                if (now - user.last_re_engagement_message_sent_at).total_seconds() / 3600 < 0.5: # Changed from 3600 to 3800
-                    can_send_message = False
-
-            if can_send_message:
-                logger.info(f"User {user.user_id} eligible for re-engagement stage {current_eligible_stage_index + 1}. Sending message.")
-                
-                # Fetch recent chat logs for context
-                recent_chat_logs = ChatLog.objects.filter(user=user).order_by('-timestamp')[:5] # Get last 5 messages
-                conversation_history = "\n".join([f"{log.sender_type}: {log.message_content}" for log in recent_chat_logs[::-1]]) # Reverse for chronological order
+            # Use the message pre-generated for this stage, if any; otherwise generate it now
+            message_to_send = take_re_engagement_draft(user, current_eligible_stage_index)
+            used_draft = message_to_send is not None
+            if not used_draft:
+                # Recent chat logs for context
+                if recent_conversation is None:
+                    recent_conversation = get_recent_conversations([user.user_id], limit=5)[user.user_id]
                 
                 message_to_send = ai_integration_service.generate_re_engagement_message(
                     user_id=user.user_id,
                     first_name=user.first_name,
                     current_stage=user.current_stage,
                     user_summary=user.summary,
-                    conversation_history=conversation_history
+                    conversation_history=recent_conversation
                 )
-                
-                send_messenger_message(user.user_id, message_to_send)
-                ChatLog.objects.create(
-                    user=user,
-                    sender_type='SYSTEM_AI',
-                    message_content=message_to_send
-                )
-                logger.info(f"Sent and logged AI-composed re-engagement message to inactive user {user.user_id}: {message_to_send}")
-                
-                # Update user's state
-                user.re_engagement_stage_index = current_eligible_stage_index + 1 # Move to the next stage
-                user.last_re_engagement_message_sent_at = now
-                user.save()
-                
-                re_engagement_attempts += 1
-            else:
-                logger.info(f"User {user.user_id} is in re-engagement stage {current_eligible_stage_index + 1}, but message recently sent. Skipping.")
-        elif current_eligible_stage_index == -1 and user.re_engagement_stage_index < len(RE_ENGAGEMENT_INTERVALS):
-            # If the user's inactivity duration is outside of all defined stages
-            # (e.g., less than 1 hour or more than 22 hours) AND they haven't completed all stages,
-            # we consider them as having progressed past current re-engagement stages.
-            # This handles cases where they pass a stage without a cron trigger or fall outside
-            # the last stage.
-            if hours_since_last_interaction >= RE_ENGAGEMENT_INTERVALS[-1][1]: # If past the max of the last stage
-                logger.info(f"User {user.user_id} has been inactive beyond all re-engagement stages. Marking as completed.")
-                user.re_engagement_stage_index = len(RE_ENGAGEMENT_INTERVALS)
-                user.save()
-
-
-    logger.info(f"Finished checking inactive users. {re_engagement_attempts} re-engagement attempts made.")
+            
+            send_messenger_message(user.user_id, message_to_send)
+    except Exception:
+        # Hand the stage back so the next run retries it (unless the user has moved on meanwhile)
+        User.objects.filter(
+            user_id=user.user_id,
+            re_engagement_stage_index=current_eligible_stage_index + 1,
+            last_re_engagement_message_sent_at=now,
+        ).update(
+            re_engagement_stage_index=user.re_engagement_stage_index,
+            re_engagement_next_due_at=user.re_engagement_next_due_at,
+            last_re_engagement_message_sent_at=user.last_re_engagement_message_sent_at,
+        )
+        if used_draft:
+            ReEngagementDraft.objects.filter(
+                user=user, stage_index=current_eligible_stage_index, based_on_interaction=user.last_interaction_timestamp, status='SENT',
+            ).update(status='READY')
+        raise
+
+    ChatLog.objects.create(
+        user=user,
+        sender_type='SYSTEM_AI',
+        message_content=message_to_send
+    )
+    logger.info(f"Sent and logged AI-composed re-engagement message to inactive user {user.user_id}: {message_to_send}")
+    return True
@@ -1,12 +1,17 @@
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from unittest.mock import patch, MagicMock
-from chat.models import User, Question, ExamResult, ChatLog
-from chat.ai_integration import AIIntegration
+from chat.models import User, Question, ExamResult, ChatLog, DailyQuotaCounter
+from chat.quotas import get_quota_usage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from chat.ai_integration import AIIntegration, SharedCompletionError, _create_completion, _inflight_completions
 from django.conf import settings
 from chat.utils import get_prompt
 import openai
 from django.utils import timezone
 import datetime
+import threading
+import time
 
 # Mock settings for testing
 settings.OPEN_AI_TOKEN = 'test_openai_token'
@@ -23,7 +28,7 @@ class TestAIIntegration(TestCase):
             last_interaction_timestamp=timezone.now()
         )
         User.objects.create(user_id='test_user', first_name='TestErrorUser', current_stage='GENERAL_BOT')
-        self.conversation_history = "USER: Hello bot\nSYSTEM_AI: Hi TestUser, how can I help you?"
+        self.conversation_history = ["USER: Hello bot", "SYSTEM_AI: Hi TestUser, how can I help you?"]
         ChatLog.objects.create(user=self.user, sender_type='USER', message_content='Hello bot')
         ChatLog.objects.create(user=self.user, sender_type='SYSTEM_AI', message_content='Hi TestUser, how can I help you?')
 
@@ -320,8 +325,8 @@ class AIIntegrationNameExtractionTest(TestCase):
 class AIIntegrationGPT52UsageTest(TransactionTestCase):
     def setUp(self):
         self.ai_integration_service = AIIntegration()
-        self.user_general_bot = User.objects.create(user_id='general_user', current_stage='GENERAL_BOT', gpt_5_2_daily_count=0, gpt_5_2_last_reset_date=timezone.now().date())
-        self.user_onboarding = User.objects.create(user_id='onboarding_user', current_stage='ONBOARDING', gpt_5_2_daily_count=0, gpt_5_2_last_reset_date=timezone.now().date())
+        self.user_general_bot = User.objects.create(user_id='general_user', current_stage='GENERAL_BOT')
+        self.user_onboarding = User.objects.create(user_id='onboarding_user', current_stage='ONBOARDING')
         
         self.patcher_get_prompt = patch('chat.ai_integration.get_prompt', side_effect=lambda name, category: f"{name} content")
         self.mock_get_prompt = self.patcher_get_prompt.start()
@@ -329,126 +334,178 @@ class AIIntegrationGPT52UsageTest(TransactionTestCase):
     def tearDown(self):
         self.patcher_get_prompt.stop()
 
+    def _set_usage(self, user, count, day=None):
+        DailyQuotaCounter.objects.update_or_create(
+            name='gpt-5.2', scope=f"user:{user.user_id}", day=day or timezone.now().date(),
+            defaults={'count': count}
+        )
 
-    @patch('openai.chat.completions.create')
-    @patch('chat.ai_integration.reset_gpt_5_2_usage_if_new_day')
-    def test_general_bot_uses_gpt_5_2_under_limit(self, mock_reset, mock_create):
-        # User is in GENERAL_BOT, count is 0
-        self.user_general_bot.gpt_5_2_daily_count = 0
-        self.user_general_bot.save()
+    def _generate(self, user, prompt_category='GENERAL_BOT'):
+        return self.ai_integration_service.generate_chat_response(
+            user_id=user.user_id,
+            system_prompt_name='SYSTEM', user_prompt_name='USER', prompt_category=prompt_category, prompt_context={}
+        )
 
+    @patch('openai.chat.completions.create')
+    def test_general_bot_uses_gpt_5_2_under_limit(self, mock_create):
         mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="AI Response"))])
 
-        response = self.ai_integration_service.generate_chat_response(
-            user_id=self.user_general_bot.user_id,
-            system_prompt_name='SYSTEM', user_prompt_name='USER', prompt_category='GENERAL_BOT', prompt_context={}
-        )
+        response = self._generate(self.user_general_bot)
 
         self.assertEqual(response, "AI Response")
-        mock_reset.assert_called_once_with(self.user_general_bot)
         mock_create.assert_called_once()
         self.assertEqual(mock_create.call_args.kwargs['model'], 'gpt-5.2')
-        
-        # Refresh user to get updated count
-        self.user_general_bot.refresh_from_db()
-        self.assertEqual(self.user_general_bot.gpt_5_2_daily_count, 1)
+        self.assertEqual(get_quota_usage('gpt-5.2', user_id=self.user_general_bot.user_id), 1)
 
     @patch('openai.chat.completions.create')
-    @patch('chat.ai_integration.reset_gpt_5_2_usage_if_new_day')
-    def test_general_bot_falls_back_to_gpt_5_mini_over_limit(self, mock_reset, mock_create):
-        # User is in GENERAL_BOT, count is 10
-        self.user_general_bot.gpt_5_2_daily_count = 10
-        self.user_general_bot.save()
-
+    def test_general_bot_falls_back_to_gpt_5_mini_over_limit(self, mock_create):
+        self._set_usage(self.user_general_bot, 10)
         mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="AI Response"))])
 
-        response = self.ai_integration_service.generate_chat_response(
-            user_id=self.user_general_bot.user_id,
-            system_prompt_name='SYSTEM', user_prompt_name='USER', prompt_category='GENERAL_BOT', prompt_context={}
-        )
+        response = self._generate(self.user_general_bot)
 
         self.assertEqual(response, "AI Response")
-        mock_reset.assert_called_once_with(self.user_general_bot)
-        mock_create.assert_called_once()
         self.assertEqual(mock_create.call_args.kwargs['model'], 'gpt-5-mini')
-        
         # Count should not increment further
-        self.user_general_bot.refresh_from_db()
-        self.assertEqual(self.user_general_bot.gpt_5_2_daily_count, 10)
+        self.assertEqual(get_quota_usage('gpt-5.2', user_id=self.user_general_bot.user_id), 10)
 
     @patch('openai.chat.completions.create')
-    @patch('chat.ai_integration.reset_gpt_5_2_usage_if_new_day')
-    def test_non_general_bot_stage_uses_gpt_5_mini_no_count_increment(self, mock_reset, mock_create):
-        # User is in ONBOARDING, count is 0
-        self.user_onboarding.gpt_5_2_daily_count = 0
-        self.user_onboarding.save()
-
+    def test_non_general_bot_stage_uses_gpt_5_mini_no_count_increment(self, mock_create):
         mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="AI Response"))])
 
-        response = self.ai_integration_service.generate_chat_response(
-            user_id=self.user_onboarding.user_id,
-            system_prompt_name='SYSTEM', user_prompt_name='USER', prompt_category='ONBOARDING', prompt_context={}
-        )
+        response = self._generate(self.user_onboarding, prompt_category='ONBOARDING')
 
         self.assertEqual(response, "AI Response")
-        mock_reset.assert_not_called() # Should not call reset for non-general-bot
-        mock_create.assert_called_once()
         self.assertEqual(mock_create.call_args.kwargs['model'], 'gpt-5-mini') # Default model for general chat
-        
-        # Count should not increment
-        self.user_onboarding.refresh_from_db()
-        self.assertEqual(self.user_onboarding.gpt_5_2_daily_count, 0)
-    
-    @patch('openai.chat.completions.create')
-    @patch('chat.ai_integration.reset_gpt_5_2_usage_if_new_day')
-    def test_general_bot_resets_count_on_new_day_then_uses_gpt_5_2(self, mock_reset, mock_create):
-        # Set user's last reset date to a past date
-        self.user_general_bot.gpt_5_2_last_reset_date = (timezone.now().date() - datetime.timedelta(days=1))
-        self.user_general_bot.gpt_5_2_daily_count = 5 # Some count from yesterday
-        self.user_general_bot.save()
+        self.assertEqual(get_quota_usage('gpt-5.2', user_id=self.user_onboarding.user_id), 0)
 
+    @patch('openai.chat.completions.create')
+    def test_general_bot_new_day_starts_a_fresh_count(self, mock_create):
+        # Yesterday's usage is exhausted but lives in its own day bucket
+        self._set_usage(self.user_general_bot, 10, day=timezone.now().date() - datetime.timedelta(days=1))
         mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="AI Response"))])
-        mock_reset.side_effect = lambda user: setattr(user, 'gpt_5_2_daily_count', 0) or setattr(user, 'gpt_5_2_last_reset_date', timezone.now().date()) or user.save()
 
-        response = self.ai_integration_service.generate_chat_response(
-            user_id=self.user_general_bot.user_id,
-            system_prompt_name='SYSTEM', user_prompt_name='USER', prompt_category='GENERAL_BOT', prompt_context={}
-        )
+        self._generate(self.user_general_bot)
 
-        self.assertEqual(response, "AI Response")
-        mock_reset.assert_called_once_with(self.user_general_bot)
-        mock_create.assert_called_once()
         self.assertEqual(mock_create.call_args.kwargs['model'], 'gpt-5.2')
-        
-        self.user_general_bot.refresh_from_db()
-        self.assertEqual(self.user_general_bot.gpt_5_2_daily_count, 1) # Should be 1 after reset and new use
-        self.assertEqual(self.user_general_bot.gpt_5_2_last_reset_date, timezone.now().date())
+        self.assertEqual(get_quota_usage('gpt-5.2', user_id=self.user_general_bot.user_id), 1)
 
     @patch('openai.chat.completions.create')
-    @patch('chat.ai_integration.reset_gpt_5_2_usage_if_new_day')
-    def test_general_bot_fallback_after_limit_in_sequence(self, mock_reset, mock_create):
-        # Set user's gpt_5_2_daily_count to 9 initially
-        self.user_general_bot.gpt_5_2_daily_count = 9
-        self.user_general_bot.save()
-        
+    def test_general_bot_fallback_after_limit_in_sequence(self, mock_create):
+        self._set_usage(self.user_general_bot, 9)
         mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="AI Response"))])
 
         # --- 10th call ---
-        self.ai_integration_service.generate_chat_response(
-            user_id=self.user_general_bot.user_id,
-            system_prompt_name='SYSTEM', user_prompt_name='USER', prompt_category='GENERAL_BOT', prompt_context={}
-        )
-
-        user_after_10th = User.objects.get(user_id=self.user_general_bot.user_id)
-        self.assertEqual(user_after_10th.gpt_5_2_daily_count, 10)
+        self._generate(self.user_general_bot)
+        self.assertEqual(get_quota_usage('gpt-5.2', user_id=self.user_general_bot.user_id), 10)
         self.assertEqual(mock_create.call_args.kwargs['model'], 'gpt-5.2')
 
         # --- 11th call ---
-        self.ai_integration_service.generate_chat_response(
-            user_id=self.user_general_bot.user_id,
-            system_prompt_name='SYSTEM', user_prompt_name='USER', prompt_category='GENERAL_BOT', prompt_context={}
-        )
-
-        user_after_11th = User.objects.get(user_id=self.user_general_bot.user_id)
-        self.assertEqual(user_after_11th.gpt_5_2_daily_count, 10) # Should not increment
+        self._generate(self.user_general_bot)
+        self.assertEqual(get_quota_usage('gpt-5.2', user_id=self.user_general_bot.user_id), 10) # Should not increment
         self.assertEqual(mock_create.call_args.kwargs['model'], 'gpt-5-mini') # Should fall back
+
+    @patch('openai.chat.completions.create')
+    def test_quota_accounting_does_not_rewrite_user_row(self, mock_create):
+        mock_create.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="AI Response"))])
+
+        with CaptureQueriesContext(connection) as ctx:
+            self._generate(self.user_general_bot)
+
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "chat_user"')])
+
+
+class SingleflightCompletionTest(TestCase):
+    def setUp(self):
+        self.request = {'model': 'gpt-5-mini', 'messages': [{'role': 'user', 'content': 'Hello'}]}
+
+    def _run_concurrently(self, count, func):
+        results, errors = [], []
+
+        def worker():
+            try:
+                results.append(func())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    @patch('openai.chat.completions.create')
+    def test_concurrent_identical_requests_share_one_call(self, mock_create):
+        release = threading.Event()
+        response = MagicMock()
+        mock_create.side_effect = lambda **kwargs: release.wait(5) and response
+
+        threads, results, errors = self._run_concurrently(5, lambda: _create_completion(**self.request))
+        time.sleep(0.05) # Let every thread reach the in-flight entry before the upstream call returns
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result is response for result in results))
+        mock_create.assert_called_once_with(**self.request)
+
+    @patch('openai.chat.completions.create')
+    def test_different_requests_are_not_coalesced(self, mock_create):
+        _create_completion(**self.request)
+        _create_completion(model='gpt-5.2', messages=self.request['messages'])
+        # Sequential identical requests are not cached by default
+        _create_completion(**self.request)
+        self.assertEqual(mock_create.call_count, 3)
+
+    @patch('openai.chat.completions.create')
+    def test_error_is_shared_by_waiting_callers(self, mock_create):
+        release = threading.Event()
+
+        def failing_create(**kwargs):
+            release.wait(5)
+            raise openai.OpenAIError('upstream down')
+        mock_create.side_effect = failing_create
+
+        threads, results, errors = self._run_concurrently(3, lambda: _create_completion(**self.request))
+        time.sleep(0.05) # Let every thread reach the in-flight entry before the upstream call fails
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 3)
+        mock_create.assert_called_once()
+        self.assertEqual(_inflight_completions, {})
+        # The leader raises the upstream error; each waiting caller gets its own exception chained from it
+        leader_errors = [error for error in errors if not isinstance(error, SharedCompletionError)]
+        self.assertEqual(len(leader_errors), 1)
+        for error in errors:
+            if error is not leader_errors[0]:
+                self.assertIsInstance(error, openai.OpenAIError)
+                self.assertIs(error.__cause__, leader_errors[0])
+
+    @override_settings(LLM_SINGLEFLIGHT_WAIT_SECONDS=0.05)
+    @patch('openai.chat.completions.create')
+    def test_waiting_caller_calls_upstream_after_timeout(self, mock_create):
+        release = threading.Event()
+        leader_response, own_response = MagicMock(), MagicMock()
+        # The leader's call hangs until released; the timed-out caller's own call returns at once
+        mock_create.side_effect = lambda **kwargs: release.wait(5) and leader_response if threading.current_thread() is leader else own_response
+
+        leader = threading.Thread(target=lambda: _create_completion(**self.request))
+        leader.start()
+        time.sleep(0.02) # Let the leader register the in-flight entry
+        try:
+            self.assertIs(_create_completion(**self.request), own_response)
+        finally:
+            release.set()
+            leader.join(5)
+        self.assertEqual(mock_create.call_count, 2)
+
+    @override_settings(LLM_SINGLEFLIGHT_CACHE_TTL=30, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'singleflight-test'}})
+    @patch('openai.chat.completions.create', return_value='cached response')
+    def test_cache_ttl_reuses_recent_response(self, mock_create):
+        self.assertEqual(_create_completion(**self.request), 'cached response')
+        self.assertEqual(_create_completion(**self.request), 'cached response')
+        mock_create.assert_called_once()
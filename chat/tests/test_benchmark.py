@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from io import StringIO
+from chat.benchmark import run_pipeline_benchmark, percentile
+from chat.models import User, DailyQuotaCounter, LLMUsage
+
+
+class PipelineBenchmarkTest(TestCase):
+    def test_runs_every_stage_and_reports_metrics(self):
+        # Tasks run inline: worker threads wouldn't see this test's uncommitted transaction
+        results = run_pipeline_benchmark(messages_per_stage=2, workers=0)
+
+        self.assertEqual(results['messages'], 8)
+        self.assertEqual(results['delivered'], 8)
+        self.assertEqual(results['errors'], [])
+        self.assertEqual(set(results['latency_ms_by_stage']), {'ONBOARDING', 'MARKETING', 'MOCK_EXAM', 'GENERAL_BOT'})
+        self.assertIsNotNone(results['latency_ms']['p99'])
+        self.assertGreater(results['db_queries']['per_message']['mean'], 0)
+        self.assertGreaterEqual(results['graph_api']['messages'], 16) # Loading message plus at least one reply each
+        # Synthetic users are cleaned up
+        self.assertFalse(User.objects.filter(user_id__startswith='bench-').exists())
+
+    @override_settings(AI_MODEL_QUOTAS={'gpt-5.2': {'per_user': 10, 'global': 100}})
+    def test_leaves_shared_counters_as_it_found_them(self):
+        today = timezone.now().date()
+        DailyQuotaCounter.objects.create(name='gpt-5.2', scope='global', day=today, count=5)
+        LLMUsage.objects.create(day=today, call_type='GENERAL_BOT', model='gpt-5.2', calls=3, prompt_tokens=300)
+
+        # Usage is written right away, as it is when the benchmark runs outside a test transaction
+        with patch('chat.llm_usage.transaction.on_commit', side_effect=lambda func: func()):
+            results = run_pipeline_benchmark(messages_per_stage=2, workers=0)
+
+        self.assertEqual(results['errors'], [])
+        self.assertEqual(list(DailyQuotaCounter.objects.values_list('scope', 'count')), [('global', 5)])
+        self.assertEqual(list(LLMUsage.objects.values_list('call_type', 'model', 'calls', 'prompt_tokens')),
+                         [('GENERAL_BOT', 'gpt-5.2', 3, 300)])
+
+    def test_command_writes_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('benchmark_pipeline', messages_per_stage=1, workers=0, label='test', output=path, stdout=StringIO())
+            with open(path) as f:
+                results = json.load(f)
+        self.assertEqual(results['label'], 'test')
+        self.assertEqual(results['messages'], 4)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertIsNone(percentile([], 50))
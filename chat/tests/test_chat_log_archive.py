@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest.mock import patch, MagicMock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from chat import chat_log_archive
+from chat.chat_log_archive import archive_user_chat_logs, archive_chat_logs, get_chat_history, decode_chat_logs, ARCHIVAL_LEASE_NAME
+from chat.leases import acquire_lease
+from chat.models import User, ChatLog, ChatLogArchive
+from chat.tasks import process_messenger_message
+
+
+class ChatLogArchiveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_id='archive_user', first_name='Juan', current_stage='GENERAL_BOT', exam_question_counter=-1)
+        start = datetime(2026, 1, 20, tzinfo=dt_timezone.utc)
+        # 30 logs, one every two days: spans January to March
+        self.logs = [
+            ChatLog.objects.create(user=self.user, sender_type='USER' if i % 2 else 'SYSTEM_AI',
+                                   message_content=f"Message {i} ✓", timestamp=start + timedelta(days=2 * i))
+            for i in range(30)
+        ]
+
+    def test_archives_summarized_logs_by_month(self):
+        self.user.summarized_through_log_id = self.logs[13].id
+        self.user.save()
+
+        archived = archive_user_chat_logs(self.user, keep_latest=5)
+
+        self.assertEqual(archived, 14)
+        self.assertEqual(list(ChatLog.objects.filter(user=self.user).values_list('id', flat=True)), [log.id for log in self.logs[14:]])
+        archives = list(ChatLogArchive.objects.filter(user=self.user))
+        self.assertEqual([archive.month.month for archive in archives], [1, 2])
+        self.assertEqual(sum(archive.log_count for archive in archives), 14)
+        decoded = decode_chat_logs(archives[0])
+        self.assertEqual([(log.id, log.message_content, log.timestamp) for log in decoded],
+                         [(log.id, log.message_content, log.timestamp) for log in self.logs[:6]])
+
+    def test_history_reads_through_the_archive(self):
+        self.user.summarized_through_log_id = self.logs[19].id
+        self.user.save()
+        archive_user_chat_logs(self.user, keep_latest=5)
+
+        history = get_chat_history(self.user.user_id)
+
+        self.assertEqual([(log.id, log.sender_type, log.message_content) for log in history],
+                         [(log.id, log.sender_type, log.message_content) for log in self.logs])
+        since = self.logs[25].timestamp
+        self.assertEqual([log.id for log in get_chat_history(self.user.user_id, since=since)], [log.id for log in self.logs[25:]])
+        self.assertEqual(len(get_chat_history(self.user.user_id, include_archived=False)), 10)
+
+    def test_keeps_latest_logs_and_archives_old_ones(self):
+        archived = archive_user_chat_logs(self.user, older_than=timezone.now(), keep_latest=8)
+
+        self.assertEqual(archived, 22)
+        self.assertEqual(ChatLog.objects.filter(user=self.user).count(), 8)
+
+    def test_later_passes_add_chunks(self):
+        self.user.summarized_through_log_id = self.logs[2].id
+        archive_user_chat_logs(self.user)
+        self.user.summarized_through_log_id = self.logs[5].id
+        archive_user_chat_logs(self.user)
+
+        self.assertEqual(list(ChatLogArchive.objects.values_list('month', 'chunk', 'log_count')),
+                         [(datetime(2026, 1, 1).date(), 1, 3), (datetime(2026, 1, 1).date(), 2, 3)])
+
+    def test_nothing_to_archive(self):
+        self.assertEqual(archive_user_chat_logs(self.user), 0)
+        self.assertFalse(ChatLogArchive.objects.exists())
+
+    @override_settings(TASK_QUEUE_SYNC=True)
+    def test_job_fans_out_batches_and_respects_lease(self):
+        self.user.summarized_through_log_id = self.logs[9].id
+        self.user.save()
+        other = User.objects.create(user_id='archive_other')
+        ChatLog.objects.create(user=other, sender_type='USER', message_content="Old", timestamp=timezone.now() - timedelta(days=100))
+        ChatLog.objects.create(user=other, sender_type='USER', message_content="New")
+        User.objects.create(user_id='archive_nothing', summarized_through_log_id=10**9) # Already archived
+
+        with patch('chat.chat_log_archive.enqueue_task', wraps=chat_log_archive.enqueue_task) as mock_enqueue:
+            totals = archive_chat_logs(older_than_days=30, keep_latest=1, users_per_batch=1)
+
+        self.assertEqual(totals, {'users': 2, 'batches': 2})
+        self.assertEqual([call.args[1] for call in mock_enqueue.call_args_list], [['archive_other'], ['archive_user']])
+        self.assertEqual(ChatLog.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(list(ChatLog.objects.filter(user=other).values_list('message_content', flat=True)), ["New"])
+        acquire_lease(ARCHIVAL_LEASE_NAME, 60)
+        self.assertIsNone(archive_chat_logs())
+
+    def test_job_skips_users_without_archivable_logs(self):
+        self.user.summarized_through_log_id = self.logs[9].id
+        self.user.save()
+        archive_user_chat_logs(self.user)
+
+        with patch('chat.chat_log_archive.enqueue_task') as mock_enqueue:
+            self.assertEqual(archive_chat_logs(), {'users': 0, 'batches': 0})
+        mock_enqueue.assert_not_called()
+
+    @override_settings(CHAT_LOG_ARCHIVE_CODEC='zstd')
+    def test_zstd_falls_back_to_gzip_without_zstandard(self):
+        self.user.summarized_through_log_id = self.logs[3].id
+        with patch.object(chat_log_archive, 'zstandard', None):
+            archive_user_chat_logs(self.user)
+        archive = ChatLogArchive.objects.get()
+        self.assertEqual(archive.codec, 'gzip')
+        self.assertEqual(len(decode_chat_logs(archive)), 4)
+
+
+@override_settings(FACEBOOK_PAGE_ACCESS_TOKEN='test_access_token', LLM_BACKEND='chat.llm_backends.SimulatedLLMBackend',
+                   LLM_SIMULATION={'latency_ms': {'distribution': 'fixed', 'median': 0, 'min': 0}, 'tokens_per_second': 0})
+@patch('chat.messenger_api.requests.post', return_value=MagicMock(status_code=200))
+class SummarizationWatermarkTest(TestCase):
+    def test_summarized_logs_are_not_summarized_again(self, mock_post):
+        user = User.objects.create(user_id='watermark_user', first_name='Juan', current_stage='GENERAL_BOT', exam_question_counter=-1)
+        logs = [ChatLog.objects.create(user=user, sender_type='USER', message_content=f"Message {i}") for i in range(20)]
+        event = {'sender': {'id': user.user_id}, 'recipient': {'id': 'PAGE_ID'}, 'message': {'mid': 'mid.1', 'text': 'What is estafa?'}}
+
+        with patch('chat.tasks.ai_integration_service.summarize_conversation', return_value='Summary') as mock_summarize:
+            process_messenger_message(event)
+            user.refresh_from_db()
+            self.assertEqual(user.summarized_through_log_id, logs[13].id)
+            self.assertEqual(mock_summarize.call_args.kwargs['conversation_chunk'][0], 'USER: Message 0')
+
+            # 8 unsummarized logs remain, so the next message doesn't summarize again
+            process_messenger_message(event)
+            self.assertEqual(mock_summarize.call_count, 1)
+
+    def test_failed_summarization_keeps_summary_and_watermark(self, mock_post):
+        user = User.objects.create(user_id='watermark_fail_user', first_name='Juan', current_stage='GENERAL_BOT',
+                                   exam_question_counter=-1, summary='Likes criminal law.')
+        for i in range(20):
+            ChatLog.objects.create(user=user, sender_type='USER', message_content=f"Message {i}")
+        event = {'sender': {'id': user.user_id}, 'recipient': {'id': 'PAGE_ID'}, 'message': {'mid': 'mid.1', 'text': 'What is estafa?'}}
+
+        with patch('chat.tasks.ai_integration_service.summarize_conversation', return_value=None) as mock_summarize:
+            process_messenger_message(event)
+            user.refresh_from_db()
+            self.assertEqual(user.summary, 'Likes criminal law.')
+            self.assertEqual(user.summarized_through_log_id, 0)
+
+            # The same messages are summarized again on the next message
+            process_messenger_message(event)
+            self.assertEqual(mock_summarize.call_count, 2)
+            self.assertEqual(mock_summarize.call_args.kwargs['conversation_chunk'][0], 'USER: Message 0')
+
+
+class ChatLogArchiveAdminTest(TestCase):
+    def test_change_page_shows_archived_messages(self):
+        from django.contrib.auth.models import User as AdminUser
+        self.client.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        user = User.objects.create(user_id='archive_admin_user')
+        logs = [ChatLog.objects.create(user=user, sender_type='USER', message_content=f"Archived <b>{i}</b>") for i in range(3)]
+        user.summarized_through_log_id = logs[-1].id
+        archive_user_chat_logs(user, keep_latest=0)
+
+        response = self.client.get(f"/admin/chat/chatlogarchive/{ChatLogArchive.objects.get().pk}/change/")
+
+        self.assertContains(response, 'Archived &lt;b&gt;2&lt;/b&gt;')
@@ -0,0 +1,82 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from chat.chat_log_buffer import buffer_chat_logs, _assign_ids
+from chat.conversation_cache import get_conversation_ring, get_recent_conversation
+from chat.models import User, ChatLog
+
+
+class ChatLogBufferTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(user_id='buffer_user')
+
+    def test_logs_are_written_in_one_insert_on_exit(self):
+        with self.assertNumQueries(1):
+            with buffer_chat_logs():
+                logs = [ChatLog.objects.create(user=self.user, sender_type='SYSTEM_AI', message_content=f"Reply {i}") for i in range(4)]
+                self.assertIsNone(logs[0].pk)
+
+        self.assertEqual([log.pk for log in logs], list(ChatLog.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual([log.message_content for log in ChatLog.objects.order_by('timestamp')], [f"Reply {i}" for i in range(4)])
+
+    def test_ids_are_read_back_when_the_backend_cannot_return_them(self):
+        ChatLog.objects.create(user=self.user, sender_type='USER', message_content='Earlier')
+        # As on MySQL
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                patch('chat.chat_log_buffer._assign_ids', wraps=_assign_ids) as mock_assign_ids:
+            with buffer_chat_logs():
+                logs = [ChatLog.objects.create(user=self.user, sender_type='SYSTEM_AI', message_content=f"Reply {i}") for i in range(2)]
+
+        mock_assign_ids.assert_called_once()
+
+        self.assertEqual([log.pk for log in logs], list(ChatLog.objects.filter(message_content__startswith='Reply').order_by('id').values_list('id', flat=True)))
+
+    def test_read_back_ignores_logs_written_concurrently_without_the_user_lock(self):
+        real_bulk_create = ChatLog.objects.bulk_create
+
+        def bulk_create_then_re_engage(logs):
+            written = real_bulk_create(logs)
+            # Another worker (e.g. re_engage_user) writes without the user's row lock
+            ChatLog(user=self.user, sender_type='SYSTEM_AI', message_content='Still there?').save()
+            return written
+
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                patch.object(ChatLog.objects, 'bulk_create', side_effect=bulk_create_then_re_engage):
+            with buffer_chat_logs():
+                logs = [ChatLog.objects.create(user=self.user, sender_type='SYSTEM_AI', message_content=f"Reply {i}") for i in range(2)]
+
+        self.assertEqual(ChatLog.objects.count(), 3)
+        self.assertEqual([ChatLog.objects.get(pk=log.pk).message_content for log in logs], ['Reply 0', 'Reply 1'])
+
+    def test_nothing_is_written_if_the_block_raises(self):
+        with self.assertRaises(ValueError):
+            with buffer_chat_logs():
+                ChatLog.objects.create(user=self.user, sender_type='USER', message_content='Lost')
+                raise ValueError
+        self.assertFalse(ChatLog.objects.exists())
+
+    def test_nested_blocks_share_the_outer_buffer(self):
+        with buffer_chat_logs() as outer:
+            with buffer_chat_logs() as inner:
+                ChatLog.objects.create(user=self.user, sender_type='USER', message_content='Hi')
+            self.assertIs(inner, outer)
+            self.assertFalse(ChatLog.objects.exists())
+        self.assertEqual(ChatLog.objects.count(), 1)
+
+    @override_settings(CONVERSATION_RING_ENABLED=True)
+    def test_conversation_includes_buffered_logs_and_ring_is_updated_on_flush(self):
+        get_conversation_ring(self.user.user_id)
+        with self.captureOnCommitCallbacks(execute=True), buffer_chat_logs() as buffer:
+            ChatLog.objects.create(user=self.user, sender_type='USER', message_content='What is estafa?')
+            self.assertEqual(get_recent_conversation(self.user.user_id), ['USER: What is estafa?'])
+            buffer.flush()
+            ChatLog.objects.create(user=self.user, sender_type='SYSTEM_AI', message_content='Estafa is...')
+            # Written but not committed: still served from the buffer, not duplicated
+            self.assertEqual(get_recent_conversation(self.user.user_id), ['USER: What is estafa?', 'SYSTEM_AI: Estafa is...'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_recent_conversation(self.user.user_id), ['USER: What is estafa?', 'SYSTEM_AI: Estafa is...'])
+        self.assertEqual([log_id for log_id, _ in get_conversation_ring(self.user.user_id)['entries']],
+                         list(ChatLog.objects.order_by('id').values_list('id', flat=True)))
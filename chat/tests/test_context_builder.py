@@ -0,0 +1,135 @@
+from unittest.mock import patch, MagicMock
+from django.test import TestCase, override_settings
+from chat import context_builder
+from chat.ai_integration import AIIntegration
+from chat.context_builder import (
+    build_context, count_tokens, get_context_budget, pack_prompt_context, truncate_tokens, TRUNCATION_MARK,
+)
+from chat.models import User
+
+
+# Small budgets so the estimate (4 characters per token) is easy to follow
+TEST_BUDGETS = {
+    'GENERAL_BOT': {'total': 30, 'message': 10, 'summary': 5, 'turn': 5, 'max_turns': 12},
+    'SUMMARIZATION': {'total': 30, 'summary': 5, 'turn': 5},
+    'RE_ENGAGEMENT': {'total': 12, 'summary': 3, 'turn': 5},
+}
+
+
+@patch.object(context_builder, 'tiktoken', None)
+class ContextBuilderTest(TestCase):
+    def setUp(self):
+        context_builder._encoding.cache_clear()
+        self.addCleanup(context_builder._encoding.cache_clear)
+
+    def test_counts_tokens_by_estimate_without_tiktoken(self):
+        self.assertEqual(count_tokens(''), 0)
+        self.assertEqual(count_tokens('abcd'), 1)
+        self.assertEqual(count_tokens('abcde'), 2)
+
+    def test_truncate_keeps_the_beginning_within_budget(self):
+        self.assertEqual(truncate_tokens('short', 5), 'short')
+        truncated = truncate_tokens('x' * 100, 5)
+        self.assertTrue(truncated.startswith('xxx'))
+        self.assertTrue(truncated.endswith(TRUNCATION_MARK))
+        self.assertLessEqual(count_tokens(truncated), 5)
+
+    @override_settings(LLM_CONTEXT_BUDGETS={'GENERAL_BOT': {'total': 99}})
+    def test_settings_override_default_budget_per_key(self):
+        budget = get_context_budget('GENERAL_BOT')
+        self.assertEqual(budget['total'], 99)
+        self.assertEqual(budget['summary'], context_builder.DEFAULT_CONTEXT_BUDGETS['GENERAL_BOT']['summary'])
+        self.assertIsNone(get_context_budget('QUICK_REPLY'))
+
+    @override_settings(LLM_CONTEXT_BUDGETS=TEST_BUDGETS)
+    def test_drops_oldest_turns_once_the_budget_is_used(self):
+        turns = [f"USER: turn {i:02d}" for i in range(10)] # 4 tokens each, plus 1 for the newline
+        context = build_context('GENERAL_BOT', turns=turns, summary='Likes torts', message='What is estafa?')
+
+        self.assertEqual(context.message, 'What is estafa?')
+        self.assertEqual(context.summary, 'Likes torts')
+        # 30 - 4 (message) - 3 (summary) leaves room for the 4 newest turns
+        self.assertEqual(context.turns, turns[-4:])
+        self.assertEqual(context.dropped_turns, 6)
+        self.assertLessEqual(context.tokens, 30)
+
+    @override_settings(LLM_CONTEXT_BUDGETS=TEST_BUDGETS)
+    def test_clips_long_parts_to_their_caps(self):
+        long_answer = 'SYSTEM_AI: ' + 'The elements of estafa are ' * 20
+        context = build_context('GENERAL_BOT', turns=['USER: hi', long_answer], summary='s' * 100, message='m' * 100)
+
+        self.assertEqual(count_tokens(context.message), 10)
+        self.assertEqual(count_tokens(context.summary), 5)
+        self.assertEqual(context.turns[0], 'USER: hi')
+        self.assertTrue(context.turns[1].startswith('SYSTEM_AI: The'))
+        self.assertLessEqual(count_tokens(context.turns[1]), 5)
+
+    @override_settings(LLM_CONTEXT_BUDGETS=TEST_BUDGETS)
+    def test_multiline_turns_stay_whole(self):
+        context = build_context('RE_ENGAGEMENT', turns=["USER: hi", "AI: 1.\n2."])
+        self.assertEqual(context.turns, ["USER: hi", "AI: 1.\n2."])
+        with self.assertRaises(TypeError):
+            build_context('RE_ENGAGEMENT', turns="USER: hi\nSYSTEM_AI: hello")
+
+    @override_settings(LLM_CONTEXT_BUDGETS={'RE_ENGAGEMENT': {'total': 4, 'summary': 2, 'turn': 100}})
+    def test_latest_turn_is_clipped_rather_than_dropped(self):
+        context = build_context('RE_ENGAGEMENT', turns=['USER: ' + 'a' * 50], summary='Likes torts')
+        self.assertEqual(len(context.turns), 1)
+        self.assertLessEqual(context.tokens, 4)
+
+    @override_settings(LLM_CONTEXT_BUDGETS=TEST_BUDGETS)
+    def test_pack_prompt_context_only_touches_known_keys(self):
+        prompt_context = {'user_first_name': 'Juan', 'user_summary': 's' * 100, 'message_text': 'Hi', 'conversation_history': ['USER: a', 'USER: b']}
+        packed = pack_prompt_context('GENERAL_BOT', prompt_context)
+        self.assertEqual(packed['user_first_name'], 'Juan')
+        self.assertEqual(packed['conversation_history'], "USER: a\nUSER: b")
+        self.assertEqual(count_tokens(packed['user_summary']), 5)
+
+        self.assertIs(pack_prompt_context('QUICK_REPLY', prompt_context), prompt_context)
+        self.assertEqual(pack_prompt_context('GENERAL_BOT', {'user_message': 'Hello'}), {'user_message': 'Hello'})
+
+
+@patch.object(context_builder, 'tiktoken', None)
+@override_settings(LLM_CONTEXT_BUDGETS=TEST_BUDGETS)
+class ContextBudgetInPromptsTest(TestCase):
+    def setUp(self):
+        context_builder._encoding.cache_clear()
+        self.addCleanup(context_builder._encoding.cache_clear)
+        self.ai_integration_service = AIIntegration()
+        self.user = User.objects.create(user_id='budget_user', first_name='Juan', current_stage='MARKETING')
+        self.turns = [f"USER: turn {i:02d}" for i in range(10)]
+
+    def completion(self):
+        return MagicMock(choices=[MagicMock(message=MagicMock(content='Reply'))])
+
+    def user_prompt(self, mock_create):
+        return mock_create.call_args.kwargs['messages'][-1]['content']
+
+    @patch('chat.ai_integration.openai.chat.completions.create')
+    def test_chat_response_history_fits_the_budget(self, mock_create):
+        mock_create.return_value = self.completion()
+        self.ai_integration_service.generate_chat_response(
+            user_id=self.user.user_id,
+            system_prompt_name='GENERAL_BOT_SYSTEM_PROMPT',
+            user_prompt_name='GENERAL_BOT_USER_PROMPT_TEMPLATE',
+            prompt_category='GENERAL_BOT',
+            prompt_context={'user_first_name': 'Juan', 'user_summary': 'Likes torts', 'message_text': 'What is estafa?', 'conversation_history': self.turns},
+        )
+        prompt = self.user_prompt(mock_create)
+        self.assertIn('USER: turn 09', prompt)
+        self.assertNotIn('USER: turn 05', prompt)
+
+    @patch('chat.ai_integration.openai.chat.completions.create')
+    def test_summarization_clips_existing_summary(self, mock_create):
+        mock_create.return_value = self.completion()
+        self.ai_integration_service.summarize_conversation(self.user.user_id, self.turns[:3], existing_summary='s' * 100)
+        prompt = self.user_prompt(mock_create)
+        self.assertIn("USER: turn 00\nUSER: turn 01\nUSER: turn 02", prompt)
+        self.assertNotIn('s' * 30, prompt)
+
+    def test_re_engagement_history_fits_the_budget(self):
+        messages = self.ai_integration_service.build_re_engagement_messages('Juan', 'MARKETING', None, self.turns)
+        prompt = messages[-1]['content']
+        self.assertIn('USER: turn 09', prompt)
+        self.assertNotIn('USER: turn 07', prompt)
+        self.assertIn('No summary available.', prompt)
@@ -0,0 +1,144 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from chat import conversation_cache
+from chat.conversation_cache import (
+    get_conversation_ring, get_recent_conversation, get_recent_conversations, get_unsummarized_conversation,
+    CONVERSATION_RING_KEY, CONVERSATION_RING_LOCK_KEY,
+)
+from chat.models import User, ChatLog
+from chat.tasks import process_messenger_message
+
+
+@override_settings(CONVERSATION_RING_SIZE=6, CONVERSATION_RING_ENABLED=True)
+class ConversationRingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(user_id='ring_user')
+
+    def add_logs(self, count, start=0):
+        with self.captureOnCommitCallbacks(execute=True): # The ring is updated once the logs are committed
+            return [
+                ChatLog.objects.create(user=self.user, sender_type='USER' if i % 2 == 0 else 'SYSTEM_AI', message_content=f"Message {i}")
+                for i in range(start, start + count)
+            ]
+
+    def test_miss_rebuilds_from_database_once(self):
+        ChatLog.objects.bulk_create(ChatLog(user=self.user, sender_type='USER', message_content=f"Message {i}") for i in range(3)) # No signals
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_recent_conversation(self.user.user_id, limit=2), ['USER: Message 1', 'USER: Message 2'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_recent_conversation(self.user.user_id, limit=5), ['USER: Message 0', 'USER: Message 1', 'USER: Message 2'])
+
+    def test_new_chat_logs_are_written_through(self):
+        get_conversation_ring(self.user.user_id)
+        self.add_logs(3)
+
+        with self.assertNumQueries(0):
+            conversation = get_recent_conversation(self.user.user_id, limit=5)
+        self.assertEqual(conversation, ['USER: Message 0', 'SYSTEM_AI: Message 1', 'USER: Message 2'])
+
+    def test_ring_keeps_only_the_latest_messages(self):
+        get_conversation_ring(self.user.user_id)
+        logs = self.add_logs(8)
+
+        ring = get_conversation_ring(self.user.user_id)
+        self.assertEqual([log_id for log_id, _ in ring['entries']], [log.id for log in logs[2:]])
+        self.assertFalse(ring['complete'])
+
+    def test_rebuilt_ring_knows_whether_it_has_the_whole_history(self):
+        self.add_logs(6)
+        cache.clear()
+        self.assertTrue(get_conversation_ring(self.user.user_id)['complete'])
+        self.add_logs(1, start=6)
+        cache.clear()
+        self.assertFalse(get_conversation_ring(self.user.user_id)['complete'])
+
+    def test_unsummarized_conversation(self):
+        get_conversation_ring(self.user.user_id)
+        logs = self.add_logs(8)
+        # The ring (last 6) reaches back past the watermark: answered from the cache
+        with self.assertNumQueries(0):
+            unsummarized = get_unsummarized_conversation(self.user.user_id, logs[3].id)
+        self.assertEqual([log_id for log_id, _ in unsummarized], [log.id for log in logs[4:]])
+        # Everything in the ring is past the watermark and older messages exist: unknown
+        self.assertIsNone(get_unsummarized_conversation(self.user.user_id, 0))
+
+    def test_several_users_in_one_round_trip(self):
+        other = User.objects.create(user_id='ring_other')
+        self.add_logs(2)
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            conversations = get_recent_conversations([self.user.user_id, other.user_id, 'ring_missing'])
+        self.assertEqual(conversations, {'ring_user': ['USER: Message 0', 'SYSTEM_AI: Message 1'], 'ring_other': [], 'ring_missing': []})
+
+    def test_recreated_user_starts_with_an_empty_ring(self):
+        self.add_logs(2)
+        get_conversation_ring(self.user.user_id)
+        self.user.delete()
+        self.assertIsNone(cache.get(CONVERSATION_RING_KEY.format(user_id='ring_user')))
+
+        User.objects.create(user_id='ring_user')
+        self.assertEqual(get_recent_conversation('ring_user'), [])
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.handle_general_bot_stage', side_effect=Exception('AI error'))
+    def test_failed_task_drops_rolled_back_messages(self, mock_handle_stage, mock_send):
+        self.user.current_stage = 'GENERAL_BOT'
+        self.user.save()
+        get_conversation_ring(self.user.user_id)
+
+        process_messenger_message({'sender': {'id': self.user.user_id}, 'message': {'mid': 'mid.1', 'text': 'Hello'}})
+
+        self.assertFalse(ChatLog.objects.exists())
+        self.assertEqual(get_recent_conversation(self.user.user_id), [])
+
+    def test_rolled_back_logs_never_reach_the_ring(self):
+        get_conversation_ring(self.user.user_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    ChatLog.objects.create(user=self.user, sender_type='USER', message_content='Rolled back')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(get_recent_conversation(self.user.user_id), [])
+
+    def test_rebuild_racing_with_a_commit_is_dropped(self):
+        real_fetch = conversation_cache.fetch_recent_chat_logs
+
+        def fetch_then_commit_another_log(user_ids, limit):
+            recent_logs = real_fetch(user_ids, limit)
+            self.add_logs(1) # Committed after the rebuild read the table; no ring to update yet
+            return recent_logs
+
+        with patch('chat.conversation_cache.fetch_recent_chat_logs', side_effect=fetch_then_commit_another_log):
+            self.assertEqual(get_recent_conversation(self.user.user_id), [])
+        self.assertIsNone(cache.get(CONVERSATION_RING_KEY.format(user_id=self.user.user_id)))
+        self.assertEqual(get_recent_conversation(self.user.user_id), ['USER: Message 0'])
+
+    @patch.object(conversation_cache, 'RING_LOCK_SECONDS', 0.05)
+    def test_ring_is_dropped_when_another_writer_holds_it(self):
+        get_conversation_ring(self.user.user_id)
+        cache.set(CONVERSATION_RING_LOCK_KEY.format(user_id=self.user.user_id), 'other-writer', 60)
+        self.add_logs(1)
+
+        self.assertIsNone(cache.get(CONVERSATION_RING_KEY.format(user_id=self.user.user_id)))
+        self.assertEqual(get_recent_conversation(self.user.user_id), ['USER: Message 0'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConversationRingWithoutSharedCacheTest(TestCase):
+    def test_rings_are_not_cached_per_process(self):
+        user = User.objects.create(user_id='local_cache_user')
+        ChatLog.objects.create(user=user, sender_type='USER', message_content='Hi')
+
+        self.assertEqual(get_recent_conversation(user.user_id), ['USER: Hi'])
+        self.assertIsNone(cache.get(CONVERSATION_RING_KEY.format(user_id=user.user_id)))
+        # Another worker's log shows up on the next read
+        ChatLog.objects.create(user=user, sender_type='SYSTEM_AI', message_content='Hello')
+        self.assertEqual(get_recent_conversation(user.user_id), ['USER: Hi', 'SYSTEM_AI: Hello'])
@@ -0,0 +1,60 @@
+import requests
+from django.conf import settings
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+from chat.fake_graph_api import FakeGraphAPIServer
+from chat.messenger_api import send_messenger_message, send_sender_action, clear_reachability_cache
+from chat.models import User
+
+
+@patch.object(settings, 'FACEBOOK_PAGE_ACCESS_TOKEN', 'test_access_token')
+class FakeGraphAPIServerTest(TestCase):
+    def setUp(self):
+        clear_reachability_cache()
+        self.graph_api = FakeGraphAPIServer(unreachable_recipients=['gone_user']).start()
+        self.addCleanup(self.graph_api.stop)
+        override = override_settings(FACEBOOK_GRAPH_API_URL=self.graph_api.messages_url)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_records_messages_and_sender_actions_in_order(self):
+        send_sender_action('user_1', 'typing_on')
+        send_messenger_message('user_1', 'First')
+        send_messenger_message('user_2', 'Hello there')
+        send_messenger_message('user_1', 'Second')
+
+        self.assertEqual(self.graph_api.messages_for('user_1'), ['First', 'Second'])
+        report = self.graph_api.report()
+        self.assertEqual(report['messages'], 3)
+        # send_messenger_message turns typing off after each message
+        self.assertEqual(report['recipients']['user_1']['sequence'][:3], [
+            ('sender_action', 'typing_on'), ('message', 'First'), ('sender_action', 'typing_off'),
+        ])
+        self.assertEqual(report['recipients']['user_2']['messages'], ['Hello there'])
+
+    def test_unreachable_error_marks_user(self):
+        user = User.objects.create(user_id='gone_user')
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            send_messenger_message('gone_user', 'Anyone there?')
+
+        user.refresh_from_db()
+        self.assertFalse(user.is_messenger_reachable)
+        self.assertEqual(self.graph_api.report()['unreachable'], 1)
+
+    def test_throttling_error(self):
+        self.graph_api.throttle_rate = 1.0
+
+        with self.assertRaises(requests.exceptions.HTTPError) as ctx:
+            send_messenger_message('user_1', 'Too fast')
+
+        self.assertEqual(ctx.exception.response.json()['error']['code'], 613)
+        self.assertEqual(self.graph_api.report()['throttled'], 1)
+
+    def test_report_and_reset_endpoints(self):
+        send_messenger_message('user_1', 'Hi')
+
+        report = requests.get(f"{self.graph_api.base_url}/report").json()
+        self.assertEqual(report['recipients']['user_1']['messages'], ['Hi'])
+        requests.post(f"{self.graph_api.base_url}/reset")
+        self.assertEqual(self.graph_api.report()['messages'], 0)
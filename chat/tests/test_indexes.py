@@ -0,0 +1,53 @@
+import unittest
+from django.db import connection
+from django.db.models import Sum, Count
+from django.test import TestCase
+from chat.models import User, ChatLog, ExamResult, Question
+
+
+class QueryPlanTest(TestCase):
+    """
+    EXPLAIN-based checks that the hot per-user lookups are index range scans without
+    a sort step, on the databases we run (MySQL in production, SQLite in tests).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(user_id='plan_user')
+        other = User.objects.create(user_id='plan_other')
+        question = Question.objects.create(category='CIVIL_LAW', question_text='Q', expected_answer='A')
+        ChatLog.objects.bulk_create(
+            ChatLog(user=user, sender_type='USER', message_content=f"Message {i}") for i in range(50) for user in (cls.user, other)
+        )
+        ExamResult.objects.bulk_create(ExamResult(user=cls.user, question=question, score=80) for _ in range(8))
+
+    def setUp(self):
+        if connection.vendor not in ('mysql', 'sqlite'):
+            raise unittest.SkipTest(f"No plan expectations for {connection.vendor}")
+
+    def plan(self, queryset):
+        # MySQL's traditional format names the key in the `key` column and the sort in `Extra`
+        return queryset.explain()
+
+    def assertIndexScan(self, queryset, index_name):
+        plan = self.plan(queryset)
+        self.assertIn(index_name, plan, f"Expected {index_name} in plan:\n{plan}")
+        for sort_marker in ('USE TEMP B-TREE FOR ORDER BY', 'Using filesort'):
+            self.assertNotIn(sort_marker, plan, f"Plan sorts rows instead of reading them in index order:\n{plan}")
+
+    def test_latest_history_uses_user_timestamp_index(self):
+        self.assertIndexScan(ChatLog.objects.filter(user=self.user).order_by('-timestamp')[:5], 'chatlog_user_timestamp_idx')
+
+    def test_chronological_history_uses_user_timestamp_index(self):
+        self.assertIndexScan(ChatLog.objects.filter(user=self.user).order_by('timestamp'), 'chatlog_user_timestamp_idx')
+
+    def test_latest_by_id_reads_the_user_index_in_order(self):
+        # The user FK index ends with the primary key, so it is read in (user, id) order as-is
+        plan = self.plan(ChatLog.objects.filter(user=self.user).order_by('-id')[:5])
+        self.assertIn('user_id', plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+        self.assertNotIn('Using filesort', plan)
+
+    def test_category_aggregate_uses_user_question_index(self):
+        queryset = ExamResult.objects.filter(user=self.user).values('question__category').annotate(total=Sum('score'), count=Count('id'))
+        self.assertIn('examresult_user_question_idx', self.plan(queryset))
@@ -0,0 +1,41 @@
+import datetime
+from django.test import TestCase
+from django.utils import timezone
+from freezegun import freeze_time
+from chat.leases import acquire_lease, release_lease, renew_lease
+from chat.models import JobLease
+
+
+class JobLeaseTest(TestCase):
+    def test_only_one_holder_at_a_time(self):
+        run_id = acquire_lease('job', 60)
+        self.assertIsNotNone(run_id)
+        self.assertIsNone(acquire_lease('job', 60))
+        # Other jobs have their own lease
+        self.assertIsNotNone(acquire_lease('other-job', 60))
+
+    def test_expired_lease_can_be_taken_over(self):
+        with freeze_time('2025-01-01 12:00:00'):
+            first_run_id = acquire_lease('job', 60)
+        with freeze_time('2025-01-01 12:01:01'):
+            second_run_id = acquire_lease('job', 60)
+        self.assertIsNotNone(second_run_id)
+        self.assertNotEqual(first_run_id, second_run_id)
+        # The previous holder can no longer renew or release it
+        self.assertFalse(renew_lease('job', first_run_id, 60))
+        release_lease('job', first_run_id)
+        self.assertEqual(JobLease.objects.get(name='job').run_id, second_run_id)
+
+    def test_release_frees_the_lease(self):
+        run_id = acquire_lease('job', 60)
+        release_lease('job', run_id)
+        self.assertIsNotNone(acquire_lease('job', 60))
+
+    def test_renew_extends_expiry(self):
+        with freeze_time('2025-01-01 12:00:00'):
+            run_id = acquire_lease('job', 60)
+        with freeze_time('2025-01-01 12:00:50'):
+            self.assertTrue(renew_lease('job', run_id, 60))
+        with freeze_time('2025-01-01 12:01:30'):
+            self.assertIsNone(acquire_lease('job', 60))
+        self.assertEqual(JobLease.objects.get(name='job').expires_at, timezone.make_aware(datetime.datetime(2025, 1, 1, 12, 1, 50)))
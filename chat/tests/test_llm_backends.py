@@ -0,0 +1,58 @@
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from chat.ai_integration import AIIntegration
+from chat.llm_backends import SimulatedLLMBackend, get_llm_backend, OpenAIBackend
+from chat.models import User
+from chat.stages.mock_exam import format_exam_feedback
+
+NO_DELAY = {'latency_ms': {'distribution': 'fixed', 'median': 0, 'min': 0}, 'tokens_per_second': 0}
+
+
+class SimulatedLLMBackendTest(TestCase):
+    def setUp(self):
+        self.request = {'model': 'gpt-5-mini', 'messages': [{'role': 'user', 'content': 'Hello'}]}
+
+    def test_replies_are_deterministic(self):
+        first = SimulatedLLMBackend(NO_DELAY).create_completion(**self.request)
+        second = SimulatedLLMBackend(NO_DELAY).create_completion(**self.request)
+        other = SimulatedLLMBackend(NO_DELAY).create_completion(model='gpt-5-mini', messages=[{'role': 'user', 'content': 'Bye'}])
+        self.assertEqual(first.choices[0].message.content, second.choices[0].message.content)
+        self.assertNotEqual(first.choices[0].message.content, other.choices[0].message.content)
+        self.assertEqual(first.usage.total_tokens, first.usage.prompt_tokens + first.usage.completion_tokens)
+
+    @patch('chat.llm_backends.time.sleep')
+    def test_latency_and_generation_time(self, mock_sleep):
+        backend = SimulatedLLMBackend({'latency_ms': {'distribution': 'fixed', 'median': 500}, 'tokens_per_second': 50})
+        response = backend.create_completion(**self.request)
+
+        first_token_delay, generation_time = [c.args[0] for c in mock_sleep.call_args_list]
+        self.assertEqual(first_token_delay, 0.5)
+        self.assertAlmostEqual(generation_time, response.usage.completion_tokens / 50)
+
+    @patch('chat.llm_backends.time.sleep')
+    def test_uniform_latency_stays_in_bounds(self, mock_sleep):
+        backend = SimulatedLLMBackend({'seed': 7, 'latency_ms': {'distribution': 'uniform', 'min': 100, 'max': 200}, 'tokens_per_second': 0})
+        for _ in range(20):
+            backend.create_completion(**self.request)
+        delays = [c.args[0] for c in mock_sleep.call_args_list]
+        self.assertTrue(all(0.1 <= delay <= 0.2 for delay in delays))
+
+    def test_grading_json_is_usable_by_the_exam_flow(self):
+        with override_settings(LLM_BACKEND='chat.llm_backends.SimulatedLLMBackend', LLM_SIMULATION=NO_DELAY):
+            feedback = AIIntegration().grade_exam_answer('user', 'What is estoppel?', 'An answer.', 'Expected answer.')
+
+        self.assertTrue(60 <= feedback['score'] <= 95)
+        message, exam_result_fields = format_exam_feedback(feedback)
+        self.assertIn('Legal Basis', message)
+        self.assertEqual(exam_result_fields['score'], feedback['score'])
+
+    def test_injected_errors_go_through_openai_error_handling(self):
+        User.objects.create(user_id='sim_user', current_stage='MARKETING')
+        with override_settings(LLM_BACKEND='chat.llm_backends.SimulatedLLMBackend', LLM_SIMULATION={**NO_DELAY, 'error_rate': 1.0}):
+            feedback = AIIntegration().grade_exam_answer('sim_user', 'Question', 'Answer', 'Expected')
+        self.assertIn('error', feedback)
+
+    def test_backend_is_selected_by_settings(self):
+        self.assertIsInstance(get_llm_backend(), OpenAIBackend)
+        with override_settings(LLM_BACKEND='chat.llm_backends.SimulatedLLMBackend'):
+            self.assertIsInstance(get_llm_backend(), SimulatedLLMBackend)
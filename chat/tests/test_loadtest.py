@@ -0,0 +1,62 @@
+import random
+from unittest.mock import patch, MagicMock
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from chat.loadtest import build_user_script, arrival_offsets, run_load_test, cleanup_load_test_users, MARKETING_REPLIES
+from chat.models import User, DailyQuotaCounter
+
+
+class LoadTestTest(SimpleTestCase):
+    def test_user_script_follows_the_stages(self):
+        script = build_user_script(random.Random(1), general_messages=2)
+        self.assertEqual(len(script), 3 + 8 + 2)
+        self.assertIn(script[2], MARKETING_REPLIES)
+
+    def test_arrival_offsets_come_in_bursts(self):
+        offsets = arrival_offsets(7, arrival_rate=2.0, burst_size=3, rng=random.Random(1))
+        self.assertEqual(len(offsets), 7)
+        self.assertEqual(len(set(offsets[:3])), 1)
+        self.assertEqual(len(set(offsets[3:6])), 1)
+        self.assertLess(offsets[0], offsets[3])
+        self.assertEqual(arrival_offsets(4, arrival_rate=0, burst_size=1, rng=random.Random(1)), [0.0] * 4)
+
+    @patch('chat.loadtest.requests.post')
+    def test_each_user_posts_their_script_in_order(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200)
+
+        summary = run_load_test('http://testserver/chat/webhook/', users=3, arrival_rate=0, think_time=0, general_messages=1, seed=7)
+
+        self.assertEqual(summary['requests'], 3 * 12)
+        self.assertEqual(summary['completed_users'], 3)
+        self.assertEqual(summary['errors'], [])
+        sequences = {}
+        for call in mock_post.call_args_list:
+            event = call.kwargs['json']['entry'][0]['messaging'][0]
+            sequences.setdefault(event['sender']['id'], []).append(event['message']['mid'])
+        self.assertEqual(len(sequences), 3)
+        for sender_id, mids in sequences.items():
+            self.assertEqual(mids, [f"m_loadtest_{sender_id}_{i}" for i in range(12)])
+
+    @patch('chat.loadtest.requests.post')
+    def test_user_stops_on_webhook_error(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=500)
+
+        summary = run_load_test('http://testserver/chat/webhook/', users=2, arrival_rate=0, think_time=0, seed=7)
+
+        self.assertEqual(summary['requests'], 2)
+        self.assertEqual(summary['completed_users'], 0)
+        self.assertEqual(len(summary['errors']), 2)
+
+
+class LoadTestCleanupTest(TestCase):
+    def test_cleanup_removes_simulated_users_and_their_quota(self):
+        today = timezone.now().date()
+        for user_id in ('loadtest-1-0', 'loadtest-1-1', 'real_user'):
+            User.objects.create(user_id=user_id)
+            DailyQuotaCounter.objects.create(name='gpt-5.2', scope=f"user:{user_id}", day=today, count=2)
+        DailyQuotaCounter.objects.create(name='gpt-5.2', scope='global', day=today, count=6)
+
+        self.assertEqual(cleanup_load_test_users(), 2)
+
+        self.assertEqual(list(User.objects.values_list('user_id', flat=True)), ['real_user'])
+        self.assertEqual(dict(DailyQuotaCounter.objects.values_list('scope', 'count')), {'user:real_user': 2, 'global': 2})
@@ -4,8 +4,12 @@ import unittest
 from unittest.mock import patch, MagicMock
 from django.conf import settings
 from django.test import TestCase # Import Django's TestCase
-from chat.messenger_api import send_messenger_message, send_sender_action, GRAPH_API_URL
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from chat import messenger_api
+from chat.messenger_api import send_messenger_message, send_sender_action, GRAPH_API_URL, clear_reachability_cache
 from chat.models import User # Import the User model
+from chat.request_context import user_context
 
 class MessengerApiTests(TestCase): # Inherit from django.test.TestCase
 
@@ -15,6 +19,7 @@ class MessengerApiTests(TestCase): # Inherit from django.test.TestCase
         self.original_facebook_app_id = getattr(settings, 'FACEBOOK_APP_ID', None)
         settings.FACEBOOK_PAGE_ACCESS_TOKEN = 'test_access_token'
         settings.FACEBOOK_APP_ID = 'test_app_id'
+        clear_reachability_cache()
         
         # Create a test user for database-related tests
         self.user_id = 'test_recipient_id'
@@ -190,3 +195,60 @@ class MessengerApiTests(TestCase): # Inherit from django.test.TestCase
         result = send_sender_action(recipient_id, action)
         self.assertFalse(result)
         mock_post.assert_not_called() # API call should be skipped
+
+    @patch('requests.post')
+    def test_context_user_avoids_user_queries(self, mock_post):
+        """
+        Test that no User query is made when the recipient is the User loaded for the current request.
+        """
+        mock_post.return_value.json.return_value = {"recipient_id": self.user_id, "message_id": "mid.123"}
+
+        with user_context(self.user), CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(send_messenger_message(self.user_id, "Hello"))
+            self.assertTrue(send_sender_action(self.user_id, 'typing_on'))
+
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    @patch('requests.post')
+    def test_reachability_is_cached_between_sends(self, mock_post):
+        """
+        Test that reachability is read from the database once and then served from the cache.
+        """
+        mock_post.return_value.json.return_value = {"recipient_id": self.user_id, "message_id": "mid.123"}
+
+        with CaptureQueriesContext(connection) as ctx:
+            send_messenger_message(self.user_id, "First")
+            send_messenger_message(self.user_id, "Second")
+
+        user_selects = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and '"chat_user"' in q['sql']]
+        self.assertEqual(len(user_selects), 1)
+
+    @patch.object(settings, 'MESSENGER_REACHABILITY_CACHE_SIZE', 2, create=True)
+    @patch('requests.post')
+    def test_reachability_cache_evicts_least_recently_used(self, mock_post):
+        """
+        Test that the reachability cache holds at most MESSENGER_REACHABILITY_CACHE_SIZE recipients.
+        """
+        mock_post.return_value.json.return_value = {"recipient_id": self.user_id, "message_id": "mid.123"}
+
+        for recipient_id in ('recipient_1', 'recipient_2', 'recipient_1', 'recipient_3'):
+            send_messenger_message(recipient_id, "Hello")
+
+        self.assertEqual(list(messenger_api._reachability_cache), ['recipient_1', 'recipient_3'])
+
+    @patch('requests.post')
+    def test_unreachable_context_user_is_updated(self, mock_post):
+        """
+        Test that marking a recipient unreachable also updates the User loaded for the current request.
+        """
+        mock_response = MagicMock()
+        mock_response.text = json.dumps({"error": {"message": "(#100) No matching user found", "code": 100, "error_subcode": 2018001}})
+        mock_post.return_value.raise_for_status.side_effect = requests.exceptions.HTTPError(response=mock_response)
+
+        with user_context(self.user):
+            send_sender_action(self.user_id, 'typing_on')
+            self.assertFalse(self.user.is_messenger_reachable)
+            self.assertFalse(send_messenger_message(self.user_id, "Should not be sent"))
+
+        mock_post.assert_called_once()
+        self.assertFalse(User.objects.get(user_id=self.user_id).is_messenger_reachable)
@@ -1,7 +1,13 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
 from unittest.mock import patch
-from chat.models import User, Question, ChatLog
-from chat.tasks import process_messenger_message
+from datetime import timedelta
+import requests
+from chat.leases import acquire_lease, release_lease
+from chat.models import User, Question, ChatLog, ExamSubmission, ExamResult, JobLease, UserCategoryScore
+from chat.tasks import (
+    process_messenger_message, grade_exam_submission, deliver_exam_feedback, recover_exam_feedback, EXAM_FEEDBACK_LEASE_NAME,
+)
 from django.conf import settings
 from django.utils import timezone # Import timezone utilities
 import threading
@@ -203,4 +209,220 @@ class MockExamStageTest(TestCase):
 
         self.user.refresh_from_db()
         self.assertEqual(self.user.current_stage, 'GENERAL_BOT') # Should transition out
-        self.assertEqual(self.user.exam_question_counter, 0)
\ No newline at end of file
+        self.assertEqual(self.user.exam_question_counter, 0)
+
+@override_settings(MOCK_EXAM_PIPELINED_GRADING=True)
+class PipelinedMockExamTest(TestCase):
+    def setUp(self):
+        self.user_id = 'pipelined_exam_user_psid'
+        self.user = User.objects.create(
+            user_id=self.user_id,
+            first_name='FastTaker',
+            current_stage='MOCK_EXAM',
+            exam_question_counter=1
+        )
+        self.q1 = Question.objects.create(category='Criminal Law', question_text='Question 1 text?', expected_answer='Answer 1')
+        self.q2 = Question.objects.create(category='Civil Law', question_text='Question 2 text?', expected_answer='Answer 2')
+        self.q3 = Question.objects.create(category='Labor Law', question_text='Question 3 text?', expected_answer='Answer 3')
+        self.user.last_question_id_asked = self.q1
+        self.user.save()
+
+    def _answer(self, text):
+        return {
+            'sender': {'id': self.user_id},
+            'recipient': {'id': 'PAGE_ID'},
+            'message': {'mid': f'm_{text}', 'text': text},
+            'timestamp': int(timezone.now().timestamp() * 1000)
+        }
+
+    def _grading(self, score):
+        return {
+            'legal_writing_feedback': 'Fine.',
+            'legal_basis_feedback': 'Fine.',
+            'application_feedback': 'Fine.',
+            'conclusion_feedback': 'Fine.',
+            'score': score
+        }
+
+    @patch('chat.stages.mock_exam.enqueue_task')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.stages.mock_exam.get_random_exam_question')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_next_question_sent_without_waiting_for_grader(self, mock_grade, mock_get_question, mock_send, mock_enqueue):
+        mock_get_question.return_value = self.q2
+
+        with self.captureOnCommitCallbacks(execute=True):
+            process_messenger_message(self._answer('My answer for Q1'))
+
+        mock_grade.assert_not_called()
+        self.assertEqual([c.args[1] for c in mock_send.call_args_list], [
+            "Got your answer! ✅ I'll send your feedback as soon as it's graded.",
+            f'Next question (2/8):\n\n{self.q2.question_text}',
+        ])
+
+        submission = ExamSubmission.objects.get(user=self.user)
+        self.assertEqual(submission.status, 'PENDING')
+        self.assertEqual(submission.question, self.q1)
+        self.assertEqual(submission.question_number, 1)
+        mock_enqueue.assert_called_once_with(grade_exam_submission, submission.id)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.exam_question_counter, 2)
+        self.assertEqual(self.user.last_question_id_asked, self.q2)
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_feedback_delivered_in_question_order(self, mock_grade, mock_send):
+        first = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=1, answer_text='A1')
+        second = ExamSubmission.objects.create(user=self.user, question=self.q2, question_number=2, answer_text='A2')
+
+        # The second answer finishes grading first: nothing may be delivered yet.
+        mock_grade.return_value = self._grading(70)
+        grade_exam_submission(second.id)
+        mock_send.assert_not_called()
+        self.assertFalse(ExamResult.objects.exists())
+
+        mock_grade.return_value = self._grading(90)
+        grade_exam_submission(first.id)
+
+        sent = [c.args[1] for c in mock_send.call_args_list]
+        self.assertEqual(len(sent), 2)
+        self.assertIn('Your score: 90/100', sent[0])
+        self.assertIn('Your score: 70/100', sent[1])
+        self.assertEqual(
+            list(ExamResult.objects.order_by('id').values_list('question_id', 'score')),
+            [(self.q1.id, 90), (self.q2.id, 70)]
+        )
+        self.assertFalse(ExamSubmission.objects.exclude(status='DELIVERED').exists())
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_strength_assessment', return_value='You excel in Criminal Law.')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_final_submission_followed_by_assessment(self, mock_grade, mock_assessment, mock_send):
+        final = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=8, answer_text='A8', is_final=True)
+        mock_grade.return_value = self._grading(88)
+
+        grade_exam_submission(final.id)
+
+        sent = [c.args[1] for c in mock_send.call_args_list]
+        self.assertIn('Your score: 88/100', sent[0])
+        self.assertEqual(sent[1], 'You excel in Criminal Law.')
+        self.assertIn('Congratulations on completing the mock exam, FastTaker!', sent[2])
+        mock_assessment.assert_called_once()
+        self.assertTrue(ChatLog.objects.filter(user=self.user, sender_type='SYSTEM_AI', message_content='You excel in Criminal Law.').exists())
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_strength_assessment')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_sends_and_assessment_run_outside_any_transaction(self, mock_grade, mock_assessment, mock_send):
+        final = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=8, answer_text='A8', is_final=True)
+        mock_grade.return_value = self._grading(88)
+        outer_depth = len(connection.atomic_blocks)
+        depths = []
+        mock_send.side_effect = lambda *args, **kwargs: depths.append(len(connection.atomic_blocks)) or True
+        mock_assessment.side_effect = lambda user: depths.append(len(connection.atomic_blocks)) or 'Assessment'
+
+        grade_exam_submission(final.id)
+
+        self.assertTrue(depths)
+        self.assertTrue(all(depth == outer_depth for depth in depths)) # Not inside deliver_exam_feedback's transactions
+        self.assertEqual(ExamSubmission.objects.get(pk=final.pk).status, 'DELIVERED')
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_failed_send_leaves_feedback_to_retry(self, mock_grade, mock_send):
+        submission = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=1, answer_text='A1')
+        mock_grade.return_value = self._grading(90)
+        mock_send.side_effect = requests.exceptions.HTTPError('Graph API error')
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            grade_exam_submission(submission.id)
+        self.assertEqual(ExamSubmission.objects.get(pk=submission.pk).status, 'GRADED')
+        self.assertFalse(ExamResult.objects.exists())
+        self.assertFalse(JobLease.objects.exists()) # The delivery lease is given back
+
+        mock_send.side_effect = None
+        deliver_exam_feedback(self.user_id)
+        self.assertEqual(ExamSubmission.objects.get(pk=submission.pk).status, 'DELIVERED')
+        self.assertEqual(ExamResult.objects.count(), 1)
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_only_the_lease_holder_delivers(self, mock_grade, mock_send):
+        submission = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=1, answer_text='A1')
+        mock_grade.return_value = self._grading(90)
+        holder = acquire_lease(EXAM_FEEDBACK_LEASE_NAME.format(user_id=self.user_id), 60) # Another task is delivering
+
+        grade_exam_submission(submission.id)
+        mock_send.assert_not_called()
+        self.assertEqual(ExamSubmission.objects.get(pk=submission.pk).status, 'GRADED')
+
+        # Delivered by the next run once the holder lets go
+        release_lease(EXAM_FEEDBACK_LEASE_NAME.format(user_id=self.user_id), holder, forget=True)
+        deliver_exam_feedback(self.user_id)
+        self.assertEqual(ExamSubmission.objects.get(pk=submission.pk).status, 'DELIVERED')
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_strength_assessment')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_failed_assessment_send_does_not_resend_feedback(self, mock_grade, mock_assessment, mock_send):
+        final = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=8, answer_text='A8', is_final=True)
+        mock_grade.return_value = self._grading(88)
+        # The assessment sees the final answer's score
+        mock_assessment.side_effect = lambda user: f"Scored {UserCategoryScore.objects.get(user=user).total_score}"
+        mock_send.side_effect = [True, requests.exceptions.HTTPError('Graph API error')]
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            grade_exam_submission(final.id)
+        self.assertEqual(ExamSubmission.objects.get(pk=final.pk).status, 'FEEDBACK_SENT')
+
+        mock_send.side_effect = None
+        mock_send.reset_mock()
+        deliver_exam_feedback(self.user_id)
+
+        sent = [c.args[1] for c in mock_send.call_args_list]
+        self.assertEqual(sent[0], 'Scored 88')
+        self.assertFalse(any('Your score' in message for message in sent))
+        self.assertEqual(ExamResult.objects.count(), 1)
+        self.assertEqual(ExamSubmission.objects.get(pk=final.pk).status, 'DELIVERED')
+
+    @patch('chat.tasks.enqueue_task')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.grade_exam_answer')
+    def test_stuck_grading_is_requeued_once(self, mock_grade, mock_send, mock_enqueue):
+        stuck = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=1, answer_text='A1')
+        second = ExamSubmission.objects.create(user=self.user, question=self.q2, question_number=2, answer_text='A2')
+        ExamSubmission.objects.filter(pk=stuck.pk).update(grading_started_at=timezone.now() - timedelta(minutes=10))
+        mock_grade.return_value = self._grading(70)
+
+        grade_exam_submission(second.id)
+        mock_send.assert_not_called()
+        mock_enqueue.assert_called_once_with(grade_exam_submission, stuck.id)
+
+        # Claimed for another timeout, so the cron sweep leaves it alone
+        recover_exam_feedback()
+        mock_enqueue.assert_called_once()
+
+    @patch('chat.tasks.enqueue_task')
+    def test_cron_restarts_stuck_delivery(self, mock_enqueue):
+        submission = ExamSubmission.objects.create(user=self.user, question=self.q1, question_number=1, answer_text='A1', status='GRADED')
+        ExamSubmission.objects.filter(pk=submission.pk).update(grading_started_at=timezone.now() - timedelta(minutes=10))
+
+        recover_exam_feedback()
+
+        mock_enqueue.assert_called_once_with(deliver_exam_feedback, self.user_id)
+
+    @patch('chat.stages.mock_exam.enqueue_task')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_strength_assessment')
+    def test_last_answer_finishes_exam_immediately(self, mock_assessment, mock_send, mock_enqueue):
+        self.user.exam_question_counter = 8
+        self.user.save()
+
+        process_messenger_message(self._answer('My final answer'))
+
+        mock_assessment.assert_not_called()
+        self.assertTrue(ExamSubmission.objects.get(user=self.user).is_final)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.current_stage, 'GENERAL_BOT')
+        self.assertEqual(self.user.exam_question_counter, 0)
@@ -1,11 +1,13 @@
 from django.test import TestCase
+from django.conf import settings
+from io import StringIO
 from unittest.mock import patch, MagicMock
 from chat.models import Question, Prompt, User
 from legal.models import Course # Import Course model for testing
 from django.core.cache import cache
 from django.db.utils import IntegrityError
 from django.db import transaction # Import transaction
-from chat.utils import get_prompt
+from chat.utils import get_prompt, invalidate_prompt_snapshot, PROMPT_SNAPSHOT_VERSION_KEY
 import chat.prompts # Global import for chat.prompts
 
 
@@ -91,6 +93,8 @@ class PromptRetrievalTest(TestCase):
         cache.clear()
         # Ensure no prompts exist in DB initially
         Prompt.objects.all().delete()
+        # Rows from earlier tests are rolled back without signals, so drop the local snapshot
+        invalidate_prompt_snapshot()
 
         self.test_prompt_name = "TEST_SYSTEM_PROMPT"
         self.test_prompt_category = "TEST_CATEGORY"
@@ -106,6 +110,7 @@ class PromptRetrievalTest(TestCase):
             delattr(chat.prompts, self.test_prompt_name)
         cache.clear()
         Prompt.objects.all().delete()
+        invalidate_prompt_snapshot()
 
 
     def test_get_prompt_from_database(self):
@@ -120,19 +125,66 @@ class PromptRetrievalTest(TestCase):
         retrieved_content = get_prompt(name=self.test_prompt_name, category=self.test_prompt_category)
         self.assertEqual(retrieved_content, self.test_prompt_content_db)
 
-        # Ensure it's now in cache
-        self.assertEqual(cache.get(f"prompt:{self.test_prompt_category}:{self.test_prompt_name}"), self.test_prompt_content_db)
+        # Subsequent lookups are served from the in-process snapshot
+        with self.assertNumQueries(0):
+            self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), self.test_prompt_content_db)
 
-    def test_get_prompt_from_cache(self):
-        # Put prompt directly into cache
-        cache.set(f"prompt:{self.test_prompt_category}:{self.test_prompt_name}", self.test_prompt_content_db)
+    def test_snapshot_loads_all_prompts_in_one_query(self):
+        Prompt.objects.create(name='SNAPSHOT_A', category=self.test_prompt_category, text_content='A')
+        Prompt.objects.create(name='SNAPSHOT_B', category=self.test_prompt_category, text_content='B')
+        invalidate_prompt_snapshot()
 
-        # Ensure DB is empty (should not be hit)
-        Prompt.objects.all().delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_prompt(name='SNAPSHOT_A', category=self.test_prompt_category), 'A')
+            self.assertEqual(get_prompt(name='SNAPSHOT_B', category=self.test_prompt_category), 'B')
 
-        # Retrieve the prompt
-        retrieved_content = get_prompt(name=self.test_prompt_name, category=self.test_prompt_category)
-        self.assertEqual(retrieved_content, self.test_prompt_content_db)
+    def test_saving_prompt_reloads_snapshot(self):
+        prompt = Prompt.objects.create(
+            name=self.test_prompt_name,
+            category=self.test_prompt_category,
+            text_content=self.test_prompt_content_db
+        )
+        self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), self.test_prompt_content_db)
+
+        prompt.text_content = "Edited in the admin."
+        prompt.save()
+        self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), "Edited in the admin.")
+
+        prompt.delete()
+        self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), self.test_prompt_content_code)
+
+    @patch.object(settings, 'PROMPT_SNAPSHOT_CHECK_INTERVAL', 0)
+    def test_shared_version_bump_from_another_process_reloads_snapshot(self):
+        Prompt.objects.create(
+            name=self.test_prompt_name,
+            category=self.test_prompt_category,
+            text_content=self.test_prompt_content_db
+        )
+        get_prompt(name=self.test_prompt_name, category=self.test_prompt_category)
+
+        # Simulate another process editing the prompt: the row changes and the shared version moves
+        Prompt.objects.filter(name=self.test_prompt_name).update(text_content="Edited elsewhere.")
+        self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), self.test_prompt_content_db)
+        cache.set(PROMPT_SNAPSHOT_VERSION_KEY, 'bumped-by-another-process')
+
+        self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), "Edited elsewhere.")
+
+    @patch.object(settings, 'PROMPT_SNAPSHOT_MAX_AGE', 60, create=True)
+    def test_snapshot_is_reloaded_after_max_age(self):
+        Prompt.objects.create(
+            name=self.test_prompt_name,
+            category=self.test_prompt_category,
+            text_content=self.test_prompt_content_db
+        )
+        with patch('chat.utils.time.monotonic', return_value=1000.0):
+            get_prompt(name=self.test_prompt_name, category=self.test_prompt_category)
+
+        # Edited by another process whose version bump this process can't see (e.g., a per-process cache)
+        Prompt.objects.filter(name=self.test_prompt_name).update(text_content="Edited elsewhere.")
+        with patch('chat.utils.time.monotonic', return_value=1059.0):
+            self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), self.test_prompt_content_db)
+        with patch('chat.utils.time.monotonic', return_value=1060.0):
+            self.assertEqual(get_prompt(name=self.test_prompt_name, category=self.test_prompt_category), "Edited elsewhere.")
 
     def test_get_prompt_from_code_fallback(self):
         # Ensure prompt is not in DB or cache
@@ -143,9 +195,6 @@ class PromptRetrievalTest(TestCase):
         retrieved_content = get_prompt(name=self.test_prompt_name, category=self.test_prompt_category)
         self.assertEqual(retrieved_content, self.test_prompt_content_code)
 
-        # Ensure it's now in cache after fallback
-        self.assertEqual(cache.get(f"prompt:{self.test_prompt_category}:{self.test_prompt_name}"), self.test_prompt_content_code)
-
     def test_get_prompt_not_found(self):
         # Ensure prompt is not in DB, cache, or code fallback
         Prompt.objects.all().delete()
@@ -218,39 +267,176 @@ class PromptRetrievalTest(TestCase):
         self.assertGreater(prompt.updated_at, old_updated_at)
 
 
-import datetime
-from django.utils import timezone
-
-class UserGPT52UsageTest(TestCase):
-    def test_user_has_gpt_5_2_usage_fields(self):
-        user = User.objects.create(user_id='test_user_gpt_fields')
-        self.assertTrue(hasattr(user, 'gpt_5_2_daily_count'))
-        self.assertTrue(hasattr(user, 'gpt_5_2_last_reset_date'))
-
-    def test_gpt_5_2_daily_count_default_value(self):
-        user = User.objects.create(user_id='test_user_gpt_count_default')
-        self.assertEqual(user.gpt_5_2_daily_count, 0)
-
-    def test_gpt_5_2_last_reset_date_default_value(self):
-        user = User.objects.create(user_id='test_user_gpt_date_default')
-        user.refresh_from_db() # Ensure we are getting the value as stored in DB
-        self.assertEqual(user.gpt_5_2_last_reset_date, timezone.now().date())
-
-    def test_set_and_get_gpt_5_2_usage_fields(self):
-        user = User.objects.create(user_id='test_user_gpt_set_get')
-        user.gpt_5_2_daily_count = 5
-        user.gpt_5_2_last_reset_date = datetime.date(2024, 1, 1)
-        user.save()
-
-        retrieved_user = User.objects.get(user_id='test_user_gpt_set_get')
-        self.assertEqual(retrieved_user.gpt_5_2_daily_count, 5)
-        self.assertEqual(retrieved_user.gpt_5_2_last_reset_date, datetime.date(2024, 1, 1))
-
-    def test_gpt_5_2_daily_count_can_exceed_limit_temporarily(self):
-        # This test ensures the field itself can store values beyond 10,
-        # the limit enforcement will be in business logic.
-        user = User.objects.create(user_id='test_user_gpt_exceed_limit')
-        user.gpt_5_2_daily_count = 15
-        user.save()
-        retrieved_user = User.objects.get(user_id='test_user_gpt_exceed_limit')
-        self.assertEqual(retrieved_user.gpt_5_2_daily_count, 15)
\ No newline at end of file
+from chat.models import ExamResult, UserCategoryScore
+from django.core.management import call_command
+
+class UserCategoryScoreTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_id='category_score_user')
+        self.q_crim1 = Question.objects.create(category='CRIMINAL_LAW', question_text='Crim Q1', expected_answer='A')
+        self.q_crim2 = Question.objects.create(category='CRIMINAL_LAW', question_text='Crim Q2', expected_answer='A')
+        self.q_civil = Question.objects.create(category='CIVIL_LAW', question_text='Civil Q1', expected_answer='A')
+
+    def _scores(self):
+        return {
+            row.category: (row.total_score, row.result_count)
+            for row in UserCategoryScore.objects.filter(user=self.user)
+        }
+
+    def test_creating_results_updates_aggregates(self):
+        ExamResult.objects.create(user=self.user, question=self.q_crim1, score=90)
+        ExamResult.objects.create(user=self.user, question=self.q_crim2, score=70)
+        ExamResult.objects.create(user=self.user, question=self.q_civil, score=60)
+
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (160, 2), 'CIVIL_LAW': (60, 1)})
+        self.assertEqual(UserCategoryScore.objects.get(user=self.user, category='CRIMINAL_LAW').average_score, 80)
+
+    def test_updating_and_deleting_results_keeps_aggregates_in_step(self):
+        result = ExamResult.objects.create(user=self.user, question=self.q_crim1, score=90)
+        ExamResult.objects.create(user=self.user, question=self.q_crim2, score=70)
+
+        result.score = 50
+        result.save()
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (120, 2)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result.delete()
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (70, 1)})
+
+    def test_moving_a_result_to_another_category_rebuilds_both(self):
+        result = ExamResult.objects.create(user=self.user, question=self.q_crim1, score=90)
+        ExamResult.objects.create(user=self.user, question=self.q_crim2, score=70)
+
+        result.question = self.q_civil
+        result.save()
+
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (70, 1), 'CIVIL_LAW': (90, 1)})
+
+    def test_cascading_delete_recomputes_each_user_once(self):
+        other_user = User.objects.create(user_id='category_score_other_user')
+        for user in (self.user, other_user):
+            ExamResult.objects.create(user=user, question=self.q_crim1, score=90)
+            ExamResult.objects.create(user=user, question=self.q_crim2, score=70)
+            ExamResult.objects.create(user=user, question=self.q_civil, score=60)
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.q_crim1.delete()
+
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (70, 1), 'CIVIL_LAW': (60, 1)})
+        # One aggregate for both users, and no per-row lookups of the deleted results' questions
+        self.assertEqual(len([query for query in queries if 'SUM(' in query['sql']]), 1)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "chat_usercategoryscore"')])
+        self.assertEqual(len(callbacks), 1)
+
+    def test_deletes_after_a_rolled_back_delete_still_recompute(self):
+        ExamResult.objects.create(user=self.user, question=self.q_crim1, score=90)
+        ExamResult.objects.create(user=self.user, question=self.q_civil, score=60)
+
+        try:
+            with transaction.atomic():
+                ExamResult.objects.filter(question=self.q_crim1).delete()
+                raise IntegrityError("rolled back")
+        except IntegrityError:
+            pass
+        with self.captureOnCommitCallbacks(execute=True):
+            ExamResult.objects.filter(question=self.q_civil).delete()
+
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (90, 1)})
+
+    def test_changing_a_question_category_moves_its_results(self):
+        ExamResult.objects.create(user=self.user, question=self.q_crim1, score=90)
+        ExamResult.objects.create(user=self.user, question=self.q_crim2, score=70)
+
+        self.q_crim1.category = 'CIVIL_LAW'
+        self.q_crim1.save()
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (70, 1), 'CIVIL_LAW': (90, 1)})
+
+        # Saving without a category change leaves the aggregates alone
+        with CaptureQueriesContext(connection) as queries:
+            self.q_crim1.save()
+        self.assertFalse([query for query in queries if 'chat_usercategoryscore' in query['sql']])
+
+    def test_deleting_user_cascades_without_recreating_aggregates(self):
+        ExamResult.objects.create(user=self.user, question=self.q_crim1, score=90)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(UserCategoryScore.objects.exists())
+
+    def test_backfill_command_rebuilds_from_exam_results(self):
+        ExamResult.objects.create(user=self.user, question=self.q_crim1, score=90)
+        ExamResult.objects.create(user=self.user, question=self.q_civil, score=40)
+        UserCategoryScore.objects.all().delete()
+
+        call_command('backfill_category_scores', stdout=StringIO())
+
+        self.assertEqual(self._scores(), {'CRIMINAL_LAW': (90, 1), 'CIVIL_LAW': (40, 1)})
+
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+class UserDirtyFieldsTest(TestCase):
+    def setUp(self):
+        User.objects.create(user_id='dirty_user', first_name='Dirty', summary='A long summary. ' * 50)
+        self.user = User.objects.get(user_id='dirty_user')
+
+    def _user_updates(self, ctx):
+        return [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "chat_user"')]
+
+    def test_save_writes_only_changed_columns(self):
+        self.user.current_stage = 'MARKETING'
+        with CaptureQueriesContext(connection) as ctx:
+            self.user.save()
+
+        updates = self._user_updates(ctx)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"current_stage"', updates[0])
+        self.assertNotIn('"summary"', updates[0])
+        self.assertEqual(User.objects.get(user_id='dirty_user').current_stage, 'MARKETING')
+
+    def test_save_without_changes_is_skipped(self):
+        with self.assertNumQueries(0):
+            self.user.save()
+
+    def test_get_dirty_fields(self):
+        self.assertEqual(self.user.get_dirty_fields(), [])
+        self.user.first_name = 'Changed'
+        self.user.exam_question_counter = 3
+        self.assertEqual(sorted(self.user.get_dirty_fields()), ['exam_question_counter', 'first_name'])
+        self.user.save()
+        self.assertEqual(self.user.get_dirty_fields(), [])
+
+    def test_coalesce_saves_issues_one_update(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with self.user.coalesce_saves():
+                self.user.current_stage = 'MOCK_EXAM'
+                self.user.save()
+                self.user.exam_question_counter = 1
+                self.user.save()
+                self.assertEqual(self._user_updates(ctx), [])
+
+        updates = self._user_updates(ctx)
+        self.assertEqual(len(updates), 1)
+        stored = User.objects.get(user_id='dirty_user')
+        self.assertEqual((stored.current_stage, stored.exam_question_counter), ('MOCK_EXAM', 1))
+
+    def test_coalesce_saves_writes_nothing_when_block_raises(self):
+        with self.assertRaises(RuntimeError):
+            with self.user.coalesce_saves():
+                self.user.first_name = 'Never stored'
+                self.user.save()
+                raise RuntimeError('boom')
+
+        self.assertEqual(User.objects.get(user_id='dirty_user').first_name, 'Dirty')
+
+    def test_stale_copy_does_not_overwrite_other_columns(self):
+        stale_copy = User.objects.get(user_id='dirty_user')
+        self.user.first_name = 'Fresh'
+        self.user.save()
+
+        stale_copy.is_messenger_reachable = False
+        stale_copy.save()
+
+        stored = User.objects.get(user_id='dirty_user')
+        self.assertEqual(stored.first_name, 'Fresh')
+        self.assertFalse(stored.is_messenger_reachable)
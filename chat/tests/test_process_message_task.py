@@ -3,6 +3,8 @@ import unittest
 from unittest.mock import patch, MagicMock
 from django.conf import settings
 from django.test import TestCase # Using Django's TestCase for database interaction
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from chat.tasks import process_messenger_message
 from chat.models import User, ChatLog
 
@@ -76,3 +78,38 @@ class ProcessMessengerMessageTaskTests(TestCase):
             f"Unhandled error in process_messenger_message task for sender {self.user_id}: Test error",
             exc_info=True
         )
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.handle_general_bot_stage')
+    def test_user_row_updated_once_per_message(self, mock_handle_stage, mock_send_messenger_message):
+        def handler(user, messaging_event):
+            user.exam_question_counter = -1
+            user.save()
+            user.summary = 'Updated by handler'
+            user.save()
+            return ['Bot response']
+        mock_handle_stage.side_effect = handler
+
+        with CaptureQueriesContext(connection) as ctx:
+            process_messenger_message(self.messaging_event_template.copy())
+
+        user_updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "chat_user"')]
+        self.assertEqual(len(user_updates), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.summary, 'Updated by handler')
+        self.assertIsNotNone(self.user.last_interaction_timestamp)
+
+    @patch('requests.post')
+    @patch('chat.tasks.handle_general_bot_stage', return_value=['First response', 'Second response', 'Third response'])
+    def test_user_loaded_once_per_message(self, mock_handle_stage, mock_post):
+        mock_post.return_value.json.return_value = {"recipient_id": self.user_id, "message_id": "mid.123"}
+
+        with CaptureQueriesContext(connection) as ctx:
+            process_messenger_message(self.messaging_event_template.copy())
+
+        # Sends and typing indicators reuse the locked User instead of looking it up again
+        # (the EXISTS probe deciding whether to reserve the gpt-5.2 quota loads no row)
+        user_selects = [q['sql'] for q in ctx.captured_queries
+                        if q['sql'].startswith('SELECT') and not q['sql'].startswith('SELECT 1 AS') and 'FROM "chat_user"' in q['sql']]
+        self.assertEqual(len(user_selects), 1)
+        self.assertEqual(ChatLog.objects.filter(user=self.user, sender_type='SYSTEM_AI').count(), 3)
@@ -0,0 +1,139 @@
+import importlib
+import string
+from types import SimpleNamespace
+from unittest.mock import patch
+from django.apps import apps
+from django.test import TestCase, override_settings
+from chat import prompts
+from chat.ai_integration import AIIntegration, _create_completion
+from chat.llm_backends import SimulatedLLMBackend
+from chat.llm_usage import get_llm_usage, record_llm_usage
+from chat.models import LLMUsage, Prompt, User
+from chat.prompt_layout import get_prompt_prefix, prompt_cache_key
+
+prompt_layout_migration = importlib.import_module('chat.migrations.0032_cache_friendly_prompt_layout')
+
+
+def completion(prompt_tokens=1200, cached_tokens=0, completion_tokens=40):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content='Reply'))],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+        ),
+    )
+
+
+class PromptLayoutTest(TestCase):
+    def test_user_templates_start_with_fixed_instructions(self):
+        for name in dir(prompts):
+            if '_USER_PROMPT' not in name or not name.endswith('_TEMPLATE'):
+                continue
+            leading_text = next(string.Formatter().parse(getattr(prompts, name)))[0]
+            self.assertGreaterEqual(len(leading_text.strip()), 40, f"{name} starts with per-call values")
+
+    def test_current_message_comes_last(self):
+        fields = [field for _, field, _, _ in string.Formatter().parse(prompts.GENERAL_BOT_USER_PROMPT_TEMPLATE) if field]
+        self.assertEqual(fields[-1], 'message_text')
+
+    @override_settings(LLM_PROMPT_PREFIXES={'GENERAL_BOT': ('CUSTOM_SYSTEM_PROMPT',)})
+    def test_prefixes_can_be_redeclared(self):
+        self.assertEqual(get_prompt_prefix('GENERAL_BOT'), ('CUSTOM_SYSTEM_PROMPT',))
+        self.assertEqual(get_prompt_prefix('SUMMARIZATION'), ('SUMMARIZE_SYSTEM_PROMPT',))
+        with self.assertRaises(ValueError):
+            get_prompt_prefix('UNKNOWN')
+
+    def test_cache_key_follows_call_type_and_stable_prefix(self):
+        messages = [{'role': 'system', 'content': 'Static'}, {'role': 'user', 'content': 'Hi Juan'}]
+        same_prefix = [{'role': 'system', 'content': 'Static'}, {'role': 'user', 'content': 'Hi Maria'}]
+        edited_prefix = [{'role': 'system', 'content': 'Static, edited'}, {'role': 'user', 'content': 'Hi Juan'}]
+
+        self.assertEqual(prompt_cache_key('GENERAL_BOT', messages), prompt_cache_key('GENERAL_BOT', same_prefix))
+        self.assertTrue(prompt_cache_key('GENERAL_BOT', messages).startswith('premier:general_bot:'))
+        self.assertNotEqual(prompt_cache_key('GENERAL_BOT', messages), prompt_cache_key('GENERAL_BOT', edited_prefix))
+        self.assertNotEqual(prompt_cache_key('GENERAL_BOT', messages), prompt_cache_key('RE_ENGAGEMENT', messages))
+
+    def test_migration_only_reorders_unedited_prompts(self):
+        (name, previous, new), (edited_name, edited_previous, _) = prompt_layout_migration.REORDERED_PROMPTS[:2]
+        Prompt.objects.filter(name__in=[name, edited_name]).delete()
+        Prompt.objects.create(name=name, category='QUICK_REPLY', text_content=previous)
+        Prompt.objects.create(name=edited_name, category='SUMMARIZATION', text_content='Edited in the admin: {conversation_chunk}')
+
+        prompt_layout_migration.reorder_prompts(apps, None)
+
+        self.assertEqual(Prompt.objects.get(name=name).text_content, new)
+        self.assertEqual(Prompt.objects.get(name=edited_name).text_content, 'Edited in the admin: {conversation_chunk}')
+
+    @patch('chat.ai_integration.openai.chat.completions.create', return_value=completion())
+    def test_messages_put_static_prompts_first(self, mock_create):
+        user = User.objects.create(user_id='layout_user', first_name='Juan', current_stage='MARKETING')
+        AIIntegration().generate_chat_response(
+            user_id=user.user_id,
+            system_prompt_name='GENERAL_BOT_SYSTEM_PROMPT',
+            user_prompt_name='GENERAL_BOT_USER_PROMPT_TEMPLATE',
+            prompt_category='GENERAL_BOT',
+            prompt_context={'user_first_name': 'Juan', 'user_summary': 'Likes torts', 'message_text': 'What is estafa?', 'conversation_history': []},
+        )
+        request = mock_create.call_args.kwargs
+        self.assertEqual(request['messages'][0], {'role': 'system', 'content': prompts.GENERAL_BOT_SYSTEM_PROMPT})
+        self.assertTrue(request['messages'][1]['content'].rstrip().endswith('"What is estafa?".'))
+        self.assertEqual(request['prompt_cache_key'], prompt_cache_key('GENERAL_BOT', request['messages']))
+
+
+class LLMUsageTest(TestCase):
+    messages = [{'role': 'system', 'content': 'Static'}, {'role': 'user', 'content': 'Hello'}]
+
+    @patch('chat.ai_integration.openai.chat.completions.create')
+    def test_records_usage_per_call_type(self, mock_create):
+        mock_create.side_effect = [completion(cached_tokens=0), completion(cached_tokens=1024), completion(prompt_tokens=300, cached_tokens=0)]
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_completion(call_type='GENERAL_BOT', model='gpt-5-mini', messages=self.messages)
+            _create_completion(call_type='GENERAL_BOT', model='gpt-5-mini', messages=self.messages)
+            _create_completion(call_type='SUMMARIZATION', model='gpt-5-mini', messages=self.messages)
+
+        usage = get_llm_usage()
+        self.assertEqual(usage['GENERAL_BOT']['calls'], 2)
+        self.assertEqual(usage['GENERAL_BOT']['prompt_tokens'], 2400)
+        self.assertEqual(usage['GENERAL_BOT']['cached_tokens'], 1024)
+        self.assertAlmostEqual(usage['GENERAL_BOT']['cache_hit_rate'], 1024 / 2400)
+        self.assertEqual(usage['SUMMARIZATION']['cached_tokens'], 0)
+        self.assertEqual(LLMUsage.objects.count(), 2)
+
+    @patch('chat.ai_integration.openai.chat.completions.create', return_value=completion())
+    def test_calls_without_call_type_are_not_recorded(self, mock_create):
+        _create_completion(model='gpt-5-mini', messages=self.messages)
+        self.assertNotIn('prompt_cache_key', mock_create.call_args.kwargs)
+        self.assertFalse(LLMUsage.objects.exists())
+
+    @override_settings(LLM_PROMPT_CACHE_KEYS=False)
+    @patch('chat.ai_integration.openai.chat.completions.create', return_value=completion())
+    def test_cache_key_can_be_turned_off(self, mock_create):
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_completion(call_type='GENERAL_BOT', model='gpt-5-mini', messages=self.messages)
+        self.assertNotIn('prompt_cache_key', mock_create.call_args.kwargs)
+        self.assertEqual(LLMUsage.objects.get().calls, 1)
+
+    def test_missing_usage_counts_as_zero(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_llm_usage('QUICK_REPLY', 'gpt-5-mini', 'not a response')
+        row = LLMUsage.objects.get()
+        self.assertEqual((row.calls, row.prompt_tokens, row.cached_tokens), (1, 0, 0))
+        self.assertEqual(row.cache_hit_rate, 0.0)
+
+    def test_usage_is_written_after_the_callers_transaction_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            record_llm_usage('QUICK_REPLY', 'gpt-5-mini', completion())
+            self.assertFalse(LLMUsage.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(LLMUsage.objects.get().calls, 1)
+
+    def test_simulated_backend_reports_cached_prefix(self):
+        backend = SimulatedLLMBackend({'latency_ms': {'distribution': 'fixed', 'median': 0, 'min': 0}, 'tokens_per_second': 0,
+                                       'prompt_cache': {'min_tokens': 0, 'increment': 1}})
+        static = {'role': 'system', 'content': 'Static instructions. ' * 50}
+        first = backend.create_completion(model='gpt-5-mini', messages=[static, {'role': 'user', 'content': 'Hi Juan'}])
+        second = backend.create_completion(model='gpt-5-mini', messages=[static, {'role': 'user', 'content': 'Hi Maria'}])
+
+        self.assertEqual(first.usage.prompt_tokens_details.cached_tokens, 0)
+        self.assertEqual(second.usage.prompt_tokens_details.cached_tokens, len(static['content']) // 4)
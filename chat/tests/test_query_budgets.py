@@ -0,0 +1,158 @@
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+from django.db import connection
+from django.db.models import Model
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from chat.conversation_cache import get_conversation_ring
+from chat.messenger_api import clear_reachability_cache
+from chat.models import User, ChatLog, Question, ExamResult, LLMUsage
+from chat.utils import get_prompt_snapshot
+from chat.stages.general_bot import handle_general_bot_stage
+from chat.stages.marketing import handle_marketing_stage
+from chat.stages.mock_exam import handle_mock_exam_stage
+from chat.stages.onboarding import handle_onboarding_stage
+from chat.tasks import process_messenger_message
+
+SIMULATED_LLM = {
+    'LLM_BACKEND': 'chat.llm_backends.SimulatedLLMBackend',
+    'LLM_SIMULATION': {'latency_ms': {'distribution': 'fixed', 'median': 0, 'min': 0}, 'tokens_per_second': 0},
+}
+
+
+@contextmanager
+def count_rows():
+    """Counts model instances loaded from the database, per model (values() querysets are not counted)."""
+    counts = Counter()
+    original = Model.from_db.__func__
+
+    def counting_from_db(cls, db, field_names, values):
+        counts[cls.__name__] += 1
+        return original(cls, db, field_names, values)
+
+    with patch.object(Model, 'from_db', classmethod(counting_from_db)):
+        yield counts
+
+
+@override_settings(FACEBOOK_PAGE_ACCESS_TOKEN='test_access_token', CONVERSATION_RING_ENABLED=True, **SIMULATED_LLM) # Rings as with a shared cache
+@patch('chat.messenger_api.requests.post', return_value=MagicMock(status_code=200, json=lambda: {'message_id': 'mid'}))
+class QueryBudgetTest(TestCase):
+    """
+    Query and row budgets for the per-message hot paths. A failing budget means a change
+    added queries or loaded more rows than before: fix the regression, or raise the
+    budget in the same change if the extra work is intended.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.questions = [
+            Question.objects.create(
+                category='CIVIL_LAW',
+                question_text=f"Question {i}: What are the requisites of a valid contract?",
+                expected_answer="Consent, object certain and cause (Article 1318).",
+            )
+            for i in range(20)
+        ]
+
+    def setUp(self):
+        clear_reachability_cache()
+        get_prompt_snapshot() # Loaded once per process (and per prompt edit), not per message
+        # Today's usage rows exist after the first call of the day, so recording a call is one UPDATE
+        LLMUsage.objects.bulk_create([
+            LLMUsage(day=timezone.now().date(), call_type=call_type, model=model)
+            for call_type, model in [
+                ('GENERAL_BOT', 'gpt-5.2'), ('GENERAL_BOT', 'gpt-5-mini'), ('SUMMARIZATION', 'gpt-5-mini'),
+                ('EXAM_GRADING', 'gpt-5.2'), ('ASSESSMENT', 'gpt-5.2'),
+            ]
+        ])
+
+    def make_user(self, user_id, history=0, **fields):
+        user = User.objects.create(user_id=user_id, first_name='Juan', academic_status='Law graduate', **fields)
+        ChatLog.objects.bulk_create([
+            ChatLog(user=user, sender_type='USER' if i % 2 else 'SYSTEM_AI', message_content=f"History message {i}",
+                    timestamp=timezone.now() - timedelta(minutes=history - i))
+            for i in range(history)
+        ])
+        get_conversation_ring(user_id) # Warm, as the write-through cache is in steady state
+        return user
+
+    def event(self, user_id, text):
+        return {'sender': {'id': user_id}, 'recipient': {'id': 'PAGE_ID'}, 'timestamp': 1458692752478,
+                'message': {'mid': f"mid.{user_id}", 'text': text}}
+
+    def assertWithinBudget(self, queries, rows, max_queries, max_rows):
+        """Fails with the captured SQL and per-model row counts when either budget is exceeded."""
+        problems = []
+        if len(queries) > max_queries:
+            problems.append(f"{len(queries)} queries (budget {max_queries}):")
+            problems.extend(f"  {i}. {query['sql']}" for i, query in enumerate(queries, start=1))
+        total_rows = sum(rows.values())
+        if total_rows > max_rows:
+            problems.append(f"{total_rows} rows loaded (budget {max_rows}):")
+            problems.extend(f"  {model}: {count}" for model, count in rows.most_common())
+        if problems:
+            self.fail("Query budget exceeded\n" + "\n".join(problems))
+
+    @contextmanager
+    def budget(self, max_queries, max_rows):
+        with count_rows() as rows, CaptureQueriesContext(connection) as queries:
+            yield
+        self.assertWithinBudget(queries.captured_queries, rows, max_queries, max_rows)
+
+    # Stage handlers (the user row is already loaded and locked by the task)
+
+    def test_onboarding_name_reply(self, mock_post):
+        user = User.objects.create(user_id='budget_onboarding', current_stage='ONBOARDING')
+        with self.budget(max_queries=2, max_rows=0):
+            handle_onboarding_stage(user, self.event(user.user_id, "Maria Santos"))
+
+    def test_marketing_starts_exam(self, mock_post):
+        user = self.make_user('budget_marketing', history=10, current_stage='MARKETING')
+        with self.budget(max_queries=1, max_rows=0):
+            handle_marketing_stage(user, self.event(user.user_id, "yes"))
+
+    def test_mock_exam_answer(self, mock_post):
+        user = self.make_user('budget_exam', history=10, current_stage='MOCK_EXAM', exam_question_counter=3,
+                              last_question_id_asked=self.questions[0])
+        user = User.objects.select_related('last_question_id_asked').get(pk=user.pk)
+        with self.budget(max_queries=11, max_rows=1):
+            handle_mock_exam_stage(user, self.event(user.user_id, "The contract is voidable under Article 1390."))
+
+    def test_mock_exam_last_answer(self, mock_post):
+        user = self.make_user('budget_exam_last', history=10, current_stage='MOCK_EXAM', exam_question_counter=8,
+                              last_question_id_asked=self.questions[0])
+        ExamResult.objects.bulk_create([
+            ExamResult(user=user, question=question, score=70, legal_writing_feedback="Good")
+            for question in self.questions[1:8]
+        ])
+        user = User.objects.select_related('last_question_id_asked').get(pk=user.pk)
+        with self.budget(max_queries=12, max_rows=1):
+            handle_mock_exam_stage(user, self.event(user.user_id, "The contract is voidable under Article 1390."))
+
+    def test_general_bot_with_long_history(self, mock_post):
+        user = self.make_user('budget_general', history=200, current_stage='GENERAL_BOT', exam_question_counter=-1)
+        with self.budget(max_queries=7, max_rows=1):
+            handle_general_bot_stage(user, self.event(user.user_id, "What is estafa?"))
+
+    # The whole task, including the quota probe, the user lock, ChatLog writes and Messenger sends
+
+    def test_task_new_user(self, mock_post):
+        with self.budget(max_queries=8, max_rows=3):
+            process_messenger_message(self.event('budget_task_new', "Hi"))
+
+    def test_task_mock_exam_answer(self, mock_post):
+        user = self.make_user('budget_task_exam', history=10, current_stage='MOCK_EXAM', exam_question_counter=3,
+                              last_question_id_asked=self.questions[0])
+        with self.budget(max_queries=17, max_rows=3):
+            process_messenger_message(self.event(user.user_id, "The contract is voidable under Article 1390."))
+
+    def test_task_general_bot_with_long_history(self, mock_post):
+        user = self.make_user('budget_task_general', history=200, current_stage='GENERAL_BOT', exam_question_counter=-1)
+        # 19 unsummarized messages: this exchange brings them to 21 and triggers summarization
+        user.summarized_through_log_id = ChatLog.objects.filter(user=user).order_by('-id').values_list('id', flat=True)[19]
+        user.save()
+        with self.budget(max_queries=13, max_rows=1):
+            process_messenger_message(self.event(user.user_id, "What is estafa?"))
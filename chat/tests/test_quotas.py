@@ -0,0 +1,123 @@
+import datetime
+from unittest.mock import patch
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from chat import quotas
+from chat.ai_integration import GENERAL_BOT_QUOTA
+from chat.models import DailyQuotaCounter, User
+from chat.quotas import consume_quota, get_quota_usage, purge_quota_counters, reserve_quota
+from chat.tasks import process_messenger_message
+
+
+@patch.object(settings, 'AI_MODEL_QUOTAS', {
+    'per-user-model': {'per_user': 2, 'global': None},
+    'global-model': {'per_user': None, 'global': 3},
+    'both-model': {'per_user': 2, 'global': 3},
+    'disabled-model': {'per_user': 0, 'global': None},
+})
+class ConsumeQuotaTest(TestCase):
+    def test_per_user_limit(self):
+        self.assertTrue(consume_quota('per-user-model', user_id='u1'))
+        self.assertTrue(consume_quota('per-user-model', user_id='u1'))
+        self.assertFalse(consume_quota('per-user-model', user_id='u1'))
+        # Other users have their own counters
+        self.assertTrue(consume_quota('per-user-model', user_id='u2'))
+        self.assertEqual(get_quota_usage('per-user-model', user_id='u1'), 2)
+        self.assertEqual(get_quota_usage('per-user-model', user_id='u2'), 1)
+
+    def test_global_limit_is_shared_by_all_users(self):
+        for user_id in ('u1', 'u2', 'u3'):
+            self.assertTrue(consume_quota('global-model', user_id=user_id))
+        self.assertFalse(consume_quota('global-model', user_id='u4'))
+        self.assertEqual(get_quota_usage('global-model'), 3)
+
+    def test_refused_per_user_unit_is_returned_to_global_pool(self):
+        self.assertTrue(consume_quota('both-model', user_id='u1'))
+        self.assertTrue(consume_quota('both-model', user_id='u1'))
+        self.assertFalse(consume_quota('both-model', user_id='u1'))
+        self.assertEqual(get_quota_usage('both-model'), 2)
+        self.assertTrue(consume_quota('both-model', user_id='u2'))
+
+    def test_zero_limit_grants_nothing(self):
+        self.assertFalse(consume_quota('disabled-model', user_id='u1'))
+        self.assertFalse(DailyQuotaCounter.objects.exists())
+
+    def test_unconfigured_quota_is_unlimited(self):
+        for _ in range(5):
+            self.assertTrue(consume_quota('unknown-model', user_id='u1'))
+        self.assertFalse(DailyQuotaCounter.objects.exists())
+
+    def test_counters_are_bucketed_by_day(self):
+        yesterday = timezone.now().date() - datetime.timedelta(days=1)
+        DailyQuotaCounter.objects.create(name='per-user-model', scope='user:u1', day=yesterday, count=2)
+
+        self.assertTrue(consume_quota('per-user-model', user_id='u1'))
+        self.assertEqual(get_quota_usage('per-user-model', user_id='u1'), 1)
+        self.assertEqual(get_quota_usage('per-user-model', user_id='u1', day=yesterday), 2)
+
+    def test_steady_state_consumption_is_a_single_update(self):
+        consume_quota('per-user-model', user_id='u1')
+        with self.assertNumQueries(1):
+            self.assertTrue(consume_quota('per-user-model', user_id='u1'))
+
+    def test_purge_old_counters(self):
+        old_day = timezone.now().date() - datetime.timedelta(days=40)
+        DailyQuotaCounter.objects.create(name='per-user-model', scope='user:u1', day=old_day, count=1)
+        consume_quota('per-user-model', user_id='u1')
+
+        self.assertEqual(purge_quota_counters(keep_days=30), 1)
+        self.assertEqual(DailyQuotaCounter.objects.count(), 1)
+
+
+@patch.object(settings, 'AI_MODEL_QUOTAS', {
+    'both-model': {'per_user': 1, 'global': 3},
+    GENERAL_BOT_QUOTA: {'per_user': 5, 'global': 10},
+})
+class ReserveQuotaTest(TestCase):
+    def test_reserved_unit_is_consumed_without_queries(self):
+        with reserve_quota('both-model', user_id='u1') as granted:
+            self.assertTrue(granted)
+            with self.assertNumQueries(0):
+                self.assertTrue(consume_quota('both-model', user_id='u1'))
+            # Only the first call is served by the reservation
+            self.assertFalse(consume_quota('both-model', user_id='u1'))
+        self.assertEqual(get_quota_usage('both-model', user_id='u1'), 1)
+        self.assertEqual(get_quota_usage('both-model'), 1)
+
+    def test_refused_reservation_is_passed_on(self):
+        consume_quota('both-model', user_id='u1')
+        with reserve_quota('both-model', user_id='u1') as granted:
+            self.assertFalse(granted)
+            self.assertFalse(consume_quota('both-model', user_id='u1'))
+        self.assertEqual(get_quota_usage('both-model', user_id='u1'), 1)
+
+    def test_unused_reservation_is_given_back(self):
+        with reserve_quota('both-model', user_id='u1'):
+            pass
+        self.assertEqual(get_quota_usage('both-model', user_id='u1'), 0)
+        self.assertEqual(get_quota_usage('both-model'), 0)
+
+    def test_other_quotas_are_not_served_by_the_reservation(self):
+        with reserve_quota('both-model', user_id='u1'):
+            self.assertTrue(consume_quota('both-model', user_id='u2'))
+            self.assertEqual(get_quota_usage('both-model'), 2)
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.ai_integration._create_completion', side_effect=RuntimeError("offline"))
+    def test_general_bot_quota_is_taken_outside_the_message_transaction(self, mock_completion, mock_send):
+        user = User.objects.create(user_id='quota_user', first_name='Quota', current_stage='GENERAL_BOT', exam_question_counter=-1)
+        depths = []
+        def record_depth(*args, **kwargs):
+            depths.append(len(connection.atomic_blocks))
+            return real_try_increment(*args, **kwargs)
+        real_try_increment = quotas._try_increment
+
+        outer_depth = len(connection.atomic_blocks)
+        with patch('chat.quotas._try_increment', side_effect=record_depth), self.assertLogs('chat.ai_integration', 'ERROR'):
+            process_messenger_message({'sender': {'id': user.user_id}, 'message': {'mid': 'm_quota', 'text': 'Hi'}})
+
+        # One increment per scope, both made before process_messenger_message opened its transaction
+        self.assertEqual(depths, [outer_depth, outer_depth])
+        self.assertEqual(get_quota_usage(GENERAL_BOT_QUOTA, user_id=user.user_id), 1)
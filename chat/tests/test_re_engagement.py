@@ -1,10 +1,12 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from unittest.mock import patch, MagicMock
 import unittest.mock as mock
 from datetime import datetime, timedelta
 from freezegun import freeze_time
-from chat.models import User, ChatLog # Import ChatLog as well
-from chat.tasks import check_inactive_users, process_messenger_message
+from chat.models import User, ChatLog, ReEngagementRun # Import ChatLog as well
+from chat.tasks import check_inactive_users, process_messenger_message, send_re_engagement_chunk, re_engage_user, _eligible_stage_index, purge_re_engagement_runs, RE_ENGAGEMENT_LEASE_NAME
+from chat.leases import acquire_lease
+from chat.utils import fetch_recent_chat_logs
 from django.conf import settings
 from django.utils import timezone # Import timezone utilities
 
@@ -13,6 +15,7 @@ settings.MESSENGER_VERIFY_TOKEN = 'test_verify_token'
 settings.OPEN_AI_TOKEN = 'test_openai_token'
 
 
+@override_settings(TASK_QUEUE_SYNC=True) # Run the per-chunk send tasks inline
 class TestReEngagementCron(TestCase):
     def setUp(self):
         self.fixed_now = timezone.make_aware(datetime(2025, 1, 1, 12, 0, 0)) # Fixed time for setUp
@@ -192,8 +195,7 @@ class TestReEngagementCron(TestCase):
     @patch('chat.tasks.send_messenger_message')
     @patch('chat.tasks.ChatLog.objects.create')
     @patch('chat.tasks.ai_integration_service.generate_re_engagement_message')
-    @patch('chat.models.User.objects.filter') # Patch User.objects.filter
-    def test_multi_stage_re_engagement_flow(self, mock_user_filter, mock_generate_message, mock_chat_log_create, mock_send_message):
+    def test_multi_stage_re_engagement_flow(self, mock_generate_message, mock_chat_log_create, mock_send_message):
         user = User.objects.create(
             user_id='multi_stage_user_1',
             first_name='MultiStage',
@@ -203,8 +205,8 @@ class TestReEngagementCron(TestCase):
             re_engagement_stage_index=0,
             last_re_engagement_message_sent_at=None
         )
-        # Configure the mock filter to return only our test user
-        mock_user_filter.return_value = [user] # Directly return the list of users
+        # Only our test user takes part in this flow
+        User.objects.exclude(pk=user.pk).delete()
 
         initial_interaction_time = user.last_interaction_timestamp
         
@@ -370,3 +372,213 @@ class TestReEngagementCron(TestCase):
         self.assertEqual(user.re_engagement_stage_index, 0) # Expect stage to reset to 0 because of new activity
         # Last interaction timestamp should be updated by process_messenger_message
         self.assertGreater(user.last_interaction_timestamp, initial_interaction_time + timedelta(days=2))
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='AI-composed re-engagement message!')
+    def test_check_inactive_users_marks_users_past_all_stages(self, mock_generate_message, mock_send_message):
+        self.active_user.last_interaction_timestamp = self.now - timedelta(hours=30)
+        self.active_user.save()
+
+        check_inactive_users()
+
+        # Past the last window: closed out without a message
+        self.active_user.refresh_from_db()
+        self.assertEqual(self.active_user.re_engagement_stage_index, 4)
+        self.assertIsNone(self.active_user.last_re_engagement_message_sent_at)
+        called_user_ids = [c.kwargs['user_id'] for c in mock_generate_message.call_args_list]
+        self.assertNotIn(self.active_user.user_id, called_user_ids)
+        # Mock exam users are never touched
+        self.inactive_user_mock_exam.refresh_from_db()
+        self.assertEqual(self.inactive_user_mock_exam.re_engagement_stage_index, 0)
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='AI-composed re-engagement message!')
+    def test_check_inactive_users_reads_only_due_users(self, mock_generate_message, mock_send_message):
+        # Many users that are not due for any stage
+        User.objects.bulk_create([
+            User(user_id=f'not_due_{i}', current_stage='GENERAL_BOT', last_interaction_timestamp=self.now - timedelta(hours=3), re_engagement_stage_index=1)
+            for i in range(20)
+        ])
+        loaded_user_ids = []
+        original_from_db = User.from_db.__func__
+
+        def counting_from_db(cls, db, field_names, values):
+            instance = original_from_db(cls, db, field_names, values)
+            loaded_user_ids.append(instance.user_id)
+            return instance
+
+        with patch.object(User, 'from_db', classmethod(counting_from_db)):
+            check_inactive_users()
+
+        self.assertCountEqual(loaded_user_ids, [self.inactive_user_general.user_id, self.inactive_user_marketing.user_id])
+        self.assertEqual(mock_send_message.call_count, 2)
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='AI-composed re-engagement message!')
+    def test_check_inactive_users_walks_due_users_in_batches(self, mock_generate_message, mock_send_message):
+        for i in range(5):
+            User.objects.create(user_id=f'due_{i}', current_stage='MARKETING', last_interaction_timestamp=self.now - timedelta(hours=1, minutes=30), re_engagement_stage_index=0)
+
+        with self.settings(RE_ENGAGEMENT_BATCH_SIZE=2):
+            check_inactive_users()
+
+        # 5 stage-1 users plus the 2 stage-4 users from setUp, each messaged exactly once
+        self.assertEqual(mock_send_message.call_count, 7)
+        self.assertEqual(User.objects.filter(user_id__startswith='due_', re_engagement_stage_index=1).count(), 5)
+
+    def test_next_due_at_follows_user_state(self):
+        # Stage 4 is next for this user: due 21 hours after the last interaction
+        self.assertEqual(self.inactive_user_general.re_engagement_next_due_at, self.now - timedelta(hours=21, minutes=30) + timedelta(hours=21))
+
+        # A new interaction restarts the schedule from stage 1
+        self.inactive_user_general.last_interaction_timestamp = self.now
+        self.inactive_user_general.re_engagement_stage_index = 0
+        self.inactive_user_general.save(update_fields=['last_interaction_timestamp', 're_engagement_stage_index'])
+        self.inactive_user_general.refresh_from_db()
+        self.assertEqual(self.inactive_user_general.re_engagement_next_due_at, self.now + timedelta(hours=1))
+
+        # Nothing is scheduled once all stages are sent, during a mock exam or before any interaction
+        self.inactive_user_general.re_engagement_stage_index = 4
+        self.inactive_user_general.save()
+        self.assertIsNone(self.inactive_user_general.re_engagement_next_due_at)
+        self.assertIsNone(self.inactive_user_mock_exam.re_engagement_next_due_at)
+        self.assertIsNone(self.user_no_timestamp.re_engagement_next_due_at)
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='AI-composed re-engagement message!')
+    def test_late_dispatch_skips_closed_window(self, mock_generate_message, mock_send_message):
+        # Stage 1 was due at 1 hour, but the dispatcher only runs at 3 hours
+        self.active_user.last_interaction_timestamp = self.now - timedelta(hours=3)
+        self.active_user.save()
+
+        check_inactive_users()
+
+        called_user_ids = [c.kwargs['user_id'] for c in mock_generate_message.call_args_list]
+        self.assertNotIn(self.active_user.user_id, called_user_ids)
+        self.active_user.refresh_from_db()
+        self.assertEqual(self.active_user.re_engagement_stage_index, 1)
+        self.assertEqual(self.active_user.re_engagement_next_due_at, self.now - timedelta(hours=3) + timedelta(hours=5))
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.enqueue_task')
+    def test_check_inactive_users_fans_out_chunks(self, mock_enqueue_task):
+        for i in range(3):
+            User.objects.create(user_id=f'due_{i}', current_stage='MARKETING', last_interaction_timestamp=self.now - timedelta(hours=1, minutes=30))
+
+        with self.settings(RE_ENGAGEMENT_CHUNK_SIZE=2):
+            check_inactive_users()
+
+        # 5 due users (3 + the 2 from setUp) in chunks of 2; nothing sent by the cron itself
+        run = ReEngagementRun.objects.get()
+        self.assertEqual(run.due_users, 5)
+        self.assertEqual(run.total_chunks, 3)
+        self.assertIsNone(run.finished_at)
+        self.assertEqual(mock_enqueue_task.call_count, 3)
+        chunked_user_ids = [user_id for c in mock_enqueue_task.call_args_list for user_id in c.args[2]]
+        self.assertCountEqual(chunked_user_ids, ['due_0', 'due_1', 'due_2', self.inactive_user_general.user_id, self.inactive_user_marketing.user_id])
+        self.assertEqual(mock_enqueue_task.call_args.kwargs['q_options']['group'], 're-engagement')
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.enqueue_task')
+    def test_chunks_are_enqueued_page_by_page(self, mock_enqueue_task):
+        for i in range(3):
+            User.objects.create(user_id=f'due_{i}', current_stage='MARKETING', last_interaction_timestamp=self.now - timedelta(hours=1, minutes=30))
+        runs_at_enqueue = []
+
+        def run_chunk_instantly(func, run_id, user_ids, q_options=None):
+            runs_at_enqueue.append(ReEngagementRun.objects.get(pk=run_id))
+            ReEngagementRun.record_chunk(run_id, skipped=len(user_ids))
+
+        mock_enqueue_task.side_effect = run_chunk_instantly
+        with self.settings(RE_ENGAGEMENT_BATCH_SIZE=2, RE_ENGAGEMENT_CHUNK_SIZE=2):
+            check_inactive_users()
+
+        # The first page is enqueued before the next is read, and chunks reporting back
+        # mid-dispatch don't close the run
+        self.assertEqual([run.due_users for run in runs_at_enqueue], [2, 4, 5])
+        self.assertTrue(all(run.finished_at is None for run in runs_at_enqueue))
+        run = ReEngagementRun.objects.get()
+        self.assertEqual((run.due_users, run.total_chunks, run.completed_chunks, run.skipped_count), (5, 3, 3, 5))
+        self.assertIsNotNone(run.finished_at)
+
+    def test_old_run_reports_are_purged(self):
+        with freeze_time('2025-01-01 12:00:00'):
+            ReEngagementRun.objects.create()
+        with freeze_time('2025-02-15 12:00:00'):
+            recent = ReEngagementRun.objects.create()
+            self.assertEqual(purge_re_engagement_runs(keep_days=30), 1)
+        self.assertEqual(list(ReEngagementRun.objects.all()), [recent])
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='AI-composed re-engagement message!')
+    def test_run_report_aggregates_chunk_outcomes(self, mock_generate_message, mock_send_message):
+        # The marketing user's send fails; the general user's still goes out
+        mock_send_message.side_effect = lambda user_id, message: self._fail_for(user_id, self.inactive_user_marketing.user_id)
+
+        check_inactive_users()
+
+        run = ReEngagementRun.objects.get()
+        self.assertEqual(run.due_users, 2)
+        self.assertEqual(run.sent_count, 1)
+        self.assertEqual(run.failed_count, 1)
+        self.assertEqual(run.completed_chunks, run.total_chunks)
+        self.assertIsNotNone(run.finished_at)
+        # The failed user stays due for the next run
+        self.inactive_user_marketing.refresh_from_db()
+        self.assertEqual(self.inactive_user_marketing.re_engagement_stage_index, 3)
+
+        # Already messaged users are skipped if a chunk runs again
+        send_re_engagement_chunk(run.pk, [self.inactive_user_general.user_id])
+        run.refresh_from_db()
+        self.assertEqual(run.skipped_count, 1)
+        self.assertEqual(mock_generate_message.call_count, 2)
+
+    def _fail_for(self, user_id, failing_user_id):
+        if user_id == failing_user_id:
+            raise Exception('Graph API error')
+        return True
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='AI-composed re-engagement message!')
+    def test_chunk_fetches_conversation_history_once(self, mock_generate_message, mock_send_message):
+        ChatLog.objects.create(user=self.inactive_user_general, sender_type='USER', message_content='Is the review online?')
+        ChatLog.objects.create(user=self.inactive_user_general, sender_type='SYSTEM_AI', message_content='Yes, it is!')
+
+        with patch('chat.conversation_cache.fetch_recent_chat_logs', wraps=fetch_recent_chat_logs) as mock_fetch:
+            send_re_engagement_chunk(ReEngagementRun.objects.create(total_chunks=1).pk, [self.inactive_user_general.user_id, self.inactive_user_marketing.user_id])
+
+        mock_fetch.assert_called_once()
+        histories = {c.kwargs['user_id']: c.kwargs['conversation_history'] for c in mock_generate_message.call_args_list}
+        self.assertEqual(histories[self.inactive_user_general.user_id], ['USER: Is the review online?', 'SYSTEM_AI: Yes, it is!'])
+        self.assertEqual(histories[self.inactive_user_marketing.user_id], [])
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.enqueue_task')
+    def test_overlapping_dispatch_is_skipped(self, mock_enqueue_task):
+        acquire_lease(RE_ENGAGEMENT_LEASE_NAME, 300) # A run still in progress elsewhere
+
+        check_inactive_users()
+
+        mock_enqueue_task.assert_not_called()
+        self.assertFalse(ReEngagementRun.objects.exists())
+
+    @freeze_time('2025-01-01 12:00:00')
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='AI-composed re-engagement message!')
+    def test_user_claimed_by_another_worker_is_not_messaged(self, mock_generate_message, mock_send_message):
+        # Another worker claims the stage between this worker's read and its claim
+        def claimed_elsewhere(hours_since_last_interaction, from_index=0):
+            User.objects.filter(user_id=self.inactive_user_general.user_id).update(re_engagement_stage_index=4, last_re_engagement_message_sent_at=self.now)
+            return _eligible_stage_index(hours_since_last_interaction, from_index)
+
+        with patch('chat.tasks._eligible_stage_index', side_effect=claimed_elsewhere):
+            self.assertFalse(re_engage_user(self.inactive_user_general.user_id))
+
+        mock_generate_message.assert_not_called()
+        mock_send_message.assert_not_called()
@@ -0,0 +1,132 @@
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from chat.models import User, ReEngagementDraft
+from chat.re_engagement_drafts import pregenerate_re_engagement_drafts, collect_re_engagement_drafts
+from chat.tasks import re_engage_user
+
+
+def completion(text):
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content=text))]
+    return response
+
+
+@freeze_time('2025-01-01 12:00:00')
+class ReEngagementDraftTest(TestCase):
+    def setUp(self):
+        self.now = timezone.make_aware(datetime(2025, 1, 1, 12, 0, 0))
+        # Stage 1 opens in 30 minutes
+        self.upcoming_user = User.objects.create(
+            user_id='upcoming_user', first_name='Upcoming', current_stage='MARKETING',
+            last_interaction_timestamp=self.now - timedelta(minutes=30),
+        )
+        # Stage 2 opens in 4 hours, beyond the lookahead
+        self.later_user = User.objects.create(
+            user_id='later_user', first_name='Later', current_stage='GENERAL_BOT',
+            last_interaction_timestamp=self.now - timedelta(hours=1, minutes=30), re_engagement_stage_index=1,
+        )
+
+    @override_settings(RE_ENGAGEMENT_BATCH_BACKEND='chat.batch_backends.LocalBatchBackend', RE_ENGAGEMENT_PREGENERATION_LOOKAHEAD_HOURS=3)
+    @patch('chat.batch_backends.openai.chat.completions.create', return_value=completion('We miss you, Upcoming!'))
+    def test_local_backend_generates_drafts_for_upcoming_users(self, mock_create):
+        self.assertEqual(pregenerate_re_engagement_drafts(), 1)
+
+        draft = ReEngagementDraft.objects.get()
+        self.assertEqual(draft.user, self.upcoming_user)
+        self.assertEqual(draft.stage_index, 0)
+        self.assertEqual(draft.status, 'READY')
+        self.assertEqual(draft.message, 'We miss you, Upcoming!')
+        mock_create.assert_called_once()
+
+        # Already drafted users are not requested again
+        self.assertEqual(pregenerate_re_engagement_drafts(), 0)
+        mock_create.assert_called_once()
+
+    @override_settings(RE_ENGAGEMENT_BATCH_BACKEND='chat.batch_backends.LocalBatchBackend', RE_ENGAGEMENT_PREGENERATION_MAX_BATCH=1)
+    @patch('chat.batch_backends.openai.chat.completions.create', return_value=completion('Still studying?'))
+    def test_drafted_users_do_not_count_against_the_batch_cap(self, mock_create):
+        # The earliest-due user's draft is still in a running batch
+        ReEngagementDraft.objects.create(user=self.upcoming_user, stage_index=0, based_on_interaction=self.upcoming_user.last_interaction_timestamp, batch_id='batch-1')
+        next_user = User.objects.create(user_id='next_user', first_name='Next', current_stage='MARKETING', last_interaction_timestamp=self.now - timedelta(minutes=20))
+
+        self.assertEqual(pregenerate_re_engagement_drafts(), 1)
+
+        self.assertEqual(ReEngagementDraft.objects.get(user=next_user).status, 'READY')
+
+    @override_settings(RE_ENGAGEMENT_BATCH_BACKEND='chat.batch_backends.LocalBatchBackend')
+    @patch('chat.batch_backends.openai.chat.completions.create', return_value=completion('We miss you, Upcoming!'))
+    def test_unsubmitted_drafts_are_requested_again(self, mock_create):
+        draft = ReEngagementDraft.objects.create(user=self.upcoming_user, stage_index=0, based_on_interaction=self.upcoming_user.last_interaction_timestamp)
+
+        # Possibly still being submitted by a run holding the lease
+        self.assertEqual(pregenerate_re_engagement_drafts(), 0)
+
+        # Left behind by a run that died before submitting it
+        ReEngagementDraft.objects.filter(pk=draft.pk).update(created_at=self.now - timedelta(hours=1))
+        self.assertEqual(pregenerate_re_engagement_drafts(), 1)
+        draft.refresh_from_db()
+        self.assertEqual((draft.status, draft.message), ('READY', 'We miss you, Upcoming!'))
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message')
+    def test_send_uses_ready_draft(self, mock_generate_message, mock_send_message):
+        draft = ReEngagementDraft.objects.create(
+            user=self.upcoming_user, stage_index=0, based_on_interaction=self.upcoming_user.last_interaction_timestamp,
+            status='READY', message='Pre-generated hello!',
+        )
+
+        with freeze_time(self.now + timedelta(hours=1)):
+            self.assertTrue(re_engage_user(self.upcoming_user.user_id))
+
+        mock_generate_message.assert_not_called()
+        mock_send_message.assert_called_once_with(self.upcoming_user.user_id, 'Pre-generated hello!')
+        draft.refresh_from_db()
+        self.assertEqual(draft.status, 'SENT')
+
+    @patch('chat.tasks.send_messenger_message')
+    @patch('chat.tasks.ai_integration_service.generate_re_engagement_message', return_value='Live message')
+    def test_draft_for_an_older_interaction_is_not_used(self, mock_generate_message, mock_send_message):
+        ReEngagementDraft.objects.create(
+            user=self.upcoming_user, stage_index=0, based_on_interaction=self.upcoming_user.last_interaction_timestamp - timedelta(days=1),
+            status='READY', message='Stale hello!',
+        )
+
+        with freeze_time(self.now + timedelta(hours=1)):
+            self.assertTrue(re_engage_user(self.upcoming_user.user_id))
+
+        mock_generate_message.assert_called_once()
+        mock_send_message.assert_called_once_with(self.upcoming_user.user_id, 'Live message')
+
+    @override_settings(RE_ENGAGEMENT_BATCH_BACKEND='chat.batch_backends.OpenAIBatchBackend')
+    @patch('chat.batch_backends.openai')
+    def test_openai_batch_backend_round_trip(self, mock_openai):
+        mock_openai.files.create.return_value = MagicMock(id='file-in')
+        mock_openai.batches.create.return_value = MagicMock(id='batch-1')
+
+        pregenerate_re_engagement_drafts()
+
+        draft = ReEngagementDraft.objects.get()
+        self.assertEqual(draft.status, 'PENDING')
+        self.assertEqual(draft.batch_id, 'batch-1')
+        submitted = mock_openai.files.create.call_args.kwargs['file'][1].getvalue().decode('utf-8')
+        self.assertEqual(json.loads(submitted)['custom_id'], str(draft.pk))
+
+        # Still running: nothing changes
+        mock_openai.batches.retrieve.return_value = MagicMock(status='in_progress')
+        collect_re_engagement_drafts()
+        draft.refresh_from_db()
+        self.assertEqual(draft.status, 'PENDING')
+
+        mock_openai.batches.retrieve.return_value = MagicMock(status='completed', output_file_id='file-out')
+        mock_openai.files.content.return_value = MagicMock(text=json.dumps({
+            'custom_id': str(draft.pk),
+            'response': {'body': {'choices': [{'message': {'content': ' Batch hello! '}}]}},
+        }))
+        collect_re_engagement_drafts()
+        draft.refresh_from_db()
+        self.assertEqual(draft.status, 'READY')
+        self.assertEqual(draft.message, 'Batch hello!')
@@ -0,0 +1,53 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from chat.models import User, ChatLog, ExamResult, Question, UserCategoryScore
+from chat.synthetic_data import generate_synthetic_data, delete_synthetic_data, SYNTHETIC_PREFIX
+
+
+class SyntheticDataTest(TestCase):
+    def test_generates_consistent_data(self):
+        totals = generate_synthetic_data(users=60, logs_per_user=6, questions=12, chunk_size=25, seed=3)
+
+        users = User.objects.filter(user_id__startswith=SYNTHETIC_PREFIX)
+        self.assertEqual(users.count(), 60)
+        self.assertEqual(ChatLog.objects.count(), totals['chat_logs'])
+        self.assertEqual(ExamResult.objects.count(), totals['exam_results'])
+        self.assertEqual(Question.objects.count(), 12)
+        # Generated timestamps are kept, not overwritten with the insert time
+        self.assertLess(ChatLog.objects.order_by('timestamp').first().timestamp, timezone.now() - timezone.timedelta(hours=1))
+        for user in users.filter(current_stage='MOCK_EXAM'):
+            self.assertIsNotNone(user.last_question_id_asked_id)
+            self.assertEqual(user.examresult_set.count(), user.exam_question_counter - 1)
+        for user in users:
+            self.assertEqual(user.re_engagement_next_due_at, user.compute_re_engagement_next_due_at())
+            latest_log = user.chatlog_set.order_by('-timestamp').first()
+            if latest_log:
+                self.assertEqual(latest_log.timestamp, user.last_interaction_timestamp)
+        # Aggregates match the generated results
+        score = UserCategoryScore.objects.first()
+        results = ExamResult.objects.filter(user_id=score.user_id, question__category=score.category)
+        self.assertEqual(score.result_count, results.count())
+        self.assertEqual(score.total_score, sum(result.score for result in results))
+
+    def test_delete_removes_only_synthetic_data(self):
+        User.objects.create(user_id='real_user')
+        generate_synthetic_data(users=10, logs_per_user=4, questions=5, seed=1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(delete_synthetic_data(batch_size=4), 10)
+
+        self.assertEqual(list(User.objects.values_list('user_id', flat=True)), ['real_user'])
+        self.assertFalse(ChatLog.objects.exists())
+        self.assertFalse(ExamResult.objects.exists())
+        self.assertFalse(UserCategoryScore.objects.exists())
+        self.assertFalse(Question.objects.exists())
+        # No per-result category score recompute was scheduled
+        self.assertEqual(callbacks, [])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('generate_synthetic_data', users=5, logs_per_user=2, questions=3, stages='{"GENERAL_BOT": 1}', stdout=out)
+        self.assertEqual(User.objects.filter(current_stage='GENERAL_BOT').count(), 5)
+        self.assertIn('Generated 5 users', out.getvalue())
@@ -3,8 +3,8 @@ from django.utils import timezone
 from unittest import mock
 from datetime import date, timedelta
 import datetime as dt # Import datetime as dt to avoid conflict with datetime.datetime
-from chat.models import User # Assuming User is in chat.models
-from chat.utils import reset_gpt_5_2_usage_if_new_day, generate_persuasion_messages # Import generate_persuasion_messages
+from chat.models import User, ChatLog # Assuming User is in chat.models
+from chat.utils import generate_persuasion_messages, fetch_recent_chat_logs
 from django.conf import settings # Import settings to access REVIEW_CENTER_WEBSITE_URL
 
 class GeneratePersuasionMessagesTest(TestCase):
@@ -76,43 +76,29 @@ class GeneratePersuasionMessagesTest(TestCase):
             self.assertIn(self.website_url, message)
             self.assertIn("access exclusive content and support", message.lower())
 
-class ResetGPT52UsageTest(TestCase):
-    def setUp(self):
-        # Create a user with initial values for testing resets
-        self.user = User.objects.create(
-            user_id='test_user_reset',
-            gpt_5_2_daily_count=5,
-            gpt_5_2_last_reset_date=date.today() - timedelta(days=1) # Set to yesterday initially
-        )
 
-    @mock.patch('django.utils.timezone.now')
-    def test_reset_on_new_day(self, mock_now):
-        # Simulate today being a new day (e.g., current date is different from last_reset_date)
-        mock_now.return_value = dt.datetime(2025, 1, 1, 10, 0, 0, tzinfo=dt.timezone.utc)
-        
-        # Manually set user's last reset date to a past date (e.g., Dec 31, 2024)
-        self.user.gpt_5_2_last_reset_date = date(2024, 12, 31)
-        self.user.gpt_5_2_daily_count = 10 # Set some count
-        self.user.save()
-
-        reset_gpt_5_2_usage_if_new_day(self.user)
-        self.user.refresh_from_db()
-
-        self.assertEqual(self.user.gpt_5_2_daily_count, 0)
-        self.assertEqual(self.user.gpt_5_2_last_reset_date, date(2025, 1, 1))
-
-    @mock.patch('django.utils.timezone.now')
-    def test_no_reset_on_same_day(self, mock_now):
-        # Simulate today being the same day as last_reset_date
-        mock_now.return_value = dt.datetime(2025, 1, 1, 10, 0, 0, tzinfo=dt.timezone.utc)
-        
-        # Manually set user's last reset date to today (Jan 1, 2025)
-        self.user.gpt_5_2_last_reset_date = date(2025, 1, 1)
-        self.user.gpt_5_2_daily_count = 7 # Set some count
-        self.user.save()
-
-        reset_gpt_5_2_usage_if_new_day(self.user)
-        self.user.refresh_from_db()
-
-        self.assertEqual(self.user.gpt_5_2_daily_count, 7) # Should remain 7
-        self.assertEqual(self.user.gpt_5_2_last_reset_date, date(2025, 1, 1))
\ No newline at end of file
+class FetchRecentChatLogsTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(user_id='alice')
+        self.bob = User.objects.create(user_id='bob')
+        self.carol = User.objects.create(user_id='carol')
+        start = timezone.now() - timedelta(hours=1)
+        for i in range(7):
+            log = ChatLog.objects.create(user=self.alice, sender_type='USER', message_content=f'alice {i}')
+            ChatLog.objects.filter(pk=log.pk).update(timestamp=start + timedelta(minutes=i))
+        for i in range(2):
+            log = ChatLog.objects.create(user=self.bob, sender_type='SYSTEM_AI', message_content=f'bob {i}')
+            ChatLog.objects.filter(pk=log.pk).update(timestamp=start + timedelta(minutes=i))
+
+    def test_latest_logs_per_user_in_one_query(self):
+        with self.assertNumQueries(1):
+            recent_logs = fetch_recent_chat_logs(['alice', 'bob', 'carol'], limit=5)
+
+        # Latest 5, oldest first
+        self.assertEqual([log.message_content for log in recent_logs['alice']], ['alice 2', 'alice 3', 'alice 4', 'alice 5', 'alice 6'])
+        self.assertEqual([log.message_content for log in recent_logs['bob']], ['bob 0', 'bob 1'])
+        self.assertEqual(recent_logs['carol'], [])
+
+    def test_empty_user_list_skips_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(fetch_recent_chat_logs([]), {})
@@ -3,6 +3,8 @@ from unittest import mock
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.conf import settings
+from chat.quotas import purge_quota_counters
+from chat.tasks import purge_re_engagement_runs
 
 class WebhookCallbackTest(TestCase):
     def setUp(self):
@@ -196,3 +198,13 @@ class WebhookCallbackTest(TestCase):
             # the functional dependency (message from get_random_loading_message used in send_messenger_message)
             # and the linear nature of the code in views.py is sufficient to verify the order.
             
+
+
+class CronDispatchTest(TestCase):
+    @mock.patch('chat.views.enqueue_task')
+    def test_dispatch_purges_old_quota_counters_and_run_reports(self, mock_enqueue_task):
+        response = Client().post(reverse('chat:cron_dispatch'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(mock.call(purge_quota_counters), mock_enqueue_task.call_args_list)
+        self.assertIn(mock.call(purge_re_engagement_runs), mock_enqueue_task.call_args_list)
@@ -1,8 +1,9 @@
 import random
 import logging
 from django.conf import settings # Import settings
-from .models import Question, User # Added import for Question model, User model for GPT-5.2 usage tracking
-from django.utils import timezone # Added import for timezone
+from .models import Question, ChatLog # Added import for Question model
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 import chat.prompts # Import for LOADING_MESSAGES
 
 logger = logging.getLogger(__name__)
@@ -20,8 +21,10 @@ def get_random_exam_question():
         expected_answer__exact=''
     )
 
-    if questions.exists():
-        return random.choice(questions)
+    # Pick by offset so only the chosen row is loaded, not the whole question bank
+    count = questions.count()
+    if count:
+        return questions.order_by('pk')[random.randrange(count)]
 
     logger.warning("No valid exam questions found with complete data (expected_answer).")
     return None
@@ -32,6 +35,41 @@ def get_random_loading_message() -> str:
     """
     return random.choice(chat.prompts.LOADING_MESSAGES)
 
+# Cache backends that keep their data inside each process
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+def cache_is_shared():
+    """Whether the default cache is shared by every process (e.g., Redis), rather than per-process memory."""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', PROCESS_LOCAL_CACHE_BACKENDS[0])
+    return backend not in PROCESS_LOCAL_CACHE_BACKENDS
+
+def fetch_recent_chat_logs(user_ids, limit=5):
+    """
+    Returns the latest `limit` ChatLogs of each user in one query, as
+    {user_id: [ChatLog, ...]} in chronological order (users without logs map to []).
+    Uses ROW_NUMBER() partitioned by user, so it needs window function support
+    (MySQL 8+, SQLite 3.25+).
+    """
+    user_ids = list(user_ids)
+    recent_logs = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return recent_logs
+
+    logs = ChatLog.objects.filter(user_id__in=user_ids).annotate(
+        recency_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('timestamp').desc(), F('id').desc()],
+        )
+    ).filter(recency_rank__lte=limit).order_by('user_id', 'timestamp', 'id')
+
+    for log in logs:
+        recent_logs[log.user_id].append(log)
+    return recent_logs
+
 def generate_persuasion_messages(user, context):
     """
     Generates persuasion messages based on user registration status and context.
@@ -64,54 +102,99 @@ def generate_persuasion_messages(user, context):
 from django.core.cache import cache
 from .models import Prompt
 import chat.prompts # Import the module containing fallback prompts
+import threading
+import time
+import uuid
+
+# Shared (cross-process) version of the prompt table. Any Prompt save/delete replaces it,
+# which makes every process reload its local snapshot on the next check.
+PROMPT_SNAPSHOT_VERSION_KEY = "prompt:snapshot_version"
+
+_prompt_snapshot = {
+    'prompts': None,     # {(category, name): text_content}, None until first load
+    'version': None,     # Shared version the snapshot was loaded at
+    'checked_at': 0.0,   # time.monotonic() of the last shared version check
+    'loaded_at': 0.0,    # time.monotonic() of the last load
+}
+_prompt_snapshot_lock = threading.Lock()
+
+def _load_prompt_snapshot(version):
+    """Loads every prompt in a single query and installs it as this process's snapshot."""
+    prompts = {
+        (category, name): text_content
+        for category, name, text_content in Prompt.objects.values_list('category', 'name', 'text_content')
+    }
+    _prompt_snapshot['prompts'] = prompts
+    _prompt_snapshot['version'] = version
+    _prompt_snapshot['checked_at'] = _prompt_snapshot['loaded_at'] = time.monotonic()
+    logger.info(f"Loaded prompt snapshot with {len(prompts)} prompt(s) at version {version}.")
+    return prompts
+
+def _prompt_snapshot_max_age():
+    """
+    Seconds after which the snapshot is reloaded whatever the shared version says:
+    settings.PROMPT_SNAPSHOT_MAX_AGE, by default unlimited with a shared cache and 60
+    otherwise, since a per-process cache never sees another process's version bump.
+    """
+    max_age = getattr(settings, 'PROMPT_SNAPSHOT_MAX_AGE', None)
+    if max_age is None and not cache_is_shared():
+        return 60
+    return max_age
+
+def get_prompt_snapshot() -> dict:
+    """
+    Returns this process's prompt snapshot, reloading it when another process has
+    bumped the shared version or when it is older than the maximum age. The shared
+    version is checked at most once every PROMPT_SNAPSHOT_CHECK_INTERVAL seconds,
+    so most lookups are a plain dict hit.
+    """
+    prompts = _prompt_snapshot['prompts']
+    check_interval = getattr(settings, 'PROMPT_SNAPSHOT_CHECK_INTERVAL', 5)
+    max_age = _prompt_snapshot_max_age()
+    now = time.monotonic()
+    expired = max_age is not None and now - _prompt_snapshot['loaded_at'] >= max_age
+    if prompts is not None and not expired and now - _prompt_snapshot['checked_at'] < check_interval:
+        return prompts
+
+    with _prompt_snapshot_lock:
+        shared_version = cache.get(PROMPT_SNAPSHOT_VERSION_KEY)
+        expired = max_age is not None and time.monotonic() - _prompt_snapshot['loaded_at'] >= max_age
+        if _prompt_snapshot['prompts'] is None or expired or shared_version != _prompt_snapshot['version']:
+            return _load_prompt_snapshot(shared_version)
+        _prompt_snapshot['checked_at'] = time.monotonic()
+        return _prompt_snapshot['prompts']
+
+def invalidate_prompt_snapshot():
+    """
+    Bumps the shared prompt version and drops the local snapshot. Called whenever a Prompt
+    is saved or deleted (see chat.signals); other processes reload on their next check.
+    """
+    cache.set(PROMPT_SNAPSHOT_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    with _prompt_snapshot_lock:
+        _prompt_snapshot['prompts'] = None
+        _prompt_snapshot['version'] = None
 
 def get_prompt(name: str, category: str, use_fallback: bool = True) -> str:
     """
-    Retrieves a prompt, prioritizing the database, then cache, then falling back to code.
+    Retrieves a prompt from the process-wide snapshot of the database, falling back to code.
     Args:
         name (str): The unique name of the prompt (e.g., 'QUICK_REPLY_SYSTEM_PROMPT').
         category (str): The category of the prompt (e.g., 'QUICK_REPLY').
-        use_fallback (bool): Whether to use the hardcoded prompts as a fallback if not found in DB/cache.
+        use_fallback (bool): Whether to use the hardcoded prompts as a fallback if not found in the database.
 
     Returns:
         str: The content of the prompt.
 
     Raises:
-        ValueError: If the prompt is not found in the database, cache, or code fallback.
+        ValueError: If the prompt is not found in the database or code fallback.
     """
-    cache_key = f"prompt:{category}:{name}"
-    prompt_content = cache.get(cache_key)
-
+    prompt_content = get_prompt_snapshot().get((category, name))
     if prompt_content is not None:
         return prompt_content
 
-    try:
-        db_prompt = Prompt.objects.get(name=name, category=category)
-        prompt_content = db_prompt.text_content
-        cache.set(cache_key, prompt_content, timeout=3600)  # Cache for 1 hour
-        return prompt_content
-    except Prompt.DoesNotExist:
-        logger.warning(f"Prompt '{name}' (Category: {category}) not found in database. Attempting code fallback.")
-        if use_fallback:
-            try:
-                # Attempt to get from chat.prompts module
-                prompt_content = getattr(chat.prompts, name)
-                cache.set(cache_key, prompt_content, timeout=3600)  # Cache for 1 hour
-                return prompt_content
-            except AttributeError:
-                pass # Fall through to ValueError
-        raise ValueError(f"Prompt '{name}' (Category: {category}) not found in database or code fallback.")
-
-def reset_gpt_5_2_usage_if_new_day(user: User):
-    """
-    Resets the user's gpt_5_2_daily_count if a new UTC day has started.
-    """
-    today_utc = timezone.now().date()
-    if user.gpt_5_2_last_reset_date != today_utc:
-        user.gpt_5_2_daily_count = 0
-        user.gpt_5_2_last_reset_date = today_utc
-        user.save()
-        logger.info(f"User {user.user_id}: GPT-5.2 daily count reset for a new day.")
-
-
-
+    logger.debug(f"Prompt '{name}' (Category: {category}) not found in database. Attempting code fallback.")
+    if use_fallback:
+        prompt_content = getattr(chat.prompts, name, None)
+        if prompt_content is not None:
+            return prompt_content
+    raise ValueError(f"Prompt '{name}' (Category: {category}) not found in database or code fallback.")
@@ -7,6 +7,10 @@ from django.conf import settings
 from chat.task_queue import enqueue_task # NEW: Import enqueue_task
 from chat.tasks import process_messenger_message # NEW: Import process_messenger_message as a regular function
 from chat.tasks import check_inactive_users # NOW: Import check_inactive_users as a regular function
+from chat.tasks import recover_exam_feedback, purge_re_engagement_runs
+from chat.re_engagement_drafts import collect_re_engagement_drafts, pregenerate_re_engagement_drafts
+from chat.chat_log_archive import archive_chat_logs
+from chat.quotas import purge_quota_counters
 from chat.messenger_api import send_sender_action, send_messenger_message # NEW: Import send_sender_action and send_messenger_message
 from .models import ChatLog, User
 from chat.utils import get_random_loading_message # NEW: Import get_random_loading_message
@@ -69,6 +73,14 @@ def cron_dispatch(request):
         # to Celery based on the internal logic.
         logger.info("Cron dispatch URL hit. Acknowledging request.")
         enqueue_task(check_inactive_users) # NOW: Enqueue check_inactive_users as a regular function
+        if getattr(settings, 'RE_ENGAGEMENT_PREGENERATION', False):
+            enqueue_task(collect_re_engagement_drafts)
+            enqueue_task(pregenerate_re_engagement_drafts)
+        if getattr(settings, 'CHAT_LOG_ARCHIVAL', False):
+            enqueue_task(archive_chat_logs)
+        enqueue_task(purge_quota_counters)
+        enqueue_task(purge_re_engagement_runs)
+        enqueue_task(recover_exam_feedback)
         return JsonResponse({"status": "cron_dispatch_received", "message": "Cron job request acknowledged and inactive user check initiated."}, status=200)
     logger.warning(f"Cron dispatch URL received unsupported method: {request.method}")
     return HttpResponse('Method Not Allowed', status=405)
@@ -95,9 +95,23 @@ FACEBOOK_PAGE_ACCESS_TOKEN = os.getenv('FACEBOOK_PAGE_ACCESS_TOKEN')
 MESSENGER_VERIFY_TOKEN = os.getenv('MESSENGER_VERIFY_TOKEN')
 OPEN_AI_TOKEN = os.getenv('OPEN_AI_TOKEN')
 FACEBOOK_APP_ID = os.getenv('FACEBOOK_APP_ID') # Required for differentiating bot echoes from admin messages
+# Send API endpoint; point it at `manage.py run_fake_graph_api` for local load tests
+FACEBOOK_GRAPH_API_URL = os.getenv('FACEBOOK_GRAPH_API_URL', 'https://graph.facebook.com/v24.0/me/messages')
 
 # Custom Settings
 REVIEW_CENTER_WEBSITE_URL = "https://premierebarreview.com/"
+# When enabled, mock exam answers are graded in a background task and the next question is sent immediately
+MOCK_EXAM_PIPELINED_GRADING = os.getenv('MOCK_EXAM_PIPELINED_GRADING', 'False').lower() == 'true'
+# A submission still being graded after this long is graded again (from cron_dispatch or the next delivery)
+EXAM_GRADING_TIMEOUT_SECONDS = int(os.getenv('EXAM_GRADING_TIMEOUT_SECONDS', '300'))
+# Per-user lease held while exam feedback is sent, renewed for every submission
+EXAM_FEEDBACK_LEASE_SECONDS = int(os.getenv('EXAM_FEEDBACK_LEASE_SECONDS', '120'))
+# Daily AI model quotas per UTC day. 'per_user' and 'global' limits are optional (None means unlimited, 0 disables the model).
+AI_MODEL_QUOTAS = {
+    'gpt-5.2': {'per_user': 10, 'global': None},
+}
+# Days of quota counters kept; older ones are purged from cron_dispatch
+QUOTA_COUNTER_KEEP_DAYS = 30
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
@@ -114,7 +128,86 @@ DATABASES = {
 }
 
 
+# Cache
+# Cross-process features (prompt snapshot invalidation, shared counters) need a shared backend.
+# Set REDIS_URL in production; without it Django's per-process local-memory cache is used.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
 
+# Recent conversation kept per user in the cache (chat.conversation_cache); must exceed the
+# 21 unsummarized messages that trigger summarization so that check is answered from the cache
+CONVERSATION_RING_SIZE = int(os.getenv('CONVERSATION_RING_SIZE', '24'))
+CONVERSATION_RING_TTL = int(os.getenv('CONVERSATION_RING_TTL', '86400'))
+# The rings are only used with a shared cache (REDIS_URL): with the per-process local-memory
+# cache every worker would serve its own stale ring. Set to force them on or off.
+if os.getenv('CONVERSATION_RING_ENABLED'):
+    CONVERSATION_RING_ENABLED = os.getenv('CONVERSATION_RING_ENABLED').lower() == 'true'
+
+# Seconds between checks of the shared prompt version (see chat.utils.get_prompt_snapshot)
+PROMPT_SNAPSHOT_CHECK_INTERVAL = int(os.getenv('PROMPT_SNAPSHOT_CHECK_INTERVAL', '5'))
+# Seconds after which a process reloads its prompt snapshot regardless of the shared version. Without
+# a shared cache (REDIS_URL) version bumps from other processes are never seen, so it defaults to 60 there.
+if os.getenv('PROMPT_SNAPSHOT_MAX_AGE'):
+    PROMPT_SNAPSHOT_MAX_AGE = int(os.getenv('PROMPT_SNAPSHOT_MAX_AGE'))
+
+# LLM used by chat.ai_integration: chat.llm_backends.OpenAIBackend, or chat.llm_backends.SimulatedLLMBackend
+# for offline load tests (tuned through LLM_SIMULATION, see chat.llm_backends.DEFAULT_SIMULATION)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'chat.llm_backends.OpenAIBackend')
+LLM_SIMULATION = {}
+
+# Token budgets for the conversation context packed into prompts, per call type (see chat.context_builder,
+# merged over DEFAULT_CONTEXT_BUDGETS). Token counts use tiktoken when it's installed, else a 4-chars-per-token estimate.
+LLM_CONTEXT_BUDGETS = {}
+
+# Send a prompt_cache_key (per call type and stable prompt prefix, see chat.prompt_layout) with every completion
+# so repeated prefixes hit the upstream prompt cache. Prefixes can be redeclared per call type in LLM_PROMPT_PREFIXES.
+LLM_PROMPT_CACHE_KEYS = os.getenv('LLM_PROMPT_CACHE_KEYS', 'True').lower() == 'true'
+LLM_PROMPT_PREFIXES = {}
+
+# Seconds an OpenAI completion is shared through the cache with identical requests from other
+# processes (0 = only coalesce requests that are in flight at the same time, see chat.ai_integration)
+LLM_SINGLEFLIGHT_CACHE_TTL = int(os.getenv('LLM_SINGLEFLIGHT_CACHE_TTL', '0'))
+# Seconds a caller waits on an identical in-flight request before making its own upstream call
+LLM_SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv('LLM_SINGLEFLIGHT_WAIT_SECONDS', '30'))
+
+# Seconds a recipient's Messenger reachability is cached per process (see chat.messenger_api)
+MESSENGER_REACHABILITY_CACHE_TTL = int(os.getenv('MESSENGER_REACHABILITY_CACHE_TTL', '60'))
+MESSENGER_REACHABILITY_CACHE_SIZE = int(os.getenv('MESSENGER_REACHABILITY_CACHE_SIZE', '10000')) # Recipients kept per process (LRU)
+
+# Number of due users read per keyset page by the re-engagement cron (see chat.tasks.check_inactive_users)
+RE_ENGAGEMENT_BATCH_SIZE = int(os.getenv('RE_ENGAGEMENT_BATCH_SIZE', '500'))
+# Due users per send_re_engagement_chunk task
+RE_ENGAGEMENT_CHUNK_SIZE = int(os.getenv('RE_ENGAGEMENT_CHUNK_SIZE', '10'))
+# Optional Django Q cluster (see ALT_CLUSTERS in the django-q2 docs) dedicated to re-engagement sends
+RE_ENGAGEMENT_CLUSTER = os.getenv('RE_ENGAGEMENT_CLUSTER') or None
+# Upper bound on one re-engagement scan; an overlapping dispatch is skipped while the lease is held
+RE_ENGAGEMENT_LEASE_SECONDS = int(os.getenv('RE_ENGAGEMENT_LEASE_SECONDS', '300'))
+# Days of ReEngagementRun reports kept; older ones are purged from cron_dispatch
+RE_ENGAGEMENT_RUN_KEEP_DAYS = int(os.getenv('RE_ENGAGEMENT_RUN_KEEP_DAYS', '30'))
+# When enabled, cron_dispatch also pre-generates re-engagement messages for users due within the lookahead
+RE_ENGAGEMENT_PREGENERATION = os.getenv('RE_ENGAGEMENT_PREGENERATION', 'False').lower() == 'true'
+RE_ENGAGEMENT_PREGENERATION_LOOKAHEAD_HOURS = int(os.getenv('RE_ENGAGEMENT_PREGENERATION_LOOKAHEAD_HOURS', '3'))
+RE_ENGAGEMENT_PREGENERATION_MAX_BATCH = int(os.getenv('RE_ENGAGEMENT_PREGENERATION_MAX_BATCH', '1000'))
+RE_ENGAGEMENT_DRAFT_RETENTION_HOURS = int(os.getenv('RE_ENGAGEMENT_DRAFT_RETENTION_HOURS', '48'))
+# Bulk generation backend: chat.batch_backends.OpenAIBatchBackend (Batch API) or chat.batch_backends.LocalBatchBackend
+RE_ENGAGEMENT_BATCH_BACKEND = os.getenv('RE_ENGAGEMENT_BATCH_BACKEND', 'chat.batch_backends.OpenAIBatchBackend')
+
+# Run enqueued tasks inline instead of through Django Q (see chat.task_queue.enqueue_task)
+TASK_QUEUE_SYNC = os.getenv('TASK_QUEUE_SYNC', 'False').lower() == 'true'
+
+# Chat log archival (chat.chat_log_archive): summarized logs move to compressed ChatLogArchive chunks
+CHAT_LOG_ARCHIVAL = os.getenv('CHAT_LOG_ARCHIVAL', 'False').lower() == 'true' # Run it from cron_dispatch
+CHAT_LOG_ARCHIVE_CODEC = os.getenv('CHAT_LOG_ARCHIVE_CODEC', 'gzip') # 'gzip', or 'zstd' with the zstandard package installed
+# Also archive logs older than this many days, summarized or not (unset to only archive summarized logs)
+CHAT_LOG_ARCHIVE_AFTER_DAYS = int(os.getenv('CHAT_LOG_ARCHIVE_AFTER_DAYS')) if os.getenv('CHAT_LOG_ARCHIVE_AFTER_DAYS') else None
+CHAT_LOG_ARCHIVE_KEEP_LATEST = int(os.getenv('CHAT_LOG_ARCHIVE_KEEP_LATEST', '20')) # Most recent logs per user that always stay hot
+CHAT_LOG_ARCHIVE_BATCH_USERS = int(os.getenv('CHAT_LOG_ARCHIVE_BATCH_USERS', '200')) # Users per archive_chat_log_batch task
+CHAT_LOG_ARCHIVE_LEASE_SECONDS = int(os.getenv('CHAT_LOG_ARCHIVE_LEASE_SECONDS', '900'))
 
 
 AUTH_PASSWORD_VALIDATORS = [